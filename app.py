@@ -13,6 +13,8 @@ from amin import layout as amin_layout, register_callbacks as amin_callbacks
 from get_awp_dash import layout as awp_layout, register_callbacks as awp_callbacks
 from mohre_application_status import layout as mohre_layout, register_callbacks as mohre_callbacks
 from combined_stats_table import layout as stats_layout, register_callbacks as stats_callbacks
+from priority_api import register_routes as register_priority_api
+from report_artifacts import register_routes as register_report_downloads
 # Add other apps as needed
 
 app = dash.Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP])
@@ -106,6 +108,10 @@ awp_callbacks(app)
 mohre_callbacks(app)
 amin_callbacks(app)
 
+# HTTP endpoints served alongside the pages
+register_priority_api(server)
+register_report_downloads(server)
+
 
 if __name__ == '__main__':
     app.run_server(debug=True)
@@ -0,0 +1,158 @@
+"""Benchmark the prioritization pipeline on synthetic exports.
+
+    python benchmark_priorities.py --rows 1000 10000 100000 1000000
+
+For each size it reports wall time, peak traced memory and rows/sec of the
+parse, prioritize, stats and Excel write stages, and checks the vectorized
+priorities against the row-wise assign_priority reference. With
+--engines pandas duckdb polars the prioritize stage is also timed on the
+DuckDB and Polars engines and their sheets compared with the pandas ones.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import pandas as pd
+
+from priority_engine import assign_priority, evaluate_rules, read_typed_export, slice_priorities, priority_names as get_priority_names
+from priority_reports import (DEFAULT_COUNTERS, DEFAULT_PARAMS, DEFAULT_THRESHOLDS, EXPORT_COLUMNS, OUTPUT_COLUMNS, REPORT_TYPES,
+                              add_rule_names, calculate_statistics, prepare_report_frame, prioritize_report_rows, write_report_file)
+from synthetic_export import export_bytes, generate_export
+from upload_cache import read_export
+
+STAGES = ['parse', 'prioritize', 'stats', 'excel']
+
+
+def measure(stage, rows, results, trace_memory, func, *args):
+    """Run func, recording its wall time and peak traced memory under stage.
+
+    tracemalloc slows allocation-heavy stages (the Excel writer most of all)
+    several times over, so the memory is taken from a second, traced run.
+    """
+    start = time.perf_counter()
+    value = func(*args)
+    elapsed = time.perf_counter() - start
+    result = {'rows': rows, 'stage': stage, 'seconds': elapsed, 'rows/sec': rows / elapsed if elapsed else float('inf')}
+    if trace_memory:
+        tracemalloc.start()
+        func(*args)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        result['peak MiB'] = peak / 2 ** 20
+    results.append(result)
+    return value
+
+
+def prioritize(df, params, engine='pandas'):
+    """The Combined report's prioritization: rule evaluation plus the accepted, rejected and combined sheets.
+
+    Returns (sheets, non_african) like prioritize_report.
+    """
+    priority_names = get_priority_names(params)
+    sheet_counters = [DEFAULT_COUNTERS.copy() for _ in range(3)]
+    if engine in ('duckdb', 'polars'):
+        if engine == 'duckdb':
+            from priority_duckdb import prioritize_report_rows_duckdb as prioritize_rows
+        else:
+            from priority_polars import prioritize_report_rows_polars as prioritize_rows
+        sheets, _, non_african = prioritize_rows(df, REPORT_TYPES['combined'], 'Combined', sheet_counters, DEFAULT_THRESHOLDS,
+                                                 params, priority_names, EXPORT_COLUMNS, OUTPUT_COLUMNS)
+        sheets = add_rule_names(sheets, priority_names)
+    else:
+        sheets, _, non_african = prioritize_report_rows(df, REPORT_TYPES['combined'], 'Combined', sheet_counters, DEFAULT_THRESHOLDS,
+                                                        params, priority_names)
+    return sheets, non_african
+
+
+def statistics(sheets, params):
+    priority_names = get_priority_names(params)
+    return [calculate_statistics(sheet, priority_names) for sheet in sheets]
+
+
+def write_excel(sheets, non_african):
+    """Write the Combined report workbook as the app does, streamed to a temporary file; returns its size."""
+    with tempfile.TemporaryDirectory() as directory:
+        path = write_report_file(REPORT_TYPES['combined'], sheets, non_african, os.path.join(directory, 'report.xlsx'))
+        return os.path.getsize(path)
+
+
+def check_parity(decoded, filename, rows, params):
+    """Compare the vectorized priorities of the first rows against the row-wise reference.
+
+    Both run over the approved and rejected rows in file order with fresh
+    counters, as the Combined sheet does. Returns the number of mismatches.
+    """
+    raw = read_export(decoded, filename).head(rows)
+    df = read_typed_export(decoded, filename).head(rows)
+    _, is_approved, is_rejected = prepare_report_frame(df)
+    selection = is_approved | is_rejected
+
+    vectorized = slice_priorities(evaluate_rules(df, params), selection, DEFAULT_COUNTERS.copy(), DEFAULT_THRESHOLDS)
+    counters = DEFAULT_COUNTERS.copy()
+    reference = raw[selection].apply(
+        lambda row: assign_priority(row, counters, DEFAULT_THRESHOLDS, params['mv_urgency_days'], params['last_day_in_country']),
+        axis=1)
+    return int((reference.to_numpy() != vectorized).sum())
+
+
+def same_sheets(expected, actual):
+    """Whether two engines produced the same sheets, ignoring dtypes (categorical vs text, int8 vs float)."""
+    return all(len(a) == len(b) and (a.index == b.index).all() and
+               all((a[column].astype(object).where(a[column].notna(), None).tolist() ==
+                    b[column].astype(object).where(b[column].notna(), None).tolist())
+                   or a[column].astype(float).equals(b[column].astype(float)) for column in a.columns)
+               for a, b in zip(expected, actual))
+
+
+def run(rows, file_format, stages, parity_rows, seed, trace_memory, engines=('pandas',)):
+    results = []
+    params = dict(DEFAULT_PARAMS)
+    filename = f"export.{file_format}"
+    decoded = export_bytes(generate_export(rows, seed), file_format)
+
+    df = measure('parse', rows, results, trace_memory, read_typed_export, decoded, filename, EXPORT_COLUMNS)
+    sheets, non_african = measure('prioritize', rows, results, trace_memory, prioritize, df, params)
+    for engine in engines:
+        if engine != 'pandas':
+            engine_sheets, _ = measure(f'prioritize ({engine})', rows, results, trace_memory, prioritize, df, params, engine)
+            results[-1]['matches pandas'] = same_sheets(sheets, engine_sheets)
+    if 'stats' in stages:
+        measure('stats', rows, results, trace_memory, statistics, sheets, params)
+    if 'excel' in stages:
+        measure('excel', rows, results, trace_memory, write_excel, sheets, non_african)
+
+    mismatches = check_parity(decoded, filename, min(rows, parity_rows), params) if parity_rows else None
+    return [r for r in results if r['stage'].split(' ')[0] in stages], mismatches
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the prioritization pipeline on synthetic exports.")
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 10000, 100000, 1000000])
+    parser.add_argument('--format', dest='file_format', choices=['csv', 'xlsx'], default='csv',
+                        help="Upload format to parse (xlsx is much slower to generate and read)")
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=STAGES)
+    parser.add_argument('--parity-rows', type=int, default=20000,
+                        help="Rows checked against the row-wise reference per size (0 to skip)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--engines', nargs='+', choices=['pandas', 'duckdb', 'polars'], default=['pandas'],
+                        help="Engines to time for the prioritize stage; others are compared against pandas")
+    parser.add_argument('--no-memory', dest='trace_memory', action='store_false',
+                        help="Skip the traced second run of each stage that measures peak memory")
+    args = parser.parse_args(argv)
+
+    failed = False
+    for rows in args.rows:
+        results, mismatches = run(rows, args.file_format, args.stages, args.parity_rows, args.seed, args.trace_memory, args.engines)
+        print(pd.DataFrame(results).to_string(index=False, float_format=lambda x: f"{x:,.3f}"))
+        if mismatches is not None:
+            print(f"parity: {mismatches} mismatched priorities in the first {min(rows, args.parity_rows)} rows")
+            failed = failed or mismatches > 0
+        print()
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -4,7 +4,8 @@ import dash
 from dash import dcc, html, Input, Output, State, dash_table, callback_context
 import dash_bootstrap_components as dbc
 import pandas as pd
-from priorities import african_countries
+from priority_engine import african_countries
+from upload_cache import MissingColumnsError, check_columns, select_columns
 
 app = dash.Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP])
 
@@ -54,15 +55,19 @@ app.layout = dbc.Container([
 ], fluid=True)
 layout = app.layout
 
+# Columns the breakdown reads from the 'Combined' sheet; the rest is never parsed
+REQUIRED_COLUMNS = ['Priority number', 'Housemaid Type', 'Housemaid Nationality', 'Docs status']
+
 def register_callbacks(app):
     def parse_and_filter_data(contents, filename, mv_urgency_days, last_day_in_country):
         content_type, content_string = contents.split(',')
         decoded = base64.b64decode(content_string)
 
         try:
-            df = pd.read_excel(io.BytesIO(decoded), sheet_name='Combined')
+            df = pd.read_excel(io.BytesIO(decoded), sheet_name='Combined', usecols=select_columns(REQUIRED_COLUMNS))
         except ValueError:
-            df = pd.read_excel(io.BytesIO(decoded), sheet_name=0)
+            df = pd.read_excel(io.BytesIO(decoded), sheet_name=0, usecols=select_columns(REQUIRED_COLUMNS))
+        check_columns(df, REQUIRED_COLUMNS)
 
         if df is None:
             return None, None
@@ -123,7 +128,10 @@ def register_callbacks(app):
             mv_urgency_days = 7
             last_day_in_country = 10
             
-            df, stats = parse_and_filter_data(contents, filename, mv_urgency_days, last_day_in_country)
+            try:
+                df, stats = parse_and_filter_data(contents, filename, mv_urgency_days, last_day_in_country)
+            except MissingColumnsError as e:
+                return [], [], str(e), [], [], [], ""
             if stats is None:
                 return [], [], "Failed to process file. Please check the format.", [], [], [], ""
 
@@ -9,6 +9,7 @@ from googleapiclient.discovery import build
 import re
 import os
 import json
+from upload_cache import MissingColumnsError, check_columns, select_columns
 
 # Initialize the Dash app with Bootstrap styling
 app = dash.Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP])
@@ -108,6 +109,9 @@ app.layout = dbc.Container([
     dcc.Store(id='links-remote-undo-store', data=[]),
 ], fluid=True, className="px-4 py-5 bg-light")
 layout = app.layout
+# Columns the distribution reads from an upload; the rest of a wide export is never parsed
+REQUIRED_COLUMNS = ['Login link']
+
 def register_callbacks(app):
 
     def parse_excel(contents, filename):
@@ -115,11 +119,13 @@ def register_callbacks(app):
         decoded = base64.b64decode(content_string)
         try:
             if 'xlsx' in filename:
-                df = pd.read_excel(io.BytesIO(decoded))
+                df = check_columns(pd.read_excel(io.BytesIO(decoded), usecols=select_columns(REQUIRED_COLUMNS)), REQUIRED_COLUMNS)
                 # Replace NaN values with empty strings
                 df.fillna("", inplace=True)
                 return df['Login link'].tolist()  # Convert the 'Login link' column to a list
             return None
+        except MissingColumnsError as e:
+            return html.Div(str(e), className="alert alert-danger")
         except Exception as e:
             print(e)
             return None
@@ -242,6 +248,10 @@ def register_callbacks(app):
                 return html.Div("Please upload an Excel file.", className="alert alert-warning")
             # Get the login links from the Excel file
             links = parse_excel(contents, filename)
+            if isinstance(links, html.Div):
+                return links
+            if links is None:
+                return html.Div("There was an error processing the Excel file.", className="alert alert-danger")
             # Check if 'links' is a Pandas Series and convert to a list if necessary
             if isinstance(links, pd.Series):
                 links = links.tolist()
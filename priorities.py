@@ -1,5 +1,5 @@
 import dash
-from dash import dcc, html, Input, Output, State
+from dash import dcc, html, dash_table, Input, Output, State
 import dash_bootstrap_components as dbc
 import pandas as pd
 import io
@@ -7,7 +7,16 @@ import base64
 import plotly.graph_objs as go
 from dash.exceptions import PreventUpdate
 import numpy as np
-from datetime import datetime, timedelta
+import os
+import diskcache
+from dash import DiskcacheManager
+from upload_cache import APP_DATA_DIR, MissingColumnsError, cached_upload, decode_contents, parse_upload, private_dir, upload_key
+from priority_engine import read_typed_export, sweep_priority_counts, priority_names as get_priority_names
+from priority_reports import (EXPORT_COLUMNS, REPORT_ENGINE, REPORT_TYPES, SHEET_COLUMNS, SNAPSHOT_DIR, build_report, input_settings,
+                              prepare_report_frame)
+from priority_delta import export_source
+from priority_preview import PREVIEW_PAGE_SIZE, preview_sheets, sheet_page
+from report_artifacts import artifact_key, register_routes as register_report_downloads, stored_report
 
 # Initialize the Dash app with a modern theme (Bootstrap for styling)
 app = dash.Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP])
@@ -32,6 +41,34 @@ BUTTON_STYLE = {
     "margin-bottom": "10px",
 }
 
+# Parameters the sensitivity sweep can vary: the five thresholds and the two day thresholds
+SWEEP_PARAMETER_OPTIONS = [
+    {'label': 'Filipina Live-In threshold', 'value': 'Filipina Live-In'},
+    {'label': 'African Live-In threshold', 'value': 'African Live-In'},
+    {'label': 'Ethiopian Live-In threshold', 'value': 'Ethiopian Live-In'},
+    {'label': 'Filipina Live-Out threshold', 'value': 'Filipina Live-Out'},
+    {'label': 'African Live-Out threshold', 'value': 'African Live-Out'},
+    {'label': 'MV urgency days', 'value': 'mv_urgency_days'},
+    {'label': 'Last day in country', 'value': 'last_day_in_country'},
+]
+
+# Reports and sheets the preview table can show; sheet values index REPORT_TYPES[...]['sheets']
+PREVIEW_REPORT_OPTIONS = [
+    {'label': 'Combined', 'value': 'combined'},
+    {'label': 'LAWP', 'value': 'lawp'},
+    {'label': 'Non-LAWP', 'value': 'non_lawp'},
+    {'label': 'Top Priorities', 'value': 'top'},
+]
+PREVIEW_SHEET_OPTIONS = [
+    {'label': 'Accepted', 'value': 0},
+    {'label': 'Rejected', 'value': 1},
+    {'label': 'Combined', 'value': 2},
+    {'label': 'Accepted No-Africans', 'value': 3},
+    {'label': 'Rejected No-Africans', 'value': 4},
+    {'label': 'Combined No-Africans', 'value': 5},
+]
+NUMERIC_PREVIEW_COLUMNS = ['Priority number', 'Been in the table for (in days)', 'Matched rules']
+
 # Define the layout of the app with improved design, filters, and explanations
 app.layout = dbc.Container([
     dbc.Row([
@@ -165,6 +202,7 @@ app.layout = dbc.Container([
                         multiple=False
                     ),
                     html.Div(id='upload-status', className="mt-3"),
+                    html.Div(id='upload-progress'),
                 ])
             ], style=CARD_STYLE),
         ], width=12),
@@ -185,6 +223,8 @@ app.layout = dbc.Container([
                        dbc.Col(dbc.Button("Download Top Priorities", id="btn-top-priorities", color="warning", className="w-100", size="lg", style=BUTTON_STYLE), width=12, md=4),
                     ]),
                     dbc.Spinner(html.Div(id="loading-output"), color="primary", type="grow", spinnerClassName="mt-3"),
+                    # Link to the finished report's workbook; see report_artifacts.register_routes
+                    html.Div(id="download-report"),
                 ])
             ], style=CARD_STYLE),
         ], width=12),
@@ -201,288 +241,210 @@ app.layout = dbc.Container([
         ], width=12),
     ]),
     
-    dcc.Download(id="download-report"),
+    dbc.Row([
+        dbc.Col([
+            dbc.Card([
+                dbc.CardHeader(html.H4("Preview", className="text-info")),
+                dbc.CardBody([
+                    html.P("Browse a prioritized sheet with the settings above without downloading the report. After changing the settings, click Apply Settings to prioritize the preview again. Type in the row under the headers to filter (e.g. a Request ID or '> 5'), click a header to sort.", className="text-muted mb-4"),
+                    dbc.Row([
+                        dbc.Col(dbc.InputGroup([
+                            dbc.InputGroupText("Report"),
+                            dbc.Select(id="preview-report", options=PREVIEW_REPORT_OPTIONS, value='combined'),
+                        ], className="mb-2"), md=5),
+                        dbc.Col(dbc.InputGroup([
+                            dbc.InputGroupText("Sheet"),
+                            dbc.Select(id="preview-sheet", options=PREVIEW_SHEET_OPTIONS, value=2),
+                        ], className="mb-2"), md=5),
+                        dbc.Col(dbc.Button("Apply Settings", id="btn-apply-preview", color="secondary", className="w-100"), md=2),
+                    ]),
+                    html.Div(id="preview-status", className="text-muted mb-2"),
+                    dash_table.DataTable(
+                        id='preview-table',
+                        columns=[{'name': column, 'id': column, 'type': 'numeric' if column in NUMERIC_PREVIEW_COLUMNS else 'text'}
+                                 for column in SHEET_COLUMNS],
+                        page_current=0,
+                        page_size=PREVIEW_PAGE_SIZE,
+                        page_action='custom',
+                        sort_action='custom',
+                        sort_mode='multi',
+                        sort_by=[],
+                        filter_action='custom',
+                        filter_query='',
+                        filter_options={'case': 'insensitive'},
+                        style_table={'overflowX': 'auto'},
+                        style_cell={'textAlign': 'left', 'padding': '10px'},
+                        style_header={
+                            'backgroundColor': 'lightgrey',
+                            'fontWeight': 'bold'
+                        }
+                    ),
+                ])
+            ], style=CARD_STYLE),
+        ], width=12),
+    ]),
+
+    dbc.Row([
+        dbc.Col([
+            dbc.Card([
+                dbc.CardHeader(html.H4("Threshold Sensitivity Sweep", className="text-info")),
+                dbc.CardBody([
+                    html.P("Pick one or two parameters and a comma-separated list of values for each to see how many maids land in every priority (Combined sheet) at each setting. The other parameters keep the values set above.", className="text-muted mb-4"),
+                    dbc.Row([
+                        dbc.Col([
+                            dbc.InputGroup([
+                                dbc.InputGroupText("Parameter 1"),
+                                dbc.Select(id="sweep-param-1", options=SWEEP_PARAMETER_OPTIONS, value='Filipina Live-In'),
+                            ], className="mb-2"),
+                            dbc.InputGroup([
+                                dbc.InputGroupText("Values"),
+                                dbc.Input(id="sweep-values-1", type="text", placeholder="e.g. 40, 60, 80, 100", value="40, 60, 80, 100, 120"),
+                            ], className="mb-2"),
+                        ], md=6),
+                        dbc.Col([
+                            dbc.InputGroup([
+                                dbc.InputGroupText("Parameter 2"),
+                                dbc.Select(id="sweep-param-2", options=[{'label': 'None', 'value': ''}] + SWEEP_PARAMETER_OPTIONS, value=''),
+                            ], className="mb-2"),
+                            dbc.InputGroup([
+                                dbc.InputGroupText("Values"),
+                                dbc.Input(id="sweep-values-2", type="text", placeholder="e.g. 3, 5, 7"),
+                            ], className="mb-2"),
+                        ], md=6),
+                    ]),
+                    dbc.Button("Run Sweep", id="btn-run-sweep", color="secondary", size="lg", style=BUTTON_STYLE),
+                    dbc.Spinner(html.Div(id="sweep-output", className="mt-3"), color="primary", type="grow"),
+                ])
+            ], style=CARD_STYLE),
+        ], width=12),
+    ]),
+
+    # upload_key of the parsed upload, so the preview table finds it in the upload cache
+    # without sending the file with every page
+    dcc.Store(id='upload-key'),
 ], fluid=True)
 layout = app.layout
-# List of African countries for prioritization
-african_countries = [
-    "Algeria", "Algerian", "Algerians", "Algerian (adj.)",
-    "Angola", "Angolan", "Angolans", "Angolan (adj.)",
-    "Benin", "Beninese", "Beninese (plural)", "Beninese (adj.)",
-    "Botswana", "Botswanan", "Botswanans", "Botswanan (adj.)",
-    "Burkina Faso", "Burkinabe", "Burkinabe (plural)", "Burkinabe (adj.)",
-    "Burundi", "Burundian", "Burundians", "Burundian (adj.)",
-    "Cabo Verde", "Cabo Verdean", "Cabo Verdeans", "Cabo Verdean (adj.)",
-    "Cameroon", "Cameroonian", "Cameroonians", "Cameroonian (adj.)",
-    "Central African Republic", "Central African", "Central Africans", "Central African (adj.)",
-    "Chad", "Chadian", "Chadians", "Chadian (adj.)",
-    "Comoros", "Comoran", "Comorans", "Comoran (adj.)",
-    "Democratic Republic of the Congo", "Congolese (Democratic Republic)", "Congolese (plural)", "Congolese (Democratic Republic adj.)",
-    "Republic of the Congo", "Congolese (Republic)", "Congolese (plural)", "Congolese (Republic adj.)",
-    "Djibouti", "Djiboutian", "Djiboutians", "Djiboutian (adj.)",
-    "Egypt", "Egyptian", "Egyptians", "Egyptian (adj.)",
-    "Equatorial Guinea", "Equatoguinean", "Equatoguineans", "Equatoguinean (adj.)",
-    "Eritrea", "Eritrean", "Eritreans", "Eritrean (adj.)",
-    "Eswatini", "Swazi", "Swazis", "Swazi (adj.)",
-    "Ethiopia", "Ethiopian", "Ethiopians", "Ethiopian (adj.)",
-    "Gabon", "Gabonese", "Gabonese (plural)", "Gabonese (adj.)",
-    "Gambia", "Gambian", "Gambians", "Gambian (adj.)",
-    "Ghana", "Ghanaian", "Ghanaians", "Ghanaian (adj.)",
-    "Guinea", "Guinean", "Guineans", "Guinean (adj.)",
-    "Guinea-Bissau", "Bissau-Guinean", "Bissau-Guineans", "Bissau-Guinean (adj.)",
-    "Ivory Coast", "Ivorian", "Ivorians", "Ivorian (adj.)",
-    "Kenya", "Kenyan", "Kenyans", "Kenyan (adj.)",
-    "Lesotho", "Mosotho", "Basotho", "Basotho (adj.)",
-    "Liberia", "Liberian", "Liberians", "Liberian (adj.)",
-    "Libya", "Libyan", "Libyans", "Libyan (adj.)",
-    "Madagascar", "Malagasy", "Malagasy (plural)", "Malagasy (adj.)",
-    "Malawi", "Malawian", "Malawians", "Malawian (adj.)",
-    "Mali", "Malian", "Malians", "Malian (adj.)",
-    "Mauritania", "Mauritanian", "Mauritanians", "Mauritanian (adj.)",
-    "Mauritius", "Mauritian", "Mauritians", "Mauritian (adj.)",
-    "Morocco", "Moroccan", "Moroccans", "Moroccan (adj.)",
-    "Mozambique", "Mozambican", "Mozambicans", "Mozambican (adj.)",
-    "Namibia", "Namibian", "Namibians", "Namibian (adj.)",
-    "Niger", "Nigerien", "Nigeriens", "Nigerien (adj.)",
-    "Nigeria", "Nigerian", "Nigerians", "Nigerian (adj.)",
-    "Rwanda", "Rwandan", "Rwandans", "Rwandan (adj.)",
-    "São Tomé and Príncipe", "São Toméan", "São Toméans", "São Toméan (adj.)",
-    "Senegal", "Senegalese", "Senegalese (plural)", "Senegalese (adj.)",
-    "Seychelles", "Seychellois", "Seychellois (plural)", "Seychellois (adj.)",
-    "Sierra Leone", "Sierra Leonean", "Sierra Leoneans", "Sierra Leonean (adj.)",
-    "Somalia", "Somali", "Somalis", "Somali (adj.)",
-    "South Africa", "South African", "South Africans", "South African (adj.)",
-    "South Sudan", "South Sudanese", "South Sudanese (plural)", "South Sudanese (adj.)",
-    "Sudan", "Sudanese", "Sudanese (plural)", "Sudanese (adj.)",
-    "Tanzania", "Tanzanian", "Tanzanians", "Tanzanian (adj.)",
-    "Togo", "Togolese", "Togolese (plural)", "Togolese (adj.)",
-    "Tunisia", "Tunisian", "Tunisians", "Tunisian (adj.)",
-    "Uganda", "Ugandan", "Ugandans", "Ugandan (adj.)",
-    "Zambia", "Zambian", "Zambians", "Zambian (adj.)",
-    "Zimbabwe", "Zimbabwean", "Zimbabweans", "Zimbabwean (adj.)"
-]
-    # Define priority names for display
-approved_strings = [' Approved', 'Approved', 'Approved ', ' Approved ', 'Maid is already verified and accepted']
-rejected_strings = [' Rejected', 'Rejected', 'Rejected ', ' Rejected ', 'NA', ' ']
 
-def register_callbacks(app):
+# Reports are generated as background jobs so a large export does not pin a
+# server worker; job state and results are pickled to a local SQLite-backed diskcache
+# in a private directory under the app's data dir, like the upload store
+REPORT_JOBS_DIR = os.environ.get('REPORT_JOBS_DIR', os.path.join(APP_DATA_DIR, 'report-jobs'))
+background_manager = DiskcacheManager(diskcache.Cache(private_dir(REPORT_JOBS_DIR)))
+
+# Columns the page reads from an upload; the rest of a wide export is never parsed
+REQUIRED_COLUMNS = EXPORT_COLUMNS
+
+# Report generated by each download button, see priority_reports.REPORT_TYPES
+REPORT_BUTTONS = {
+    "btn-combined-report": 'combined',
+    "btn-lawp-report": 'lawp',
+    "btn-no-lawp-report": 'non_lawp',
+    "btn-top-priorities": 'top',
+}
+
+
+class UploadEvicted(Exception):
+    """The upload a report job was started on is no longer in the upload store."""
+
 
+def register_callbacks(app):
 
-    def get_priority_names(mv_urgency_days, last_day_in_country):
-        return {
-            1: "MV with Super Angry Client",
-            2: "MV with Visa Prioritization Request",
-            3: "Filipina with Flight in more than 2 days and Less Than 4 Days",
-            4: f"MV in Table for More Than {mv_urgency_days} Days",
-            5: f"Last day to stay in country < {last_day_in_country}",  # New priority
-            6: "Filipina Live-In in Dubai",  # This was previously priority 5
-            7: "African Live-In in Dubai",  # Previously 6, and so on...
-            8: "Ethiopian Live-In in Dubai",
-            9: "Ethiopian Pending COC for More Than 10 Days",
-            10: "Filipina Live-Out in Dubai",
-            11: "African Live-Out in Dubai",
-            12: "Filipina with Flight in 4 to 7 Days",
-            13: f"MV in Table for {mv_urgency_days} Days or Less",
-            14: "Landed in Dubai Live In",
-            15: "Landed in Dubai Live Out",
-            16: "Outcome is LAWP",
-            17: "Filipina with Flight in 7 to 14 Days",
-            18: "African with Attested GCC",
-            19: "Ethiopian Pending Exit Permit",
-            20: "African with MFA",
-            21: "Ethiopian Pending COC",
-            22: "African with GCC",
-            23: "Other"
-        }
 
     def parse_contents(contents, filename):
-        """Parse the contents of the uploaded file and return a pandas DataFrame."""
-        content_type, content_string = contents.split(',')
-        decoded = base64.b64decode(content_string)
+        """Parse the contents of the uploaded file and return a pandas DataFrame.
+
+        Only REQUIRED_COLUMNS are loaded. Parsed uploads are typed by
+        compact_export and cached by content hash, so every report button and
+        toggle reuses the same (read-only) DataFrame.
+        """
+        if 'xlsx' not in filename and 'csv' not in filename:
+            return html.Div(['Please upload an Excel or CSV file.'])
         try:
-            if 'xlsx' in filename:
-                df = pd.read_excel(io.BytesIO(decoded))
-            elif 'csv' in filename:
-                try:
-                    # Read as TSV using '\t' as the delimiter
-                    df = pd.read_csv(io.StringIO(decoded.decode('utf-16')), delimiter='\t', skip_blank_lines=True)
-                except Exception as e:
-                    print("Failed to parse TSV file:", e)
-                    return html.Div(['There was an error processing the TSV file.'])
-            else:
-                return html.Div(['Please upload an Excel or CSV file.'])
-            return df
+            return parse_upload(contents, filename, read=read_typed_export, columns=REQUIRED_COLUMNS)
+        except MissingColumnsError as e:
+            return html.Div([str(e)])
         except Exception as e:
+            if 'csv' in filename:
+                print("Failed to parse TSV file:", e)
+                return html.Div(['There was an error processing the TSV file.'])
             print(e)
             return html.Div(['There was an error processing this file.'])
 
-
-    def assign_priority(row, priority_counters, priority_thresholds, mv_urgency_days, last_day_in_country):
-        """Assign priority to a row based on various conditions."""
-        priorities = []
-        
-        # Priority assignment logic
-        if row['Housemaid Type'] == 'MV' and row['Client Note'] == 'SUPER_ANGRY_CLIENT':
-            priorities.append(1)
-        
-        if row['Housemaid Type'] == 'MV' and row['Client Note'] == 'PRIORITIZE_VISA':
-            priorities.append(2)
-        
-        if row['Housemaid Nationality'] == 'Filipina' and pd.notna(row['Flight in (days)']) and row['Flight in (days)'] < 4 and row['Flight in (days)'] > 2:
-            priorities.append(3)
-        
-        if row['Housemaid Type'] == 'MV' and pd.notna(row['Been in the table for (in days)']) and row['Been in the table for (in days)'] > mv_urgency_days:
-            priorities.append(4)
-        
-        # New priority: Last day to stay in country < 5 (This becomes Priority 5)
-        if pd.notna(row['Last day to stay in country in']) and row['Last day to stay in country in'] < last_day_in_country:
-            priorities.append(5)
-        
-        # Shift all subsequent priorities by 1
-        if row['Housemaid Nationality'] == 'Filipina' and row['Housemaid Status'] == 'LANDED_IN_DUBAI' and row['Live out'] == 'No':
-            if priority_counters[6] < priority_thresholds['Filipina Live-In']:
-                priorities.append(6)
-                priority_counters[6] += 1
-        
-        if row['Housemaid Nationality'] in african_countries and row['Housemaid Status'] == 'LANDED_IN_DUBAI' and row['Live out'] == 'No':
-            if priority_counters[7] < priority_thresholds['African Live-In']:
-                priorities.append(7)
-                priority_counters[7] += 1
-        
-        if row['Housemaid Nationality'] == 'Ethiopian' and row['Housemaid Status'] == 'LANDED_IN_DUBAI' and row['Live out'] == 'No':
-            if priority_counters[8] < priority_thresholds['Ethiopian Live-In']:
-                priorities.append(8)
-                priority_counters[8] += 1
-        
-        if row['Housemaid Nationality'] == 'Ethiopian' and row['Stage in Freedom Operator Page'] == 'Pending COC' and pd.notna(row['Been in the table for (in days)']) and row['Been in the table for (in days)'] > 10 and row['Live out'] == 'No':
-            priorities.append(9)
-        
-        if row['Housemaid Nationality'] == 'Filipina' and row['Housemaid Status'] == 'LANDED_IN_DUBAI' and row['Live out'] == 'Yes':
-            if priority_counters[10] < priority_thresholds['Filipina Live-Out']:
-                priorities.append(10)
-                priority_counters[10] += 1
-        
-        if row['Housemaid Nationality'] in african_countries and row['Housemaid Status'] == 'LANDED_IN_DUBAI' and row['Live out'] == 'Yes':
-            if priority_counters[11] < priority_thresholds['African Live-Out']:
-                priorities.append(11)
-                priority_counters[11] += 1
-        
-        if row['Housemaid Nationality'] == 'Filipina' and pd.notna(row['Flight in (days)']) and 4 <= row['Flight in (days)'] <= 7:
-            priorities.append(12)
-        
-        if row['Housemaid Type'] == 'MV' and pd.notna(row['Been in the table for (in days)']) and row['Been in the table for (in days)'] <= mv_urgency_days:
-            priorities.append(13)
-
-        if row['Housemaid Status'] == 'LANDED_IN_DUBAI' and row['Live out'] == 'No':
-            priorities.append(14)
-
-        if row['Housemaid Status'] == 'LANDED_IN_DUBAI' and row['Live out'] == 'Yes':
-            priorities.append(15)
-
-        if row['Outcome'] == 'LAWP':
-            priorities.append(16)
-
-        if row['Housemaid Nationality'] == 'Filipina' and pd.notna(row['Flight in (days)']) and 7 < row['Flight in (days)'] <= 14:
-            priorities.append(17)
-        
-        if row['Housemaid Nationality'] in african_countries and row['Attested GCC'] == 'Yes':
-            priorities.append(18)
-        
-        if row['Housemaid Nationality'] == 'Ethiopian' and row['Stage in Freedom Operator Page'] == 'Pending Exit Permit':
-            priorities.append(19)
-        
-        if row['Housemaid Nationality'] in african_countries and row['MFA'] == 'Yes':
-            priorities.append(20)
-        
-        if row['Housemaid Nationality'] == 'Ethiopian' and row['Stage in Freedom Operator Page'] == 'Pending COC':
-            priorities.append(21)
-        
-        if row['Housemaid Nationality'] in african_countries and row['GCC'] == 'Yes':
-            priorities.append(22)
-        
-        priorities.append(23)
-        
-        return min(priorities) if priorities else None
-
-    def process_dataframe(df, docs_status_list, priority_counters, priority_thresholds, mv_urgency_days, last_day_in_country):
-        """Process the DataFrame to assign priorities and generate statistics."""
-
-        if 'NA' in docs_status_list:
-            # Remove 'NA' as a string
-            docs_status_list.remove('NA')
-            # Add np.nan to check for missing values
-            docs_status_list.append(np.nan)
-            df = df[df['Docs status'].isin(docs_status_list) | df['Docs status'].isna()]
-        
-        else:
-            df = df[df['Docs status'].isin(docs_status_list)]
-
-        replacement_dict = {status: 'Rejected' for status in rejected_strings}
-        replacement_dict.update({status: 'Approved' for status in approved_strings})
-
-        # Replace values in the 'Docs status' column
-        df['Docs status'] = df['Docs status'].replace(replacement_dict)
-        
-        priority_names = get_priority_names(mv_urgency_days, last_day_in_country)
-        df['Priority number'] = df.apply(lambda row: assign_priority(row, priority_counters, priority_thresholds, mv_urgency_days, last_day_in_country), axis=1)
-        df['Priority Name'] = df['Priority number'].map(priority_names)
-        
-        df_prioritized = df[df['Priority number'].notna()]
-        output_df = df_prioritized.sort_values(by=['Priority number', 'Been in the table for (in days)'], ascending=[True, False])    
-        output_df = output_df[['Priority number', 'Request ID', 'Housemaid Name', 'Housemaid Nationality', 'Housemaid Type', 'Gender', 'Priority Name', 'Been in the table for (in days)', 'Docs status']]
-
-        # output_df = output_df.sort_values('Priority number')
-        
-        stats = calculate_statistics(df_prioritized, priority_names)
-        
-        return output_df, stats
-
-    def calculate_statistics(df, priority_names):
-        """Calculate statistics for the prioritized DataFrame."""
-        stats = {}
-        for priority, name in priority_names.items():
-            priority_df = df[df['Priority number'] == priority]
-            males = len(priority_df[priority_df['Gender'] == 'Male'])
-            females = len(priority_df[priority_df['Gender'] == 'Female'])
-            total = len(priority_df)
-            stats[name] = {'Males': males, 'Females': females, 'Total': total}
-        return stats
-
     def create_stats_table(stats, title):
         """Create a formatted table for displaying statistics."""
         table_header = [
             html.Thead(html.Tr([html.Th("Priority Name"), html.Th("Males"), html.Th("Females"), html.Th("Total")]))
         ]
         rows = []
-        for name, data in stats.items():
-            row = html.Tr([html.Td(name), html.Td(data['Males']), html.Td(data['Females']), html.Td(data['Total'])])
+        for name, data in stats.iterrows():
+            row = html.Tr([html.Td(name), html.Td(int(data['Males'])), html.Td(int(data['Females'])), html.Td(int(data['Total']))])
             rows.append(row)
         table_body = [html.Tbody(rows)]
         return dbc.Table(table_header + table_body, bordered=True, hover=True, responsive=True, striped=True, className="mt-3", style={"fontSize": "0.9rem"})
 
+    def create_rule_stats_panel(rules, report_type):
+        """Collapsed panel with each rule's hits over the Combined sheet and its evaluation time."""
+        table_header = [
+            html.Thead(html.Tr([html.Th("Rule"), html.Th("Matched"), html.Th("Won"), html.Th("Capped"), html.Th("Time (ms)")]))
+        ]
+        rows = []
+        for name, data in rules.iterrows():
+            seconds = data['Seconds']
+            # Rules no row matched are greyed out
+            row = html.Tr([html.Td(name), html.Td(int(data['Matched'])), html.Td(int(data['Won'])), html.Td(int(data['Capped'])),
+                           html.Td("-" if pd.isna(seconds) else f"{seconds * 1000:.1f}")],
+                          className="text-muted" if data['Matched'] == 0 else None)
+            rows.append(row)
+        table = dbc.Table(table_header + [html.Tbody(rows)], bordered=True, hover=True, responsive=True, striped=True, style={"fontSize": "0.9rem"})
+        return dbc.Accordion([
+            dbc.AccordionItem([
+                html.P("Rows of the Combined sheet meeting each rule, winning it as their lowest priority, and turned away by its cap. "
+                       "Times are for evaluating the rule over the whole upload.", className="text-muted"),
+                table,
+            ], title=f"Rule hits and timings ({report_type} report)"),
+        ], start_collapsed=True, className="mt-3")
+
+    def report_progress(message):
+        """Progress line shown under the report buttons while a report job runs."""
+        return html.Div([
+            html.Span(className="spinner-border spinner-border-sm text-primary me-2"),
+            message
+        ], className="text-muted mt-3")
+
     @app.callback(
-        Output('upload-status', 'children'),
+        [Output('upload-status', 'children'),
+        Output('upload-key', 'data')],
         Input('upload-data', 'contents'),
-        State('upload-data', 'filename')
+        State('upload-data', 'filename'),
+        background=True,
+        manager=background_manager,
+        progress=Output('upload-progress', 'children'),
+        progress_default="",
     )
-    def update_upload_status(contents, filename):
+    def update_upload_status(set_progress, contents, filename):
         if contents is not None:
+            # Parsing a large export takes seconds, so it runs as a background job like the
+            # reports; the parsed upload goes to the shared upload store, where report jobs
+            # and the preview load it instead of parsing it again
+            set_progress(report_progress("Reading the uploaded file..."))
+            df = parse_contents(contents, filename)
+            if not isinstance(df, pd.DataFrame):
+                return df, None
             return html.Div([
                 html.I(className="fas fa-check-circle text-success me-2"),
                 f"File uploaded successfully: {filename}"
-            ], className="mt-2")
-        return ""
+            ], className="mt-2"), upload_key(decode_contents(contents), filename, read_typed_export, REQUIRED_COLUMNS)
+        return "", None
 
     @app.callback(
-        [Output("download-report", "data"),
-        Output('output-stats', 'children'),
-        Output("loading-output", "children")],
+        [Output("download-report", "children"),
+        Output('output-stats', 'children')],
         [Input("btn-combined-report", "n_clicks"),
         Input("btn-lawp-report", "n_clicks"),
         Input("btn-no-lawp-report", "n_clicks"),
         Input("btn-top-priorities", "n_clicks"),
         Input("payment-added-toggle", "value")],
-        [State('upload-data', 'contents'),
+        [State('upload-key', 'data'),
         State('upload-data', 'filename'),
         State("counter-filipina-live-in", "value"),
         State("counter-african-live-in", "value"),
@@ -497,17 +459,24 @@ def register_callbacks(app):
         State("offer-letter-threshold", "value"),
         State("mv-urgency-days", "value"),
         State("last-day-in-country", "value")],
+        background=True,
+        manager=background_manager,
+        progress=Output("loading-output", "children"),
+        progress_default="",
         prevent_initial_call=True,
     )
-    def generate_report(n_clicks_combined, n_clicks_lawp, n_clicks_no_lawp, n_clicks_top_priorities, payment_added,
-                        contents, filename,
+    def generate_report(set_progress, n_clicks_combined, n_clicks_lawp, n_clicks_no_lawp, n_clicks_top_priorities, payment_added,
+                        key, filename,
                         counter_filipina_live_in, counter_african_live_in, counter_ethiopian_live_in,
                         counter_filipina_live_out, counter_african_live_out,
                         threshold_filipina_live_in, threshold_african_live_in, threshold_ethiopian_live_in,
                         threshold_filipina_live_out, threshold_african_live_out, offer_letter_threshold,
                         mv_urgency_days, last_day_in_country):
-        """Generate reports and display statistics based on the button clicked and input counters and thresholds."""
-        if contents is None:
+        """Generate reports and display statistics based on the button clicked and input counters and thresholds.
+
+        Runs as a background job on the upload already parsed into the upload store.
+        """
+        if key is None:
             raise PreventUpdate
 
         ctx = dash.callback_context
@@ -515,62 +484,40 @@ def register_callbacks(app):
             raise PreventUpdate
         
         button_id = ctx.triggered[0]['prop_id'].split('.')[0]
-        
-        df = parse_contents(contents, filename)
-        if not isinstance(df, pd.DataFrame):
-            raise PreventUpdate
-        original_df = df
-        offer_letter_threshold = offer_letter_threshold or 2
-        # df['Offer Letter date'] = pd.to_datetime(df['Offer Letter date'], errors='coerce')
-        today = pd.Timestamp.today()
-        if payment_added in ["Yes", "No"]:
-         df = df[(df['Payment added?'] == payment_added)]
-        # print(f'mhd, payment added {payment_added}')
-        # df = df[((df['Payment added?'] == 'No'))]
-        # df = df[((df['MB?'] == 'No') & (df['Has Contract MB?'] == 'No') & (df['Payment added?'] == 'No'))]
-        # df = df[((df['MB?'] == 'No') & (df['Has Contract MB?'] == 'No')) | (((df['MB?'] == 'Yes') | (df['Has Contract MB?'] == 'Yes')) & (((today - df['Offer Letter date']) <= timedelta(days=offer_letter_threshold))))]
-        priority_counters = {
-            6: counter_filipina_live_in or 0,
-            7: counter_african_live_in or 0,
-            8: counter_ethiopian_live_in or 0,
-            10: counter_filipina_live_out or 0,
-            11: counter_african_live_out or 0
-        }
-        
-        priority_thresholds = {
-            'Filipina Live-In': threshold_filipina_live_in or 80,
-            'African Live-In': threshold_african_live_in or 60,
-            'Ethiopian Live-In': threshold_ethiopian_live_in or 70,
-            'Filipina Live-Out': threshold_filipina_live_out or 60,
-            'African Live-Out': threshold_african_live_out or 40
-        }
-
-        mv_urgency_days = mv_urgency_days or 5
-
-        last_day_in_country = last_day_in_country or 5
-
-        if button_id == "btn-combined-report":
-            accepted_df, accepted_stats = process_dataframe(df, approved_strings, priority_counters.copy(), priority_thresholds, mv_urgency_days, last_day_in_country)
-            rejected_df, rejected_stats = process_dataframe(df, rejected_strings, priority_counters.copy(), priority_thresholds, mv_urgency_days, last_day_in_country)
-            combined_df, _ = process_dataframe(df, approved_strings + rejected_strings, priority_counters.copy(), priority_thresholds, mv_urgency_days, last_day_in_country)
-            # combined_df = pd.concat([accepted_df, rejected_df]).sort_values('Priority number')
-
-            # Exclude African maids, but keep Ethiopians
-            non_african_accepted_df = accepted_df[~accepted_df['Housemaid Nationality'].isin(african_countries) | (accepted_df['Housemaid Nationality'] == 'Ethiopian')]
-            non_african_rejected_df = rejected_df[~rejected_df['Housemaid Nationality'].isin(african_countries) | (rejected_df['Housemaid Nationality'] == 'Ethiopian')]
-            non_african_combined_df = combined_df[~combined_df['Housemaid Nationality'].isin(african_countries) | (combined_df['Housemaid Nationality'] == 'Ethiopian')]
-
-            output = io.BytesIO()
-            with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-                accepted_df.to_excel(writer, sheet_name='Accepted', index=False)
-                rejected_df.to_excel(writer, sheet_name='Rejected', index=False)
-                combined_df.to_excel(writer, sheet_name='Combined', index=False)
-                
-                # Add the new sheet with the filtered data (excluding Africans, but keeping Ethiopians)
-                non_african_accepted_df.to_excel(writer, sheet_name='Accepted No-Africans', index=False)
-                non_african_rejected_df.to_excel(writer, sheet_name='Rejected No-Africans', index=False)
-                non_african_combined_df.to_excel(writer, sheet_name='Combined No-Africans', index=False)
-            
+
+        priority_counters, priority_thresholds, params = input_settings(
+            [counter_filipina_live_in, counter_african_live_in, counter_ethiopian_live_in, counter_filipina_live_out, counter_african_live_out],
+            [threshold_filipina_live_in, threshold_african_live_in, threshold_ethiopian_live_in, threshold_filipina_live_out, threshold_african_live_out],
+            mv_urgency_days, last_day_in_country)
+
+        report_type = REPORT_BUTTONS.get(button_id)
+        if report_type is None:
+            return dash.no_update, dash.no_update
+
+        def build(path):
+            set_progress(report_progress("Reading the uploaded file..."))
+            df = cached_upload(key)
+            if df is None:
+                raise UploadEvicted()
+            _, report_filename, stats = build_report(
+                df, report_type, payment_added, priority_counters, priority_thresholds, params,
+                progress=lambda message: set_progress(report_progress(message)), engine=REPORT_ENGINE, snapshot_dir=SNAPSHOT_DIR,
+                output=path, snapshot_source=export_source(filename))
+            return report_filename, stats
+
+        if SNAPSHOT_DIR:
+            # The Movers sheet depends on the snapshots as well as the upload, so it is always rebuilt
+            report_key = None
+        else:
+            # The same upload, report and settings as an earlier request get its stored workbook
+            report_key = artifact_key(key, report_type, payment_added, priority_counters, priority_thresholds, params, REPORT_ENGINE)
+        try:
+            token, report_filename, stats = stored_report(report_key, build)
+        except UploadEvicted:
+            return html.Div(['The upload is no longer cached, please upload the file again.'], className="text-danger"), ""
+        accepted_stats, rejected_stats = stats['Accepted'], stats['Rejected']
+
+        if report_type == 'combined':
             stats_div = html.Div([
                 html.H4("Combined Statistics:", className="text-primary mb-4"),
                 dbc.Row([
@@ -584,41 +531,11 @@ def register_callbacks(app):
                     ], md=4),
                     dbc.Col([  
                         html.H5("Total:", className="text-primary"),
-                        create_stats_table({k: {'Males': v['Males'] + rejected_stats.get(k, {}).get('Males', 0),
-                                                'Females': v['Females'] + rejected_stats.get(k, {}).get('Females', 0),
-                                                'Total': v['Total'] + rejected_stats.get(k, {}).get('Total', 0)}
-                                            for k, v in accepted_stats.items()}, "Total")
+                        create_stats_table(accepted_stats.add(rejected_stats, fill_value=0), "Total")
                     ], md=4),
                 ]),
             ])
-            
-            return dcc.send_bytes(output.getvalue(), "combined_maids_docs_report.xlsx"), stats_div, ""
-        
-        elif button_id == "btn-lawp-report":
-            lawp_df = df[df['Outcome'] == 'LAWP']
-            accepted_df, accepted_stats = process_dataframe(lawp_df, approved_strings, priority_counters.copy(), priority_thresholds, mv_urgency_days, last_day_in_country)
-            rejected_df, rejected_stats = process_dataframe(lawp_df, rejected_strings, priority_counters.copy(), priority_thresholds, mv_urgency_days, last_day_in_country)
-            combined_df, _ = process_dataframe(df, approved_strings + rejected_strings, priority_counters.copy(), priority_thresholds, mv_urgency_days, last_day_in_country)
-            # combined_df = pd.concat([accepted_df, rejected_df]).sort_values('Priority number')
-            
-            # Exclude African maids, but keep Ethiopians
-            non_african_accepted_df = accepted_df[~accepted_df['Housemaid Nationality'].isin(african_countries) | (accepted_df['Housemaid Nationality'] == 'Ethiopian')]
-            non_african_rejected_df = rejected_df[~rejected_df['Housemaid Nationality'].isin(african_countries) | (rejected_df['Housemaid Nationality'] == 'Ethiopian')]
-            non_african_combined_df = combined_df[~combined_df['Housemaid Nationality'].isin(african_countries) | (combined_df['Housemaid Nationality'] == 'Ethiopian')]
-
-            output = io.BytesIO()
-            with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-                accepted_df.to_excel(writer, sheet_name='Accepted LAWP', index=False)
-                rejected_df.to_excel(writer, sheet_name='Rejected LAWP', index=False)
-                combined_df.to_excel(writer, sheet_name='Combined LAWP', index=False)
-
-                # Add the new sheet with the filtered data (excluding Africans, but keeping Ethiopians)
-                non_african_accepted_df.to_excel(writer, sheet_name='Accepted No-Africans LAWP', index=False)
-                non_african_rejected_df.to_excel(writer, sheet_name='Rejected No-Africans LAWP', index=False)
-                non_african_combined_df.to_excel(writer, sheet_name='Combined No-Africans LAWP', index=False)
-            
-
-            
+        elif report_type == 'lawp':
             stats_div = html.Div([
                 html.H4("LAWP Statistics:", className="text-info mb-4"),
                 dbc.Row([
@@ -632,33 +549,7 @@ def register_callbacks(app):
                     ], md=6),
                 ]),
             ])
-            
-            return dcc.send_bytes(output.getvalue(), "lawp_maids_docs_report.xlsx"), stats_div, ""
-        
-        elif button_id == "btn-no-lawp-report":
-            non_lawp_df = df[df['Outcome'] != 'LAWP']
-            accepted_df, accepted_stats = process_dataframe(non_lawp_df, approved_strings, priority_counters.copy(), priority_thresholds, mv_urgency_days, last_day_in_country)
-            rejected_df, rejected_stats = process_dataframe(non_lawp_df, rejected_strings, priority_counters.copy(), priority_thresholds, mv_urgency_days, last_day_in_country)
-            combined_df, _ = process_dataframe(df, approved_strings + rejected_strings, priority_counters.copy(), priority_thresholds, mv_urgency_days, last_day_in_country)
-            # combined_df = pd.concat([accepted_df, rejected_df]).sort_values('Priority number')
-            
-            # Exclude African maids, but keep Ethiopians
-            non_african_accepted_df = accepted_df[~accepted_df['Housemaid Nationality'].isin(african_countries) | (accepted_df['Housemaid Nationality'] == 'Ethiopian')]
-            non_african_rejected_df = rejected_df[~rejected_df['Housemaid Nationality'].isin(african_countries) | (rejected_df['Housemaid Nationality'] == 'Ethiopian')]
-            non_african_combined_df = combined_df[~combined_df['Housemaid Nationality'].isin(african_countries) | (combined_df['Housemaid Nationality'] == 'Ethiopian')]
-
-            output = io.BytesIO()
-            with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-                accepted_df.to_excel(writer, sheet_name='Accepted Non-LAWP', index=False)
-                rejected_df.to_excel(writer, sheet_name='Rejected Non-LAWP', index=False)
-                combined_df.to_excel(writer, sheet_name='Combined Non-LAWP', index=False)
-
-                # Add the new sheet with the filtered data (excluding Africans, but keeping Ethiopians)
-                non_african_accepted_df.to_excel(writer, sheet_name='Accepted No-Africans Non-LAWP', index=False)
-                non_african_rejected_df.to_excel(writer, sheet_name='Rejected No-Africans Non-LAWP', index=False)
-                non_african_combined_df.to_excel(writer, sheet_name='Combined No-Africans Non-LAWP', index=False)
-            
-            
+        elif report_type == 'non_lawp':
             stats_div = html.Div([
                 html.H4("Non-LAWP Statistics:", className="text-success mb-4"),
                 dbc.Row([
@@ -672,41 +563,177 @@ def register_callbacks(app):
                     ], md=6),
                 ]),
             ])
-            
-            return dcc.send_bytes(output.getvalue(), "non_lawp_maids_docs_report.xlsx"), stats_div, ""
-
-        elif button_id == "btn-top-priorities":
-            # Filter for top 4 priorities
-            non_lawp_df = df[df['Outcome'] != 'LAWP']
-            accepted_df, accepted_stats = process_dataframe(non_lawp_df, approved_strings, priority_counters.copy(), priority_thresholds, mv_urgency_days, last_day_in_country)
-            rejected_df, rejected_stats = process_dataframe(non_lawp_df, rejected_strings, priority_counters.copy(), priority_thresholds, mv_urgency_days, last_day_in_country)
-            combined_df, _ = process_dataframe(df, approved_strings + rejected_strings, priority_counters.copy(), priority_thresholds, mv_urgency_days, last_day_in_country)
-            # combined_df = pd.concat([accepted_df, rejected_df]).sort_values('Priority number')
-
-            accepted_df = accepted_df[accepted_df['Priority number'].isin([1, 2, 3, 4, 5])]
-            rejected_df = rejected_df[rejected_df['Priority number'].isin([1, 2, 3, 4, 5])]
-            combined_df = combined_df[combined_df['Priority number'].isin([1, 2, 3, 4, 5])]
-
-            # Exclude African maids, but keep Ethiopians
-            non_african_accepted_df = accepted_df[~accepted_df['Housemaid Nationality'].isin(african_countries) | (accepted_df['Housemaid Nationality'] == 'Ethiopian')]
-            non_african_rejected_df = rejected_df[~rejected_df['Housemaid Nationality'].isin(african_countries) | (rejected_df['Housemaid Nationality'] == 'Ethiopian')]
-            non_african_combined_df = combined_df[~combined_df['Housemaid Nationality'].isin(african_countries) | (combined_df['Housemaid Nationality'] == 'Ethiopian')]
-
-            output = io.BytesIO()
-            with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-                accepted_df.to_excel(writer, sheet_name='Accepted Non-LAWP-Top', index=False)
-                rejected_df.to_excel(writer, sheet_name='Rejected Non-LAWP-Top', index=False)
-                combined_df.to_excel(writer, sheet_name='Combined Non-LAWP-Top', index=False)
-                # Add the new sheet with the filtered data (excluding Africans, but keeping Ethiopians)
-                non_african_accepted_df.to_excel(writer, sheet_name='Accepted No-Afr Non-LAWP-Top', index=False)
-                non_african_rejected_df.to_excel(writer, sheet_name='Rejected No-Afr Non-LAWP-Top', index=False)
-                non_african_combined_df.to_excel(writer, sheet_name='Combined No-Afr Non-LAWP-Top', index=False)
-                
-            
-            return dcc.send_bytes(output.getvalue(), "top_priorities_report.xlsx"), "", ""
-
-        return dash.no_update, dash.no_update, ""
+        else:
+            stats_div = ""
+
+        rules = stats.get('Rules')
+        if rules is not None:
+            stats_div = html.Div([stats_div, create_rule_stats_panel(rules, report_type)])
+
+        movers = stats.get('Movers')
+        if movers is not None:
+            changes = movers['Change'].value_counts()
+            stats_div = html.Div([
+                stats_div,
+                html.P(f"Since the previous export: {changes.get('entered', 0)} entered, {changes.get('left', 0)} left and "
+                       f"{changes.get('changed', 0)} changed priority (see the Movers sheet).", className="text-muted mt-3"),
+            ])
+
+        # A plain link with a download name: if the stored workbook has expired, the failed
+        # download leaves the page and its settings as they are
+        download_link = html.A([
+            html.I(className="fas fa-download me-2"),
+            f"Download {report_filename}"
+        ], href=app.get_relative_path(f"/reports/{token}"), download=report_filename, className="btn btn-outline-primary mt-3")
+        return download_link, stats_div
+
+    @app.callback(
+        [Output('preview-table', 'data'),
+        Output('preview-table', 'page_count'),
+        Output('preview-status', 'children')],
+        [Input('upload-key', 'data'),
+        Input('preview-report', 'value'),
+        Input('preview-sheet', 'value'),
+        Input('preview-table', 'page_current'),
+        Input('preview-table', 'page_size'),
+        Input('preview-table', 'sort_by'),
+        Input('preview-table', 'filter_query'),
+        Input('btn-apply-preview', 'n_clicks')],
+        # The settings are only read when something above changes, so typing in
+        # them does not prioritize the upload again on every keystroke
+        [State('payment-added-toggle', 'value'),
+        State("counter-filipina-live-in", "value"),
+        State("counter-african-live-in", "value"),
+        State("counter-ethiopian-live-in", "value"),
+        State("counter-filipina-live-out", "value"),
+        State("counter-african-live-out", "value"),
+        State("threshold-filipina-live-in", "value"),
+        State("threshold-african-live-in", "value"),
+        State("threshold-ethiopian-live-in", "value"),
+        State("threshold-filipina-live-out", "value"),
+        State("threshold-african-live-out", "value"),
+        State("mv-urgency-days", "value"),
+        State("last-day-in-country", "value")],
+    )
+    def update_preview(key, report_type, sheet_index, page_current, page_size, sort_by, filter_query, n_clicks_apply, payment_added,
+                       counter_filipina_live_in, counter_african_live_in, counter_ethiopian_live_in,
+                       counter_filipina_live_out, counter_african_live_out,
+                       threshold_filipina_live_in, threshold_african_live_in, threshold_ethiopian_live_in,
+                       threshold_filipina_live_out, threshold_african_live_out,
+                       mv_urgency_days, last_day_in_country):
+        """Send one page of the selected sheet, filtered and sorted on the server."""
+        if key is None:
+            return [], 1, "Upload a file to preview its prioritized rows."
+        df = cached_upload(key)
+        if df is None:
+            return [], 1, "The upload is no longer cached, please upload the file again."
+
+        priority_counters, priority_thresholds, params = input_settings(
+            [counter_filipina_live_in, counter_african_live_in, counter_ethiopian_live_in, counter_filipina_live_out, counter_african_live_out],
+            [threshold_filipina_live_in, threshold_african_live_in, threshold_ethiopian_live_in, threshold_filipina_live_out, threshold_african_live_out],
+            mv_urgency_days, last_day_in_country)
+
+        sheet_name = REPORT_TYPES[report_type]['sheets'][int(sheet_index)]
+        sheets = preview_sheets(df, report_type, payment_added, priority_counters, priority_thresholds, params, REPORT_ENGINE)
+        try:
+            data, page_count, matching = sheet_page(sheets[sheet_name], page_current, page_size, sort_by, filter_query)
+        except ValueError as e:
+            return [], 1, str(e)
+        return data, page_count, f"{sheet_name}: {matching} of {len(sheets[sheet_name])} rows"
+
+
+    def parse_sweep_values(text):
+        """Parse a comma-separated list of sweep values, ignoring blanks."""
+        return [float(value) for value in (text or '').split(',') if value.strip()]
+
+    def create_sweep_heatmap(counts, priority_names):
+        """Heatmap of maids per priority (rows) for every sweep grid point (columns)."""
+        if isinstance(counts.index, pd.MultiIndex):
+            labels = [", ".join(f"{name}={value:g}" for name, value in zip(counts.index.names, point)) for point in counts.index]
+        else:
+            labels = [f"{counts.index.name}={value:g}" for value in counts.index]
+        figure = go.Figure(go.Heatmap(
+            z=counts.to_numpy().T,
+            x=labels,
+            y=[priority_names[p] for p in counts.columns],
+            colorscale='Blues',
+            text=counts.to_numpy().T,
+            texttemplate="%{text}",
+            hovertemplate="%{x}<br>%{y}: %{z}<extra></extra>",
+        ))
+        figure.update_layout(
+            height=max(400, 28 * len(counts.columns)),
+            margin=dict(l=10, r=10, t=30, b=10),
+            yaxis=dict(autorange='reversed'),
+        )
+        return dcc.Graph(figure=figure)
+
+    @app.callback(
+        Output('sweep-output', 'children'),
+        Input('btn-run-sweep', 'n_clicks'),
+        [State('upload-key', 'data'),
+        State('payment-added-toggle', 'value'),
+        State('sweep-param-1', 'value'),
+        State('sweep-values-1', 'value'),
+        State('sweep-param-2', 'value'),
+        State('sweep-values-2', 'value'),
+        State("counter-filipina-live-in", "value"),
+        State("counter-african-live-in", "value"),
+        State("counter-ethiopian-live-in", "value"),
+        State("counter-filipina-live-out", "value"),
+        State("counter-african-live-out", "value"),
+        State("threshold-filipina-live-in", "value"),
+        State("threshold-african-live-in", "value"),
+        State("threshold-ethiopian-live-in", "value"),
+        State("threshold-filipina-live-out", "value"),
+        State("threshold-african-live-out", "value"),
+        State("mv-urgency-days", "value"),
+        State("last-day-in-country", "value")],
+        background=True,
+        manager=background_manager,
+        running=[(Output('btn-run-sweep', 'disabled'), True, False)],
+        prevent_initial_call=True,
+    )
+    def run_sweep(n_clicks, key, payment_added,
+                  sweep_param_1, sweep_values_1, sweep_param_2, sweep_values_2,
+                  counter_filipina_live_in, counter_african_live_in, counter_ethiopian_live_in,
+                  counter_filipina_live_out, counter_african_live_out,
+                  threshold_filipina_live_in, threshold_african_live_in, threshold_ethiopian_live_in,
+                  threshold_filipina_live_out, threshold_african_live_out,
+                  mv_urgency_days, last_day_in_country):
+        """Count maids per priority over a grid of one or two parameters for the Combined sheet.
+
+        Runs as a background job on the upload already parsed into the upload store.
+        """
+        if key is None:
+            return html.Div(['Please upload a file before running a sweep.'], className="text-danger")
+
+        df = cached_upload(key)
+        if df is None:
+            return html.Div(['The upload is no longer cached, please upload the file again.'], className="text-danger")
+
+        grid = {}
+        try:
+            grid[sweep_param_1] = parse_sweep_values(sweep_values_1)
+            if sweep_param_2 and sweep_param_2 != sweep_param_1:
+                grid[sweep_param_2] = parse_sweep_values(sweep_values_2)
+        except ValueError:
+            return html.Div(['Sweep values must be numbers separated by commas.'], className="text-danger")
+        if not all(grid.values()):
+            return html.Div(['Enter at least one value for every sweep parameter.'], className="text-danger")
+
+        priority_counters, priority_thresholds, params = input_settings(
+            [counter_filipina_live_in, counter_african_live_in, counter_ethiopian_live_in, counter_filipina_live_out, counter_african_live_out],
+            [threshold_filipina_live_in, threshold_african_live_in, threshold_ethiopian_live_in, threshold_filipina_live_out, threshold_african_live_out],
+            mv_urgency_days, last_day_in_country)
+
+        _, is_approved, is_rejected = prepare_report_frame(df)
+        selection = is_approved | is_rejected
+        if payment_added in ["Yes", "No"]:
+            selection = selection & (df['Payment added?'] == payment_added).to_numpy(dtype=bool)
 
+        counts = sweep_priority_counts(df, params, priority_counters, priority_thresholds, grid, selection)
+        return create_sweep_heatmap(counts, get_priority_names(params))
 
     # Add a callback to update the download button based on file upload
     @app.callback(
@@ -721,4 +748,5 @@ def register_callbacks(app):
         return False, False, False
 # register_callbacks(app)
 if __name__ == '__main__':
+    register_report_downloads(app.server)
     app.run_server(debug=True, port=7001)
\ No newline at end of file
@@ -0,0 +1,174 @@
+"""Headless prioritization: write the Prioritization page's report workbooks for export files.
+
+    python prioritize_cli.py exports/ --report combined --report top --output-dir reports/
+
+Each input file is processed in its own worker process, so several regional
+exports run in parallel across cores.
+"""
+import argparse
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from priority_delta import export_source
+from priority_engine import read_typed_export
+from priority_reports import (CAPPED_PRIORITIES, DEFAULT_PARAMS, DEFAULT_THRESHOLDS, EXPORT_COLUMNS, REPORT_TYPES, build_report,
+                              build_report_chunked)
+
+# Files read_export accepts; .csv and .tsv are both UTF-16 tab-separated text
+EXPORT_EXTENSIONS = ('.xlsx', '.csv', '.tsv', '.json')
+TEXT_EXPORT_EXTENSIONS = ('.csv', '.tsv')
+
+
+def find_exports(paths):
+    """Expand the given files and directories into the export files to process."""
+    exports = []
+    for path in paths:
+        if os.path.isdir(path):
+            exports.extend(sorted(os.path.join(path, name) for name in os.listdir(path)
+                                  if name.lower().endswith(EXPORT_EXTENSIONS) and not name.startswith('~$')))
+        elif os.path.isfile(path):
+            exports.append(path)
+        else:
+            raise FileNotFoundError(f"No such file or directory: {path}")
+    return exports
+
+
+def clashing_exports(exports, key):
+    """The exports that share key(path) with another, as '; '-separated groups of paths."""
+    groups = {}
+    for path in exports:
+        groups.setdefault(key(path), []).append(path)
+    return "; ".join(", ".join(paths) for paths in groups.values() if len(paths) > 1)
+
+
+def check_output_stems(exports, snapshot_dir=None):
+    """Raise ValueError if two exports would overwrite each other's reports or snapshot.
+
+    Reports are named after the export's file name stem, and with snapshot_dir
+    each export replaces the snapshot of its source (see priority_delta.export_source).
+    """
+    clashes = clashing_exports(exports, lambda path: os.path.splitext(os.path.basename(path))[0])
+    if clashes:
+        raise ValueError(f"These exports would write reports with the same names, rename them or run them separately: {clashes}")
+    clashes = clashing_exports(exports, export_source) if snapshot_dir else None
+    if clashes:
+        raise ValueError(f"These exports are of the same source and would replace each other's snapshot, run them separately: {clashes}")
+
+
+def prioritize_file(path, output_dir, report_types, payment_added, priority_counters, priority_thresholds, params, chunksize=None,
+                    engine='pandas', parquet=False, snapshot_dir=None):
+    """Read one export and write each requested report next to the others in output_dir.
+
+    With chunksize, a .csv/.tsv export is streamed chunksize rows at a time
+    once per report instead of being loaded whole. With engine='duckdb' or
+    'polars', a .csv/.tsv export is queried in place (or through its cached
+    Parquet copy with parquet=True) instead of being loaded into pandas first.
+    With snapshot_dir, each report is diffed against the previous day's export
+    of the same source and gets a Movers sheet (see priority_delta).
+    """
+    is_csv = path.lower().endswith(TEXT_EXPORT_EXTENSIONS)
+    stream = chunksize and is_csv and engine == 'pandas' and not snapshot_dir
+    if stream:
+        df = None
+    elif engine in ('duckdb', 'polars') and is_csv and not snapshot_dir:
+        if parquet:
+            from priority_duckdb import parquet_copy
+            df = parquet_copy(path, EXPORT_COLUMNS)
+        else:
+            df = path
+    else:
+        with open(path, 'rb') as f:
+            df = read_typed_export(f.read(), os.path.basename(path), EXPORT_COLUMNS)
+
+    stem = os.path.splitext(os.path.basename(path))[0]
+    written = []
+    for report_type in report_types:
+        output_path = os.path.join(output_dir, f"{stem}_{REPORT_TYPES[report_type]['filename']}")
+        if stream:
+            with open(path, 'rb') as f:
+                build_report_chunked(f, report_type, payment_added, priority_counters, priority_thresholds, params, chunksize, output=output_path)
+        else:
+            build_report(df, report_type, payment_added, priority_counters, priority_thresholds, params,
+                         engine=engine, snapshot_dir=snapshot_dir, output=output_path, snapshot_source=export_source(path))
+        written.append(output_path)
+    return written
+
+
+def add_settings_arguments(parser):
+    """Add the payment toggle, parameter, counter and threshold flags shared with watch_exports."""
+    parser.add_argument('--payment-added', choices=['Combined', 'Yes', 'No'], default='No')
+    parser.add_argument('--mv-urgency-days', type=int, default=DEFAULT_PARAMS['mv_urgency_days'])
+    parser.add_argument('--last-day-in-country', type=int, default=DEFAULT_PARAMS['last_day_in_country'])
+    for flag, (_, threshold_name) in CAPPED_PRIORITIES.items():
+        parser.add_argument(f'--counter-{flag}', type=int, default=0)
+        parser.add_argument(f'--threshold-{flag}', type=int, default=DEFAULT_THRESHOLDS[threshold_name])
+
+
+def settings_from_args(args):
+    """(priority_counters, priority_thresholds, params) from the flags added by add_settings_arguments."""
+    priority_counters = {p: getattr(args, f"counter_{flag.replace('-', '_')}") for flag, (p, _) in CAPPED_PRIORITIES.items()}
+    priority_thresholds = {name: getattr(args, f"threshold_{flag.replace('-', '_')}") for flag, (_, name) in CAPPED_PRIORITIES.items()}
+    params = {'mv_urgency_days': args.mv_urgency_days, 'last_day_in_country': args.last_day_in_country}
+    return priority_counters, priority_thresholds, params
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Write maid document prioritization reports for one or more exports.")
+    parser.add_argument('paths', nargs='+', help="Export files (.xlsx, UTF-16 .csv/.tsv or .json) or directories containing them")
+    parser.add_argument('--output-dir', default='.', help="Directory the report workbooks are written to")
+    parser.add_argument('--report', dest='reports', action='append', choices=list(REPORT_TYPES),
+                        help="Report to write, may be repeated (default: combined)")
+    add_settings_arguments(parser)
+    parser.add_argument('--chunksize', type=int, default=None,
+                        help="Stream .csv/.tsv exports this many rows at a time to bound memory on very large files")
+    parser.add_argument('--engine', choices=['pandas', 'duckdb', 'polars'], default='pandas',
+                        help="Run the rules in pandas, as SQL in an embedded DuckDB or as lazy Polars queries "
+                             "(the last two need the duckdb or polars package, see requirements-engines.txt)")
+    parser.add_argument('--parquet', action='store_true',
+                        help="With --engine duckdb or polars, query a cached Parquet copy of each .csv/.tsv export (written with duckdb)")
+    parser.add_argument('--snapshot-dir', default=None,
+                        help="Keep a daily snapshot of each export source here, diff each export against its source's "
+                             "snapshot from an earlier day and add a Movers sheet")
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes (default: one per core, at most one per file)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    exports = find_exports(args.paths)
+    if not exports:
+        print("No export files found.")
+        return 1
+    try:
+        check_output_stems(exports, args.snapshot_dir)
+    except ValueError as e:
+        print(e)
+        return 1
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    report_types = args.reports or ['combined']
+    priority_counters, priority_thresholds, params = settings_from_args(args)
+
+    workers = min(args.workers or os.cpu_count() or 1, len(exports))
+    failed = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(prioritize_file, path, args.output_dir, report_types, args.payment_added,
+                        priority_counters, priority_thresholds, params, args.chunksize, args.engine, args.parquet,
+                        args.snapshot_dir): path
+            for path in exports
+        }
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                for output_path in future.result():
+                    print(f"{path} -> {output_path}")
+            except Exception as e:
+                failed += 1
+                print(f"Failed to process {path}: {e}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
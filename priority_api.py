@@ -0,0 +1,192 @@
+"""HTTP API over the prioritization engine, for bots that cannot drive the page.
+
+    curl --data-binary @export.csv -H 'Content-Type: text/csv' \
+         'https://host/api/prioritize?report=top&sheet=Combined&threshold-filipina-live-in=90'
+
+The export is the request body or a multipart 'file' field: an .xlsx
+workbook, a UTF-16 tab-separated .csv/.tsv or a JSON list of row objects,
+optionally gzipped (Content-Encoding: gzip or a .gz file name). Exports are
+parsed in the web worker, so a request body over API_MAX_EXPORT_BYTES (after
+un-gzipping too) is turned away with a 413. Parsed exports
+share the upload cache with the Prioritization page. The ranked rows of one
+sheet come back as JSON records, or as an Arrow IPC stream with format=arrow.
+"""
+import json
+import os
+import zipfile
+import zlib
+
+from flask import Response, jsonify, request
+
+from priority_engine import read_typed_export
+from priority_reports import (CAPPED_PRIORITIES, DEFAULT_PARAMS, EXPORT_COLUMNS, REPORT_ENGINE, REPORT_TYPES, prioritize_report,
+                              report_sheets)
+from upload_cache import MissingColumnsError, parse_upload_bytes
+
+try:
+    import pyarrow as pa
+except ImportError:  # optional dependency, only needed for format=arrow
+    pa = None
+
+ARROW_MIMETYPE = 'application/vnd.apache.arrow.stream'
+
+# Largest export the API parses, as sent and once un-gzipped
+API_MAX_EXPORT_BYTES = int(os.environ.get('API_MAX_EXPORT_BYTES', 64 * 1024 * 1024))
+
+# File name implied by the Content-Type of a raw request body, when none is given
+CONTENT_TYPE_FILENAMES = {
+    'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet': 'export.xlsx',
+    'text/csv': 'export.csv',
+    'text/tab-separated-values': 'export.tsv',
+    'application/json': 'export.json',
+}
+
+
+class BadRequest(ValueError):
+    """The request cannot be prioritized as sent."""
+
+    status = 400
+
+
+class ExportTooLarge(BadRequest):
+    """The export is over API_MAX_EXPORT_BYTES."""
+
+    status = 413
+
+    def __init__(self):
+        super().__init__(f"The export is larger than the {API_MAX_EXPORT_BYTES} bytes the API accepts.")
+
+
+def gunzip(data):
+    """Un-gzip data, stopping once it grows past API_MAX_EXPORT_BYTES."""
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    try:
+        decoded = decompressor.decompress(data, API_MAX_EXPORT_BYTES + 1)
+    except zlib.error as e:
+        raise BadRequest(f"The export is not valid gzip data: {e}")
+    if len(decoded) > API_MAX_EXPORT_BYTES:
+        raise ExportTooLarge()
+    if not decompressor.eof:
+        raise BadRequest("The export is not valid gzip data: it ends before the compressed stream does")
+    return decoded
+
+
+def read_request_export():
+    """The uploaded export's bytes and file name, un-gzipped.
+
+    The body must come with a Content-Length, so an oversized one is refused
+    before it is read.
+    """
+    if request.content_length is None:
+        raise BadRequest("Send the export with a Content-Length header.")
+    if request.content_length > API_MAX_EXPORT_BYTES:
+        raise ExportTooLarge()
+    upload = request.files.get('file')
+    if upload is not None:
+        decoded, filename = upload.read(), upload.filename or ''
+    else:
+        decoded = request.get_data()
+        filename = request.args.get('filename') or CONTENT_TYPE_FILENAMES.get(request.mimetype, '')
+    if not decoded:
+        raise BadRequest("No export was sent: post it as the request body or as a multipart 'file' field.")
+
+    if request.headers.get('Content-Encoding') == 'gzip' or filename.endswith('.gz'):
+        decoded = gunzip(decoded)
+        filename = filename[:-len('.gz')] if filename.endswith('.gz') else filename
+    if not any(kind in filename for kind in ('xlsx', 'csv', 'tsv', 'json')):
+        raise BadRequest("Unsupported export type: send an .xlsx, .csv, .tsv or .json file, or set a matching Content-Type.")
+    return decoded, filename
+
+
+def parse_request_export(decoded, filename):
+    """The typed DataFrame of an uploaded export; one that cannot be decoded or parsed is a BadRequest."""
+    try:
+        return parse_upload_bytes(decoded, filename, read=read_typed_export, columns=EXPORT_COLUMNS)
+    except (ValueError, EOFError, zipfile.BadZipFile) as e:
+        # Covers text that is not UTF-16, malformed CSV or JSON and corrupt or truncated workbooks.
+        # Other errors, such as an OSError from the upload store, are the server's and give a 500
+        raise BadRequest(f"The export could not be read: {e}")
+
+
+def int_arg(name, default=None):
+    value = request.args.get(name)
+    if value is None or value == '':
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise BadRequest(f"{name} must be a whole number, not {value!r}")
+
+
+def read_settings():
+    """Report type, sheet, payment toggle, counters, thresholds and parameters from the query string."""
+    report_type = request.args.get('report', 'combined')
+    if report_type not in REPORT_TYPES:
+        raise BadRequest(f"Unknown report {report_type!r}, expected one of: {', '.join(REPORT_TYPES)}")
+    sheet_names = REPORT_TYPES[report_type]['sheets']
+    # The Combined sheet by default
+    sheet_name = request.args.get('sheet', sheet_names[2])
+    if sheet_name not in sheet_names:
+        raise BadRequest(f"Unknown sheet {sheet_name!r} for the {report_type} report, expected one of: {', '.join(sheet_names)}")
+    payment_added = request.args.get('payment_added', 'No')
+    if payment_added not in ('Yes', 'No', 'Combined'):
+        raise BadRequest("payment_added must be Yes, No or Combined")
+
+    priority_counters = {priority: int_arg(f'counter-{flag}', 0) for flag, (priority, _) in CAPPED_PRIORITIES.items()}
+    priority_thresholds = {name: value for flag, (_, name) in CAPPED_PRIORITIES.items()
+                           if (value := int_arg(f'threshold-{flag}')) is not None}
+    params = {name: int_arg(name, default) for name, default in DEFAULT_PARAMS.items()}
+    return report_type, sheet_name, payment_added, priority_counters, priority_thresholds, params
+
+
+def stats_json(stats):
+    """The Accepted/Rejected counts per priority, plus the per-rule hits and timings when the engine gives them."""
+    counts = {title: {name: {column: int(count) for column, count in row.items()} for name, row in stats[title].iterrows()}
+              for title in ('Accepted', 'Rejected')}
+    if stats.get('Rules') is not None:
+        counts['Rules'] = json.loads(stats['Rules'].to_json(orient='index'))
+    return counts
+
+
+def arrow_response(sheet):
+    if pa is None:
+        raise BadRequest("format=arrow needs the pyarrow package on the server; ask for JSON instead.")
+    table = pa.Table.from_pandas(sheet, preserve_index=False)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return Response(sink.getvalue().to_pybytes(), mimetype=ARROW_MIMETYPE)
+
+
+def json_response(report_type, sheet_name, sheet, stats):
+    # pandas converts the cells (NaN to null, numpy numbers to JSON numbers); json.dumps keeps
+    # the sheet's column order, which jsonify would sort
+    rows = json.loads(sheet.to_json(orient='records'))
+    body = {'report': report_type, 'sheet': sheet_name, 'row_count': len(sheet), 'stats': stats_json(stats), 'rows': rows}
+    return Response(json.dumps(body), mimetype='application/json')
+
+
+def register_routes(server):
+    """Add the prioritization API to the Flask server behind the Dash app."""
+
+    @server.route('/api/prioritize', methods=['POST'])
+    def prioritize_export():
+        try:
+            decoded, filename = read_request_export()
+            report_type, sheet_name, payment_added, priority_counters, priority_thresholds, params = read_settings()
+            df = parse_request_export(decoded, filename)
+            sheets, non_african, stats = prioritize_report(df, report_type, payment_added, priority_counters, priority_thresholds,
+                                                           params, engine=REPORT_ENGINE)
+            sheet = report_sheets(REPORT_TYPES[report_type], sheets, non_african)[sheet_name]
+
+            wants_arrow = request.args.get('format') == 'arrow' or request.accept_mimetypes.best == ARROW_MIMETYPE
+            if wants_arrow:
+                return arrow_response(sheet)
+            return json_response(report_type, sheet_name, sheet, stats)
+        except BadRequest as e:
+            return jsonify({'error': str(e)}), e.status
+        except MissingColumnsError as e:
+            return jsonify({'error': str(e)}), 400
+        except Exception as e:
+            print("Prioritization API request failed:", e)
+            return jsonify({'error': "There was an error processing this export."}), 500
@@ -0,0 +1,217 @@
+"""Delta prioritization against the previous export's snapshot.
+
+Each prioritized export is kept as a Parquet snapshot: its typed rows plus,
+per row, a fingerprint of the columns the rules read and the bitmask of rules
+it matched before caps. The next export is diffed against the snapshot by
+Request ID and only new or changed rows go through rule evaluation; every row
+is then sliced, capped and sorted as usual, since capped counts depend on the
+whole slice. The movers report lists the rows that entered, left or changed
+priority in the report's Combined sheet since the previous export.
+
+A snapshot directory holds one snapshot per export source and date
+(snapshot-<source>-YYYY-MM-DD.parquet), the latest export of that source on
+that day. The source is the export's file name without its date stamp (see
+export_source), so regional exports processed the same day each keep their
+own snapshots. An export is compared with the newest snapshot of its source
+from an earlier date, so generating several reports from one upload, or
+uploading another export of the source the same day, keeps comparing with the
+previous day's export. Snapshots are read and replaced under a lock on the
+directory, since report jobs may run concurrently.
+"""
+import contextlib
+import datetime
+import fcntl
+import hashlib
+import json
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+from priority_engine import (DAY_COLUMNS, PRIORITY_RULES, evaluate_rules, evaluation_rule_bits, rule_columns, rules_hash,
+                             priority_names as get_priority_names)
+from priority_reports import DEFAULT_PARAMS, REPORT_TYPES, prioritize_report, report_sheets
+
+SNAPSHOT_FILE = re.compile(r'snapshot-(?P<source>.+)-(?P<date>\d{4}-\d{2}-\d{2})\.parquet')
+SNAPSHOT_LOCK = '.lock'
+
+# Source of exports whose file name is not known
+DEFAULT_SOURCE = 'export'
+
+# Date and time stamps in export file names, e.g. 2024-05-01, 20240501 or 2024-05-01_0930
+DATE_STAMP = re.compile(r'\d{4}-?\d{2}-?\d{2}(?:[T_ -]?\d{2}[:.-]?\d{2}(?:[:.-]?\d{2})?)?')
+
+MOVERS_COLUMNS = ['Change', 'Request ID', 'Housemaid Name', 'Housemaid Nationality',
+                  'Previous priority', 'Previous Priority Name', 'Priority number', 'Priority Name']
+
+
+def row_fingerprints(df, columns):
+    """64-bit hash of each row's values in columns, independent of dtype downcasting and category order."""
+    frame = pd.DataFrame({column: df[column].astype('float64') if column in DAY_COLUMNS else df[column] for column in columns})
+    return pd.util.hash_pandas_object(frame, index=False).to_numpy()
+
+
+def export_digest(df):
+    """Content hash of a typed export, identifying the same upload across reports."""
+    return hashlib.sha256(row_fingerprints(df, list(df.columns)).tobytes()).hexdigest()
+
+
+def evaluation_key(params, rules=PRIORITY_RULES):
+    """The rule spec and parameters a snapshot's rule bits were evaluated with."""
+    return json.dumps([rules_hash(rules), {**DEFAULT_PARAMS, **params}], sort_keys=True)
+
+
+def export_source(filename):
+    """The source an export file belongs to: its name without directory, extension or date stamps.
+
+    'exports/dubai_2024-05-01.csv' and 'dubai-20240502.xlsx' are both 'dubai'.
+    """
+    stem = os.path.splitext(os.path.basename(filename or ''))[0]
+    source = re.sub(r'[^A-Za-z0-9]+', '-', DATE_STAMP.sub('', stem)).strip('-').lower()
+    return source or DEFAULT_SOURCE
+
+
+def snapshot_path(snapshot_dir, source, export_date):
+    return os.path.join(snapshot_dir, f"snapshot-{source}-{export_date.isoformat()}.parquet")
+
+
+def snapshot_dates(snapshot_dir, source):
+    """Export dates of the snapshots of source in snapshot_dir, oldest first."""
+    return sorted(datetime.date.fromisoformat(match['date']) for match in map(SNAPSHOT_FILE.fullmatch, os.listdir(snapshot_dir))
+                  if match and match['source'] == source)
+
+
+@contextlib.contextmanager
+def snapshot_lock(snapshot_dir):
+    """Hold an exclusive lock on snapshot_dir, shared with every process using it."""
+    with open(os.path.join(snapshot_dir, SNAPSHOT_LOCK), 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def load_snapshot(path):
+    if not os.path.exists(path):
+        return None
+    return pd.read_parquet(path)
+
+
+def save_snapshot(path, df, fingerprints, rule_bits, digest, key):
+    """Write df with its fingerprints and rule bits as the snapshot at path, atomically."""
+    snapshot = df.reset_index(drop=True)
+    snapshot = snapshot.assign(_fingerprint=fingerprints, _rule_bits=rule_bits)
+    snapshot.attrs = {'digest': digest, 'key': key}
+    partial = f"{path}.{os.getpid()}.tmp"
+    snapshot.to_parquet(partial, index=False)
+    os.replace(partial, path)
+
+
+def snapshot_rows(snapshot):
+    """The export rows of a snapshot, without its bookkeeping columns."""
+    return snapshot.drop(columns=['_fingerprint', '_rule_bits'])
+
+
+def delta_rule_bits(df, params, snapshot=None, rules=PRIORITY_RULES):
+    """evaluation_rule_bits for df, reusing the snapshot's for rows whose rule inputs are unchanged.
+
+    Rows are matched on Request ID; a row whose fingerprint differs, or that
+    is new, is evaluated. Nothing is reused when the snapshot was evaluated
+    with other parameters or rules. Returns (rule_bits, fingerprints, reused row count).
+    """
+    fingerprints = row_fingerprints(df, rule_columns(rules))
+    rule_bits = np.zeros(len(df), dtype=np.uint32)
+    fresh = np.ones(len(df), dtype=bool)
+    if snapshot is not None and snapshot.attrs.get('key') == evaluation_key(params, rules):
+        previous = snapshot.drop_duplicates('Request ID', keep='last')
+        positions = pd.Index(previous['Request ID']).get_indexer(df['Request ID'])
+        found = positions >= 0
+        unchanged = found.copy()
+        unchanged[found] = previous['_fingerprint'].to_numpy()[positions[found]] == fingerprints[found]
+        rule_bits[unchanged] = previous['_rule_bits'].to_numpy()[positions[unchanged]]
+        fresh = ~unchanged
+
+    if fresh.all():
+        # Evaluate df itself so the masks cached for it by prepare_rule_cache are reused
+        rule_bits = evaluation_rule_bits(evaluate_rules(df, params, rules))
+    elif fresh.any():
+        rule_bits[fresh] = evaluation_rule_bits(evaluate_rules(df[fresh], params, rules))
+    return rule_bits, fingerprints, int((~fresh).sum())
+
+
+def find_movers(previous_sheet, sheet, priority_names):
+    """Rows that entered or left sheet, or changed priority, since previous_sheet; matched on Request ID."""
+    columns = ['Request ID', 'Housemaid Name', 'Housemaid Nationality', 'Priority number']
+    previous = previous_sheet[columns].drop_duplicates('Request ID').astype({'Housemaid Name': object, 'Housemaid Nationality': object})
+    current = sheet[columns].drop_duplicates('Request ID').astype({'Housemaid Name': object, 'Housemaid Nationality': object})
+    both = previous.merge(current, on='Request ID', how='outer', suffixes=(' previous', ''), indicator=True, sort=False)
+
+    change = np.select([both['_merge'] == 'right_only', both['_merge'] == 'left_only',
+                        both['Priority number previous'] != both['Priority number']],
+                       ['entered', 'left', 'changed'], '')
+    movers = pd.DataFrame({
+        'Change': change,
+        'Request ID': both['Request ID'],
+        'Housemaid Name': both['Housemaid Name'].fillna(both['Housemaid Name previous']),
+        'Housemaid Nationality': both['Housemaid Nationality'].fillna(both['Housemaid Nationality previous']),
+        'Previous priority': both['Priority number previous'].astype('Int64'),
+        'Previous Priority Name': both['Priority number previous'].map(priority_names),
+        'Priority number': both['Priority number'].astype('Int64'),
+        'Priority Name': both['Priority number'].map(priority_names),
+    })[change != '']
+    order = {'entered': 0, 'changed': 1, 'left': 2}
+    return (movers.assign(_order=movers['Change'].map(order), _priority=movers['Priority number'].fillna(movers['Previous priority']))
+            .sort_values(['_order', '_priority'], kind='stable').drop(columns=['_order', '_priority'])[MOVERS_COLUMNS]
+            .reset_index(drop=True))
+
+
+def prioritize_delta(df, report_type, payment_added='No', priority_counters=None, priority_thresholds=None, params=None,
+                     snapshot_dir=None, prefilters=None, export_date=None, source=DEFAULT_SOURCE):
+    """prioritize_report using and updating the snapshots in snapshot_dir.
+
+    df is the export of source (see export_source) on export_date (today by
+    default); it is compared with the newest snapshot of source from an
+    earlier date and becomes the snapshot of source for its own date. Returns (sheets, non_african, stats, movers, reused) like
+    prioritize_report, plus the movers DataFrame (None when there is no
+    earlier snapshot) and how many rows reused their snapshot rule bits.
+    """
+    params = {**DEFAULT_PARAMS, **(params or {})}
+    export_date = export_date or datetime.date.today()
+    os.makedirs(snapshot_dir, exist_ok=True)
+    current_path = snapshot_path(snapshot_dir, source, export_date)
+
+    digest = export_digest(df)
+    key = evaluation_key(params)
+    with snapshot_lock(snapshot_dir):
+        earlier = [date for date in snapshot_dates(snapshot_dir, source) if date < export_date]
+        current = load_snapshot(current_path)
+        baseline = load_snapshot(snapshot_path(snapshot_dir, source, earlier[-1])) if earlier else None
+
+    # Rule bits are reused from the closest export: an earlier upload of the same day, or else the baseline
+    rule_bits, fingerprints, reused = delta_rule_bits(df, params, current if current is not None else baseline)
+    sheets, non_african, stats = prioritize_report(df, report_type, payment_added, priority_counters, priority_thresholds, params,
+                                                   rule_bits=rule_bits, prefilters=prefilters)
+
+    movers = None
+    if baseline is not None:
+        baseline_bits = baseline['_rule_bits'].to_numpy() if baseline.attrs.get('key') == key else None
+        baseline_sheets, baseline_non_african, _ = prioritize_report(snapshot_rows(baseline), report_type, payment_added,
+                                                                     priority_counters, priority_thresholds, params, rule_bits=baseline_bits,
+                                                                     prefilters=prefilters, log_rules=False)
+        report = REPORT_TYPES[report_type]
+        combined = report['sheets'][2]
+        movers = find_movers(report_sheets(report, baseline_sheets, baseline_non_african)[combined],
+                             report_sheets(report, list(sheets), non_african)[combined], get_priority_names(params))
+
+    # The same upload again with the same parameters leaves its snapshot as it is; otherwise the
+    # snapshot of the day is replaced, keeping the rule bits of the latest parameters for reuse
+    if current is None or current.attrs.get('digest') != digest or current.attrs.get('key') != key:
+        with snapshot_lock(snapshot_dir):
+            save_snapshot(current_path, df, fingerprints, rule_bits, digest, key)
+            # Snapshots of the source older than the baseline can no longer be compared with
+            for date in snapshot_dates(snapshot_dir, source):
+                if earlier and date < earlier[-1]:
+                    os.remove(snapshot_path(snapshot_dir, source, date))
+    return sheets, non_african, stats, movers, reused
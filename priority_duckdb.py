@@ -0,0 +1,246 @@
+"""DuckDB execution backend for the priority rules.
+
+The rule spec in priority_engine is translated into SQL: one CASE expression
+picks each row's priority, capped rules become running SUM() window counts and
+the per-priority gender statistics are a GROUP BY. Queries run in an embedded
+DuckDB over a typed DataFrame, a UTF-16 TSV export or a Parquet copy of one,
+and return the same sheets and statistics as the pandas path in
+priority_reports.
+"""
+import hashlib
+import os
+import tempfile
+
+import pandas as pd
+
+from priority_engine import (CATEGORICAL_COLUMNS, DAY_COLUMNS, PRIORITY_RULES, NUMERIC_OPERATORS, african_countries,
+                             approved_strings, compile_rules, rejected_strings, rule_bit)
+
+try:
+    import duckdb
+except ImportError:  # optional dependency, only needed for engine='duckdb'
+    duckdb = None
+
+# Parquet copies of exports made by parquet_copy, keyed by file content hash
+PARQUET_CACHE_DIR = os.environ.get('PARQUET_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'chekri-parquet'))
+
+
+def connect():
+    """Open an in-memory DuckDB connection, failing clearly when duckdb is not installed."""
+    if duckdb is None:
+        raise ImportError("The DuckDB engine needs the duckdb package: pip install duckdb")
+    return duckdb.connect()
+
+
+def quote_identifier(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def quote_literal(value):
+    if isinstance(value, str):
+        return "'" + value.replace("'", "''") + "'"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def condition_sql(column, op, value, params):
+    """SQL for one (column, operator, value) rule condition; NULL never satisfies it, like NaN in pandas."""
+    if isinstance(value, dict):
+        value = params[value['param']]
+    column_sql = quote_identifier(column)
+    if op in NUMERIC_OPERATORS:
+        return f"TRY_CAST({column_sql} AS DOUBLE) {op} {quote_literal(float(value))}"
+    if op == '==':
+        return f"{column_sql} = {quote_literal(value)}"
+    if op == '!=':
+        return f"{column_sql} <> {quote_literal(value)}"
+    if op == 'in':
+        return f"{column_sql} IN ({', '.join(quote_literal(item) for item in value)})"
+    raise ValueError(f"Unsupported operator in priority rule: {op!r}")
+
+
+def rule_sql(rule, params):
+    """Boolean SQL for a whole rule, COALESCEd so a NULL condition counts as no match."""
+    if not rule['when']:
+        return "TRUE"
+    return "COALESCE(" + " AND ".join(condition_sql(column, op, value, params) for column, op, value in rule['when']) + ", FALSE)"
+
+
+def typed_select(columns):
+    """SELECT list that applies compact_export's cleaning in SQL: stripped text and mapped 'Docs status'."""
+    approved = ", ".join(quote_literal(status.strip()) for status in approved_strings)
+    rejected = ", ".join(quote_literal(status.strip()) for status in rejected_strings)
+    select = []
+    for column in columns:
+        column_sql = quote_identifier(column)
+        if column == 'Docs status':
+            stripped = f"trim(CAST({column_sql} AS VARCHAR))"
+            select.append(f"CASE WHEN {column_sql} IS NULL OR {stripped} IN ({rejected}) THEN 'Rejected' "
+                          f"WHEN {stripped} IN ({approved}) THEN 'Approved' ELSE {stripped} END AS {column_sql}")
+        elif column in CATEGORICAL_COLUMNS:
+            select.append(f"trim(CAST({column_sql} AS VARCHAR)) AS {column_sql}")
+        elif column in DAY_COLUMNS:
+            select.append(f"TRY_CAST({column_sql} AS DOUBLE) AS {column_sql}")
+        else:
+            select.append(column_sql)
+    return ", ".join(select)
+
+
+def parquet_copy(path, columns=None):
+    """Convert a UTF-16 TSV export to Parquet once and return the copy's path.
+
+    Copies are cached in PARQUET_CACHE_DIR by content hash, so re-running a
+    historical export reads the columnar copy instead of re-parsing the text.
+    """
+    with open(path, 'rb') as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+    os.makedirs(PARQUET_CACHE_DIR, exist_ok=True)
+    target = os.path.join(PARQUET_CACHE_DIR, f"{digest}.parquet")
+    if not os.path.exists(target):
+        con = connect()
+        load_export(con, path, columns)
+        partial = f"{target}.{os.getpid()}.tmp"
+        con.execute(f"COPY (SELECT * FROM export ORDER BY row_no) TO {quote_literal(partial)} (FORMAT PARQUET)")
+        os.replace(partial, target)
+    return target
+
+
+def load_export(con, source, columns=None):
+    """Create the typed 'export' view over source, with a row_no column in file order.
+
+    source is a DataFrame, a UTF-16 TSV (.csv/.tsv) path or a .parquet path
+    written by parquet_copy. Only columns are selected when given.
+    """
+    if isinstance(source, pd.DataFrame):
+        con.register('export_source', source.reset_index(drop=True))
+        from_sql = "export_source"
+    elif source.lower().endswith('.parquet'):
+        from_sql = f"read_parquet({quote_literal(source)})"
+    elif source.lower().endswith(('.csv', '.tsv')):
+        from_sql = f"read_csv({quote_literal(source)}, delim='\\t', header=true, encoding='utf-16'"
+        header = [row[0] for row in con.execute(f"DESCRIBE SELECT * FROM {from_sql}, all_varchar=true)").fetchall()]
+        # Keep text columns as text: type sniffing would turn 'Yes'/'No' columns into booleans
+        text_columns = [column for column in header if column in CATEGORICAL_COLUMNS]
+        if text_columns:
+            from_sql += ", types={" + ", ".join(f"{quote_literal(column)}: 'VARCHAR'" for column in text_columns) + "}"
+        from_sql += ")"
+    else:
+        raise ValueError(f"Unsupported file type for the DuckDB engine: {source}")
+
+    available = [row[0] for row in con.execute(f"DESCRIBE SELECT * FROM {from_sql}").fetchall()]
+    missing = [column for column in columns or [] if column not in available]
+    if missing:
+        raise KeyError(f"The following required columns are missing: {', '.join(missing)}")
+    if 'row_no' in available and not isinstance(source, pd.DataFrame):
+        # A Parquet copy already carries the original file order
+        selected = [column for column in (columns or available) if column != 'row_no']
+        con.execute(f"CREATE OR REPLACE VIEW export AS SELECT row_no, {typed_select(selected)} FROM {from_sql}")
+    else:
+        selected = columns or available
+        con.execute(f"CREATE OR REPLACE VIEW export AS SELECT row_number() OVER () - 1 AS row_no, {typed_select(selected)} FROM {from_sql}")
+
+
+def prioritize_sql(where, params, priority_counters, priority_thresholds, rules=PRIORITY_RULES):
+    """Query giving every row of export that satisfies where its 'Priority number' and 'Matched rules'.
+
+    Capped rules keep a match only while the running count of matches (in
+    file order, within the slice) fits under the threshold minus the counter.
+    """
+    compiled = compile_rules(rules)
+    ordered = sorted(rules, key=lambda rule: rule['priority'])
+    flags = ", ".join(f"{rule_sql(rule, params)} AS r{rule['priority']}" for rule in ordered)
+    capped = []
+    for rule in ordered:
+        priority = rule['priority']
+        if priority in compiled['caps']:
+            remaining = priority_thresholds[compiled['caps'][priority]] - priority_counters[priority]
+            capped.append(f"r{priority} AND SUM(r{priority}::INTEGER) OVER (ORDER BY row_no ROWS UNBOUNDED PRECEDING) <= {remaining} AS m{priority}")
+        else:
+            capped.append(f"r{priority} AS m{priority}")
+    case = " ".join(f"WHEN m{rule['priority']} THEN {rule['priority']}" for rule in ordered)
+    bits = " | ".join(f"(CASE WHEN m{rule['priority']} THEN {rule_bit(rule['priority'])} ELSE 0 END)" for rule in ordered) or "0"
+    return f"""
+        WITH sliced AS (SELECT * FROM export WHERE {where}),
+        flagged AS (SELECT *, {flags} FROM sliced),
+        matched AS (SELECT *, {', '.join(capped)} FROM flagged)
+        SELECT *, CASE {case} ELSE {compiled['unmatched']} END AS "Priority number",
+               CAST({bits} AS UINTEGER) AS "Matched rules"
+        FROM matched
+    """
+
+
+def slice_where(report, payment_added, docs_status, lawp_filter=True):
+    """WHERE clause of one sheet: its docs status(es), the payment toggle and (unless lawp_filter is False) the report's LAWP filter."""
+    where = [f'"Docs status" IN ({", ".join(quote_literal(status) for status in docs_status)})']
+    if payment_added in ["Yes", "No"]:
+        where.append(f'"Payment added?" = {quote_literal(payment_added)}')
+    if report['lawp'] is not None and lawp_filter:
+        where.append(('' if report['lawp'] else 'NOT ') + """COALESCE("Outcome" = 'LAWP', FALSE)""")
+    return " AND ".join(where)
+
+
+def process_slice(con, where, output_columns, priority_counters, priority_thresholds, params, priority_names, rules=PRIORITY_RULES,
+                  targets=None):
+    """process_dataframe for one slice of the export view: the sorted sheet and its gender statistics.
+
+    priority_counters is updated in place with the capped slots used. With
+    targets and no capped rules, other priorities are dropped before the sheet
+    and statistics are built, as prioritize_report_rows does.
+    """
+    query = prioritize_sql(where, params, priority_counters, priority_thresholds, rules)
+    con.execute(f"CREATE OR REPLACE TEMP TABLE prioritized AS {query}")
+
+    caps = compile_rules(rules)['caps']
+    for priority in caps:
+        used = con.execute(f"SELECT COALESCE(SUM(m{priority}::INTEGER), 0) FROM prioritized").fetchone()[0]
+        priority_counters[priority] += int(used)
+    if targets and not caps:
+        con.execute(f'DELETE FROM prioritized WHERE "Priority number" NOT IN ({", ".join(str(target) for target in targets)})')
+
+    names = pd.DataFrame({'Priority number': list(priority_names), 'Priority Name': list(priority_names.values())})
+    con.register('priority_names', names)
+    select = ", ".join('"Priority Name"' if column == 'Priority Name' else f"p.{quote_identifier(column)}" for column in output_columns)
+    sheet = con.execute(f"""
+        SELECT p.row_no, {select}
+        FROM prioritized p LEFT JOIN priority_names n USING ("Priority number")
+        ORDER BY "Priority number", "Been in the table for (in days)" DESC NULLS LAST, p.row_no
+    """).df().set_index('row_no')
+    sheet.index.name = None
+
+    counts = con.execute("""
+        SELECT "Priority number",
+               COUNT(*) FILTER (WHERE "Gender" = 'Male') AS "Males",
+               COUNT(*) FILTER (WHERE "Gender" = 'Female') AS "Females",
+               COUNT(*) AS "Total"
+        FROM prioritized GROUP BY "Priority number"
+    """).df().set_index('Priority number')
+    stats = counts.reindex(list(priority_names), fill_value=0).astype('int64')
+    stats.index = list(priority_names.values())
+    return sheet, stats
+
+
+def prioritize_report_rows_duckdb(source, report, payment_added, sheet_counters, priority_thresholds, params, priority_names,
+                                  export_columns, output_columns, rules=PRIORITY_RULES, targets=None):
+    """DuckDB counterpart of priority_reports.prioritize_report_rows for a whole export."""
+    con = connect()
+    try:
+        load_export(con, source, export_columns)
+        wheres = [slice_where(report, payment_added, ['Approved']),
+                  slice_where(report, payment_added, ['Rejected']),
+                  # The Combined sheet always covers every row
+                  slice_where(report, payment_added, ['Approved', 'Rejected'], lawp_filter=False)]
+        sheets, stats = [], []
+        for where, counters in zip(wheres, sheet_counters):
+            sheet, sheet_stats = process_slice(con, where, output_columns, counters, priority_thresholds, params, priority_names, rules, targets)
+            sheets.append(sheet)
+            stats.append(sheet_stats)
+
+        african = ", ".join(quote_literal(country) for country in african_countries)
+        non_african = con.execute(f"""
+            SELECT row_no, NOT COALESCE("Housemaid Nationality" IN ({african}), FALSE)
+                   OR COALESCE("Housemaid Nationality" = 'Ethiopian', FALSE) AS non_african
+            FROM export ORDER BY row_no
+        """).df().set_index('row_no')['non_african']
+        non_african.index.name = None
+        return sheets, stats[:2], non_african
+    finally:
+        con.close()
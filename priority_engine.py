@@ -0,0 +1,720 @@
+import hashlib
+import itertools
+import json
+import operator
+import time
+import weakref
+
+import numpy as np
+import pandas as pd
+
+from upload_cache import UPLOAD_STORE_MAX_AGE, read_export, upload_key_of, upload_store
+
+# List of African countries for prioritization
+african_countries = [
+    "Algeria", "Algerian", "Algerians", "Algerian (adj.)",
+    "Angola", "Angolan", "Angolans", "Angolan (adj.)",
+    "Benin", "Beninese", "Beninese (plural)", "Beninese (adj.)",
+    "Botswana", "Botswanan", "Botswanans", "Botswanan (adj.)",
+    "Burkina Faso", "Burkinabe", "Burkinabe (plural)", "Burkinabe (adj.)",
+    "Burundi", "Burundian", "Burundians", "Burundian (adj.)",
+    "Cabo Verde", "Cabo Verdean", "Cabo Verdeans", "Cabo Verdean (adj.)",
+    "Cameroon", "Cameroonian", "Cameroonians", "Cameroonian (adj.)",
+    "Central African Republic", "Central African", "Central Africans", "Central African (adj.)",
+    "Chad", "Chadian", "Chadians", "Chadian (adj.)",
+    "Comoros", "Comoran", "Comorans", "Comoran (adj.)",
+    "Democratic Republic of the Congo", "Congolese (Democratic Republic)", "Congolese (plural)", "Congolese (Democratic Republic adj.)",
+    "Republic of the Congo", "Congolese (Republic)", "Congolese (plural)", "Congolese (Republic adj.)",
+    "Djibouti", "Djiboutian", "Djiboutians", "Djiboutian (adj.)",
+    "Egypt", "Egyptian", "Egyptians", "Egyptian (adj.)",
+    "Equatorial Guinea", "Equatoguinean", "Equatoguineans", "Equatoguinean (adj.)",
+    "Eritrea", "Eritrean", "Eritreans", "Eritrean (adj.)",
+    "Eswatini", "Swazi", "Swazis", "Swazi (adj.)",
+    "Ethiopia", "Ethiopian", "Ethiopians", "Ethiopian (adj.)",
+    "Gabon", "Gabonese", "Gabonese (plural)", "Gabonese (adj.)",
+    "Gambia", "Gambian", "Gambians", "Gambian (adj.)",
+    "Ghana", "Ghanaian", "Ghanaians", "Ghanaian (adj.)",
+    "Guinea", "Guinean", "Guineans", "Guinean (adj.)",
+    "Guinea-Bissau", "Bissau-Guinean", "Bissau-Guineans", "Bissau-Guinean (adj.)",
+    "Ivory Coast", "Ivorian", "Ivorians", "Ivorian (adj.)",
+    "Kenya", "Kenyan", "Kenyans", "Kenyan (adj.)",
+    "Lesotho", "Mosotho", "Basotho", "Basotho (adj.)",
+    "Liberia", "Liberian", "Liberians", "Liberian (adj.)",
+    "Libya", "Libyan", "Libyans", "Libyan (adj.)",
+    "Madagascar", "Malagasy", "Malagasy (plural)", "Malagasy (adj.)",
+    "Malawi", "Malawian", "Malawians", "Malawian (adj.)",
+    "Mali", "Malian", "Malians", "Malian (adj.)",
+    "Mauritania", "Mauritanian", "Mauritanians", "Mauritanian (adj.)",
+    "Mauritius", "Mauritian", "Mauritians", "Mauritian (adj.)",
+    "Morocco", "Moroccan", "Moroccans", "Moroccan (adj.)",
+    "Mozambique", "Mozambican", "Mozambicans", "Mozambican (adj.)",
+    "Namibia", "Namibian", "Namibians", "Namibian (adj.)",
+    "Niger", "Nigerien", "Nigeriens", "Nigerien (adj.)",
+    "Nigeria", "Nigerian", "Nigerians", "Nigerian (adj.)",
+    "Rwanda", "Rwandan", "Rwandans", "Rwandan (adj.)",
+    "São Tomé and Príncipe", "São Toméan", "São Toméans", "São Toméan (adj.)",
+    "Senegal", "Senegalese", "Senegalese (plural)", "Senegalese (adj.)",
+    "Seychelles", "Seychellois", "Seychellois (plural)", "Seychellois (adj.)",
+    "Sierra Leone", "Sierra Leonean", "Sierra Leoneans", "Sierra Leonean (adj.)",
+    "Somalia", "Somali", "Somalis", "Somali (adj.)",
+    "South Africa", "South African", "South Africans", "South African (adj.)",
+    "South Sudan", "South Sudanese", "South Sudanese (plural)", "South Sudanese (adj.)",
+    "Sudan", "Sudanese", "Sudanese (plural)", "Sudanese (adj.)",
+    "Tanzania", "Tanzanian", "Tanzanians", "Tanzanian (adj.)",
+    "Togo", "Togolese", "Togolese (plural)", "Togolese (adj.)",
+    "Tunisia", "Tunisian", "Tunisians", "Tunisian (adj.)",
+    "Uganda", "Ugandan", "Ugandans", "Ugandan (adj.)",
+    "Zambia", "Zambian", "Zambians", "Zambian (adj.)",
+    "Zimbabwe", "Zimbabwean", "Zimbabweans", "Zimbabwean (adj.)"
+]
+
+
+# Docs status values as they appear in the exports
+approved_strings = [' Approved', 'Approved', 'Approved ', ' Approved ', 'Maid is already verified and accepted']
+rejected_strings = [' Rejected', 'Rejected', 'Rejected ', ' Rejected ', 'NA', ' ']
+
+# Low-cardinality text columns stored as pandas Categorical, so rule
+# comparisons run on integer codes
+CATEGORICAL_COLUMNS = [
+    'Housemaid Nationality', 'Housemaid Status', 'Housemaid Type', 'Live out', 'Docs status', 'Gender', 'Outcome',
+    'Stage in Freedom Operator Page', 'Client Note', 'Attested GCC', 'MFA', 'GCC', 'Payment added?', 'MB?', 'Has Contract MB?',
+]
+DAY_COLUMNS = ['Flight in (days)', 'Been in the table for (in days)', 'Last day to stay in country in']
+
+
+def _stripped_category(series, mapping=None):
+    """Strip whitespace (and apply mapping) on the distinct values only, returning a Categorical."""
+    codes, uniques = pd.factorize(series)
+    cleaned = [value.strip() if isinstance(value, str) else value for value in uniques]
+    if mapping:
+        cleaned = [mapping.get(value, value) for value in cleaned]
+    category_codes, categories = pd.factorize(pd.Index(cleaned, dtype=object))
+    codes = np.where(codes >= 0, category_codes[codes] if len(category_codes) else -1, -1)
+    return pd.Categorical.from_codes(codes, categories)
+
+
+def _compact_days(series):
+    """Coerce a day column to the smallest numeric dtype that holds it without loss."""
+    values = pd.to_numeric(series, errors='coerce')
+    if len(values) and values.notna().all() and (values % 1 == 0).all():
+        return pd.to_numeric(values.astype('int64'), downcast='integer')
+    compact = values.astype('float32')
+    if (compact.astype('float64') == values)[values.notna()].all():
+        return compact
+    return values.astype('float64')
+
+
+def compact_export(df):
+    """Typed load step for a maid export.
+
+    Strips whitespace, maps every approved/rejected spelling of 'Docs status'
+    to 'Approved'/'Rejected' (missing values count as rejected), stores the
+    text columns as Categorical and downcasts the day columns.
+    """
+    df = df.copy(deep=False)
+    docs_status = {status.strip(): 'Rejected' for status in rejected_strings}
+    docs_status.update({status.strip(): 'Approved' for status in approved_strings})
+    for column in CATEGORICAL_COLUMNS:
+        if column not in df.columns:
+            continue
+        if column == 'Docs status':
+            df[column] = _stripped_category(df[column].fillna('Rejected'), docs_status)
+        else:
+            df[column] = _stripped_category(df[column])
+    for column in DAY_COLUMNS:
+        if column in df.columns:
+            df[column] = _compact_days(df[column])
+    return df
+
+
+def read_typed_export(decoded, filename, columns=None):
+    """read_export followed by compact_export, for use as an upload_cache reader."""
+    return compact_export(read_export(decoded, filename, columns))
+
+
+def param(name):
+    """Reference a run parameter (e.g. mv_urgency_days) as a rule value."""
+    return {'param': name}
+
+
+# Priority rules, lowest number wins. A rule matches when all of its
+# (column, operator, value) conditions hold; capped rules only keep the first
+# rows that fit under the named threshold.
+PRIORITY_RULES = [
+    {'priority': 1, 'label': "MV with Super Angry Client",
+     'when': [('Housemaid Type', '==', 'MV'), ('Client Note', '==', 'SUPER_ANGRY_CLIENT')]},
+    {'priority': 2, 'label': "MV with Visa Prioritization Request",
+     'when': [('Housemaid Type', '==', 'MV'), ('Client Note', '==', 'PRIORITIZE_VISA')]},
+    {'priority': 3, 'label': "Filipina with Flight in more than 2 days and Less Than 4 Days",
+     'when': [('Housemaid Nationality', '==', 'Filipina'), ('Flight in (days)', '<', 4), ('Flight in (days)', '>', 2)]},
+    {'priority': 4, 'label': "MV in Table for More Than {mv_urgency_days} Days",
+     'when': [('Housemaid Type', '==', 'MV'), ('Been in the table for (in days)', '>', param('mv_urgency_days'))]},
+    {'priority': 5, 'label': "Last day to stay in country < {last_day_in_country}",
+     'when': [('Last day to stay in country in', '<', param('last_day_in_country'))]},
+    {'priority': 6, 'label': "Filipina Live-In in Dubai", 'cap': 'Filipina Live-In',
+     'when': [('Housemaid Nationality', '==', 'Filipina'), ('Housemaid Status', '==', 'LANDED_IN_DUBAI'), ('Live out', '==', 'No')]},
+    {'priority': 7, 'label': "African Live-In in Dubai", 'cap': 'African Live-In',
+     'when': [('Housemaid Nationality', 'in', african_countries), ('Housemaid Status', '==', 'LANDED_IN_DUBAI'), ('Live out', '==', 'No')]},
+    {'priority': 8, 'label': "Ethiopian Live-In in Dubai", 'cap': 'Ethiopian Live-In',
+     'when': [('Housemaid Nationality', '==', 'Ethiopian'), ('Housemaid Status', '==', 'LANDED_IN_DUBAI'), ('Live out', '==', 'No')]},
+    {'priority': 9, 'label': "Ethiopian Pending COC for More Than 10 Days",
+     'when': [('Housemaid Nationality', '==', 'Ethiopian'), ('Stage in Freedom Operator Page', '==', 'Pending COC'),
+              ('Been in the table for (in days)', '>', 10), ('Live out', '==', 'No')]},
+    {'priority': 10, 'label': "Filipina Live-Out in Dubai", 'cap': 'Filipina Live-Out',
+     'when': [('Housemaid Nationality', '==', 'Filipina'), ('Housemaid Status', '==', 'LANDED_IN_DUBAI'), ('Live out', '==', 'Yes')]},
+    {'priority': 11, 'label': "African Live-Out in Dubai", 'cap': 'African Live-Out',
+     'when': [('Housemaid Nationality', 'in', african_countries), ('Housemaid Status', '==', 'LANDED_IN_DUBAI'), ('Live out', '==', 'Yes')]},
+    {'priority': 12, 'label': "Filipina with Flight in 4 to 7 Days",
+     'when': [('Housemaid Nationality', '==', 'Filipina'), ('Flight in (days)', '>=', 4), ('Flight in (days)', '<=', 7)]},
+    {'priority': 13, 'label': "MV in Table for {mv_urgency_days} Days or Less",
+     'when': [('Housemaid Type', '==', 'MV'), ('Been in the table for (in days)', '<=', param('mv_urgency_days'))]},
+    {'priority': 14, 'label': "Landed in Dubai Live In",
+     'when': [('Housemaid Status', '==', 'LANDED_IN_DUBAI'), ('Live out', '==', 'No')]},
+    {'priority': 15, 'label': "Landed in Dubai Live Out",
+     'when': [('Housemaid Status', '==', 'LANDED_IN_DUBAI'), ('Live out', '==', 'Yes')]},
+    {'priority': 16, 'label': "Outcome is LAWP",
+     'when': [('Outcome', '==', 'LAWP')]},
+    {'priority': 17, 'label': "Filipina with Flight in 7 to 14 Days",
+     'when': [('Housemaid Nationality', '==', 'Filipina'), ('Flight in (days)', '>', 7), ('Flight in (days)', '<=', 14)]},
+    {'priority': 18, 'label': "African with Attested GCC",
+     'when': [('Housemaid Nationality', 'in', african_countries), ('Attested GCC', '==', 'Yes')]},
+    {'priority': 19, 'label': "Ethiopian Pending Exit Permit",
+     'when': [('Housemaid Nationality', '==', 'Ethiopian'), ('Stage in Freedom Operator Page', '==', 'Pending Exit Permit')]},
+    {'priority': 20, 'label': "African with MFA",
+     'when': [('Housemaid Nationality', 'in', african_countries), ('MFA', '==', 'Yes')]},
+    {'priority': 21, 'label': "Ethiopian Pending COC",
+     'when': [('Housemaid Nationality', '==', 'Ethiopian'), ('Stage in Freedom Operator Page', '==', 'Pending COC')]},
+    {'priority': 22, 'label': "African with GCC",
+     'when': [('Housemaid Nationality', 'in', african_countries), ('GCC', '==', 'Yes')]},
+    {'priority': 23, 'label': "Other", 'when': []},
+]
+
+NUMERIC_OPERATORS = {
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+}
+
+_compiled_rules = {}
+# Specs already compiled, by id: {id(rules): (rules, compiled)}. The entry keeps
+# the spec alive so its id is not reused by another list
+_compiled_specs = {}
+_pushdown_specs = {}
+_static_evaluations = {}
+
+
+def rules_hash(rules):
+    """Stable hash of a rule spec, used as its compile cache key."""
+    spec = json.dumps(rules, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(spec.encode('utf-8')).hexdigest()
+
+
+def _compile_condition(column, op, value):
+    """Build a function (df, params, numeric_columns) -> boolean ndarray for one condition."""
+    if isinstance(value, dict):
+        if op not in NUMERIC_OPERATORS:
+            # Parameter values may be arrays (see sweep_priority_counts), which only numeric comparisons broadcast
+            raise ValueError(f"Rule parameters are only supported with numeric operators, not {op!r}")
+        name = value['param']
+        resolve = lambda params: params[name]
+    else:
+        resolve = lambda params: value
+
+    if op in NUMERIC_OPERATORS:
+        compare = NUMERIC_OPERATORS[op]
+
+        def condition(df, params, numeric_columns):
+            # Coerce each column once per evaluation; NaN never satisfies a comparison
+            if column not in numeric_columns:
+                numeric_columns[column] = pd.to_numeric(df[column], errors='coerce').to_numpy(dtype=float)
+            with np.errstate(invalid='ignore'):
+                return compare(numeric_columns[column], resolve(params))
+    elif op == '==':
+        def condition(df, params, numeric_columns):
+            return (df[column] == resolve(params)).to_numpy(dtype=bool)
+    elif op == '!=':
+        def condition(df, params, numeric_columns):
+            return (df[column] != resolve(params)).to_numpy(dtype=bool)
+    elif op == 'in':
+        def condition(df, params, numeric_columns):
+            return df[column].isin(resolve(params)).to_numpy(dtype=bool)
+    else:
+        raise ValueError(f"Unsupported operator in priority rule: {op!r}")
+    return condition
+
+
+def compile_rules(rules=PRIORITY_RULES):
+    """Compile a rule spec into vectorized condition functions, cached by spec hash.
+
+    Conditions shared by several rules (e.g. Filipina nationality) are compiled
+    and evaluated only once. A spec object seen before is looked up by identity,
+    so it is only serialized and hashed the first time it is passed in; specs
+    are treated as immutable once compiled.
+    """
+    entry = _compiled_specs.get(id(rules))
+    if entry is not None and entry[0] is rules:
+        return entry[1]
+    key = rules_hash(rules)
+    if key in _compiled_rules:
+        _compiled_specs[id(rules)] = (rules, _compiled_rules[key])
+        return _compiled_rules[key]
+
+    conditions = []
+    condition_index = {}
+    dynamic_conditions = set()
+    rule_conditions = {}
+    for rule in sorted(rules, key=lambda r: r['priority']):
+        indices = []
+        for column, op, value in rule['when']:
+            condition_key = json.dumps([column, op, value], sort_keys=True, ensure_ascii=False)
+            if condition_key not in condition_index:
+                condition_index[condition_key] = len(conditions)
+                if isinstance(value, dict):
+                    dynamic_conditions.add(len(conditions))
+                conditions.append(_compile_condition(column, op, value))
+            indices.append(condition_index[condition_key])
+        rule_conditions[rule['priority']] = indices
+
+    compiled = {
+        'hash': key,
+        'priorities': np.array(sorted(rule_conditions)),
+        'labels': {rule['priority']: rule['label'] for rule in rules},
+        'caps': {rule['priority']: rule['cap'] for rule in rules if rule.get('cap')},
+        # Priority of rows no rule matches; never produced by a spec that ends with a catch-all rule
+        'unmatched': max(rule_conditions, default=0) + 1,
+        'conditions': conditions,
+        'rule_conditions': rule_conditions,
+        # Conditions (and the rules using them) whose value comes from the run parameters
+        'dynamic_conditions': dynamic_conditions,
+        'dynamic_rules': {priority: [index for index in indices if index in dynamic_conditions]
+                          for priority, indices in rule_conditions.items()
+                          if any(index in dynamic_conditions for index in indices)},
+    }
+    _compiled_rules[key] = compiled
+    _compiled_specs[id(rules)] = (rules, compiled)
+    return compiled
+
+
+def pushdown_rules(targets, rules=PRIORITY_RULES):
+    """The part of a rule spec that can decide whether a row lands in one of the target priorities.
+
+    A row's priority is the lowest rule it matches, so rules numbered above the
+    highest target never change whether it is a target; they are dropped.
+    Rows that match none of the remaining rules get the compiled 'unmatched'
+    priority. If no capped rule is left, slices need no capped-counter pass.
+    The same list is returned for the same spec and highest target, so
+    compile_rules finds it by identity.
+    """
+    highest = max(targets)
+    key = (id(rules), highest)
+    entry = _pushdown_specs.get(key)
+    if entry is None or entry[0] is not rules:
+        entry = _pushdown_specs[key] = (rules, [rule for rule in rules if rule['priority'] <= highest])
+    return entry[1]
+
+
+def rule_columns(rules=PRIORITY_RULES):
+    """Export columns the rule conditions read, in first-use order."""
+    return list(dict.fromkeys(column for rule in sorted(rules, key=lambda r: r['priority']) for column, _, _ in rule['when']))
+
+
+def priority_names(params, rules=PRIORITY_RULES):
+    """Map each priority number to its display name for the given run parameters."""
+    return {priority: label.format(**params) for priority, label in compile_rules(rules)['labels'].items()}
+
+
+def rule_masks(df, params, rules=PRIORITY_RULES):
+    """Evaluate every priority rule as a boolean mask over the whole DataFrame.
+
+    Capped rules are returned before their caps are applied.
+    """
+    return evaluate_rules(df, params, rules)['masks']
+
+
+def cap_mask(mask, counter, threshold):
+    """Keep only the first matching rows (in file order) that still fit under threshold.
+
+    Every matching row consumes a slot, even when a lower priority number also
+    matches it, exactly like the counters in assign_priority.
+    """
+    return mask & (np.cumsum(mask) <= threshold - counter)
+
+
+def apply_caps(masks, priority_counters, priority_thresholds, rules=PRIORITY_RULES):
+    """Apply cap_mask to every capped rule; priority_counters is updated in place with the slots used."""
+    capped = dict(masks)
+    for priority, threshold_name in compile_rules(rules)['caps'].items():
+        capped[priority] = cap_mask(masks[priority], priority_counters[priority], priority_thresholds[threshold_name])
+        priority_counters[priority] += int(capped[priority].sum())
+    return capped
+
+
+def pick_priority(masks):
+    """Return the lowest matching priority number for each row."""
+    priorities = np.array(sorted(masks))
+    stacked = np.vstack([masks[priority] for priority in priorities])
+    return priorities[stacked.argmax(axis=0)]
+
+
+def _static_evaluation(df, compiled):
+    """Evaluate the conditions that do not depend on the run parameters, cached per DataFrame object.
+
+    For rules with a parameter condition the cached mask holds only their
+    static conditions. Entries are dropped when the DataFrame is garbage
+    collected (e.g. evicted from the upload cache). 'seconds' is the time
+    spent on each rule; a condition shared by several rules is timed with
+    the first (lowest priority number) rule that uses it.
+
+    For an upload from upload_cache the masks are also kept in the shared
+    upload store under its upload_key and the spec hash, so other processes
+    loading the same upload (background report jobs, other server workers)
+    reuse them instead of evaluating the static conditions again.
+    """
+    key = (id(df), compiled['hash'])
+    cached = _static_evaluations.get(key)
+    if cached is not None and cached['df']() is df:
+        return cached
+
+    upload_key = upload_key_of(df)
+    store_key = None if upload_key is None else ('rule masks', upload_key, compiled['hash'])
+    stored = None if store_key is None else upload_store().get(store_key)
+    if stored is not None:
+        return _cache_static_evaluation(key, df, dict(stored, numeric_columns={}))
+
+    numeric_columns = {}
+    condition_masks = {}
+    masks = {}
+    seconds = {}
+    for priority, indices in compiled['rule_conditions'].items():
+        start = time.perf_counter()
+        mask = np.ones(len(df), dtype=bool)
+        for index in indices:
+            if index in compiled['dynamic_conditions']:
+                continue
+            if index not in condition_masks:
+                condition_masks[index] = compiled['conditions'][index](df, None, numeric_columns)
+            mask &= condition_masks[index]
+        masks[priority] = mask
+        seconds[priority] = time.perf_counter() - start
+
+    static_uncapped = {priority: mask for priority, mask in masks.items()
+                       if priority not in compiled['caps'] and priority not in compiled['dynamic_rules']}
+    static_uncapped[compiled['unmatched']] = np.ones(len(df), dtype=bool)
+    static = {'masks': masks, 'seconds': seconds, 'uncapped_priority': pick_priority(static_uncapped)}
+    if store_key is not None:
+        upload_store().set(store_key, static, expire=UPLOAD_STORE_MAX_AGE)
+    return _cache_static_evaluation(key, df, dict(static, numeric_columns=numeric_columns))
+
+
+def _cache_static_evaluation(key, df, static):
+    """Keep a static evaluation of df until df is garbage collected; returns it."""
+    cached = dict(static, df=weakref.ref(df))
+    _static_evaluations[key] = cached
+    weakref.finalize(df, _static_evaluations.pop, key, None)
+    return cached
+
+
+def prepare_rule_cache(df, rules=PRIORITY_RULES):
+    """Evaluate and cache the parameter-independent masks for df ahead of the first report."""
+    _static_evaluation(df, compile_rules(rules))
+
+
+def evaluate_rules(df, params, rules=PRIORITY_RULES):
+    """Evaluate every rule once so that several slices of df can be prioritized from the same masks.
+
+    Only the capped rules depend on which rows are in a slice, so the lowest
+    uncapped priority of every row is resolved here as well. Masks that do not
+    depend on params are cached per DataFrame, so changing the MV urgency or
+    last-day threshold re-evaluates only the parameter conditions (rules 4, 5
+    and 13), and counters/thresholds only affect the capped pass.
+
+    'seconds' holds each rule's evaluation time: its cached static conditions
+    (timed when they were first evaluated) plus its parameter conditions.
+    """
+    compiled = compile_rules(rules)
+    static = _static_evaluation(df, compiled)
+    masks = dict(static['masks'])
+    seconds = dict(static['seconds'])
+    uncapped_priority = static['uncapped_priority']
+    for priority, indices in compiled['dynamic_rules'].items():
+        start = time.perf_counter()
+        mask = masks[priority].copy()
+        for index in indices:
+            mask &= compiled['conditions'][index](df, params, static['numeric_columns'])
+        masks[priority] = mask
+        seconds[priority] += time.perf_counter() - start
+        if priority not in compiled['caps']:
+            uncapped_priority = np.where(mask, np.minimum(uncapped_priority, priority), uncapped_priority)
+    return {'masks': masks, 'caps': compiled['caps'], 'uncapped_priority': uncapped_priority, 'seconds': seconds}
+
+
+def _slice_caps(evaluation, selection, priority_counters, priority_thresholds):
+    """Run the capped counters over a slice; returns its priorities and the capped rule masks."""
+    priority = evaluation['uncapped_priority'][selection]
+    capped_masks = {}
+    for capped_priority, threshold_name in evaluation['caps'].items():
+        capped = cap_mask(evaluation['masks'][capped_priority][selection],
+                          priority_counters[capped_priority], priority_thresholds[threshold_name])
+        priority_counters[capped_priority] += int(capped.sum())
+        priority = np.where(capped, np.minimum(priority, capped_priority), priority)
+        capped_masks[capped_priority] = capped
+    return priority, capped_masks
+
+
+def slice_priorities(evaluation, selection, priority_counters, priority_thresholds):
+    """Priority numbers for the selected rows, running the capped counters over that slice alone.
+
+    selection is a boolean array over the evaluated rows (or slice(None) for all
+    of them); priority_counters is updated in place.
+    """
+    return _slice_caps(evaluation, selection, priority_counters, priority_thresholds)[0]
+
+
+def rule_bit(priority):
+    """Bit of a rule in a 'Matched rules' bitmask: bit 0 is priority 1."""
+    return 1 << (priority - 1)
+
+
+def rule_bits(priorities):
+    """Bitmask with the bits of all the given priorities set."""
+    return sum(rule_bit(priority) for priority in set(priorities))
+
+
+def slice_rule_matches(evaluation, selection, priority_counters, priority_thresholds):
+    """slice_priorities plus a bitmask of every rule each selected row matched.
+
+    A capped rule only counts as matched for rows that got one of its slots,
+    like the priorities list in assign_priority, so the lowest set bit of a
+    row's bitmask is always its priority number.
+    """
+    priority, capped_masks = _slice_caps(evaluation, selection, priority_counters, priority_thresholds)
+    matched = np.zeros(len(priority), dtype=np.uint32)
+    for rule_priority, mask in evaluation['masks'].items():
+        mask = capped_masks[rule_priority] if rule_priority in capped_masks else mask[selection]
+        matched |= np.where(mask, np.uint32(rule_bit(rule_priority)), np.uint32(0))
+    return priority, matched
+
+
+def rule_statistics(evaluation, selection, priority, matched, priority_names):
+    """Per-rule hit counts over one slice, with the rule's evaluation time, indexed by priority name.
+
+    priority and matched are slice_rule_matches' result for selection (in any
+    row order). 'Matched' counts the selected rows meeting the rule's
+    conditions, 'Won' those that got its priority and 'Capped' the matches a
+    capped rule had no slot for. 'Seconds' is missing for evaluations rebuilt
+    by evaluation_from_bits.
+    """
+    seconds = evaluation.get('seconds', {})
+    rows = {}
+    for rule_priority, mask in sorted(evaluation['masks'].items()):
+        hits = int(np.count_nonzero(mask[selection]))
+        kept = int(np.count_nonzero(matched & np.uint32(rule_bit(rule_priority))))
+        rows[priority_names[rule_priority]] = {
+            'Matched': hits,
+            'Won': int(np.count_nonzero(priority == rule_priority)),
+            'Capped': hits - kept if rule_priority in evaluation['caps'] else 0,
+            'Seconds': seconds.get(rule_priority, np.nan),
+        }
+    return pd.DataFrame.from_dict(rows, orient='index', columns=['Matched', 'Won', 'Capped', 'Seconds'])
+
+
+def evaluation_rule_bits(evaluation):
+    """Bitmask of every rule each evaluated row matches before caps are applied."""
+    bits = np.zeros(len(evaluation['uncapped_priority']), dtype=np.uint32)
+    for priority, mask in evaluation['masks'].items():
+        bits |= np.where(mask, np.uint32(rule_bit(priority)), np.uint32(0))
+    return bits
+
+
+def evaluation_from_bits(bits, rules=PRIORITY_RULES):
+    """Rebuild evaluate_rules' result from the evaluation_rule_bits of the rows, without reading them.
+
+    bits may come from a larger spec than rules (e.g. the full spec for
+    pushdown_rules); only the bits of rules are used.
+    """
+    compiled = compile_rules(rules)
+    masks = {int(priority): (bits & np.uint32(rule_bit(priority))) != 0 for priority in compiled['priorities']}
+    uncapped_priority = np.full(len(bits), compiled['unmatched'])
+    for priority in sorted(masks, reverse=True):
+        if priority not in compiled['caps']:
+            uncapped_priority = np.where(masks[priority], priority, uncapped_priority)
+    return {'masks': masks, 'caps': compiled['caps'], 'uncapped_priority': uncapped_priority}
+
+
+def matched_priorities(matched, rules=PRIORITY_RULES):
+    """Every priority whose bit is set in one 'Matched rules' value, lowest first."""
+    matched = int(matched)
+    return [int(priority) for priority in compile_rules(rules)['priorities'] if matched & rule_bit(priority)]
+
+
+def matched_rule_names(matched, priority_names, rules=PRIORITY_RULES):
+    """'Matched rules' values decoded to the rules they hold, e.g. '4. MV in Table for More Than 5 Days; 13. ...'.
+
+    matched is a Series of bitmasks; the distinct values are bit-tested against
+    every rule at once.
+    """
+    priorities = compile_rules(rules)['priorities']
+    bits = np.array([rule_bit(priority) for priority in priorities], dtype=np.uint32)
+    labels = np.array([f"{priority}. {priority_names[priority]}" for priority in priorities], dtype=object)
+    values = matched.unique()
+    hits = (values.astype(np.uint32)[:, None] & bits) != 0
+    return matched.map({value: "; ".join(labels[row]) for value, row in zip(values, hits)})
+
+
+def assign_priorities(df, priority_counters, priority_thresholds, params, rules=PRIORITY_RULES):
+    """Vectorized equivalent of applying assign_priority to every row of df."""
+    evaluation = evaluate_rules(df, params, rules)
+    priority = slice_priorities(evaluation, slice(None), priority_counters, priority_thresholds)
+    return pd.Series(priority, index=df.index, name='Priority number')
+
+
+# Upper bound on grid points x rows evaluated at once by sweep_priority_counts
+SWEEP_BLOCK_CELLS = 20_000_000
+
+
+def _sweep_block(df, static, compiled, params, priority_counters, priority_thresholds, names, points, selection):
+    """Priority numbers of the selected rows for a block of grid points, shape (len(points), rows)."""
+    values = {name: np.array([point[i] for point in points], dtype=float)[:, None] for i, name in enumerate(names)}
+    run_params = dict(params, **{name: value for name, value in values.items() if name in params})
+    thresholds = dict(priority_thresholds, **{name: value for name, value in values.items() if name in priority_thresholds})
+
+    priority = static['uncapped_priority'][selection][None, :]
+    masks = {}
+    for rule_priority, indices in compiled['dynamic_rules'].items():
+        mask = static['masks'][rule_priority][selection][None, :]
+        for index in indices:
+            condition = compiled['conditions'][index](df, run_params, static['numeric_columns'])
+            mask = mask & np.atleast_2d(condition)[:, selection]
+        masks[rule_priority] = mask
+        if rule_priority not in compiled['caps']:
+            priority = np.where(mask, np.minimum(priority, rule_priority), priority)
+
+    for capped_priority, threshold_name in compiled['caps'].items():
+        mask = masks.get(capped_priority, static['masks'][capped_priority][selection][None, :])
+        remaining = thresholds[threshold_name] - priority_counters[capped_priority]
+        capped = mask & (np.cumsum(mask, axis=1) <= remaining)
+        priority = np.where(capped, np.minimum(priority, capped_priority), priority)
+
+    return np.broadcast_to(priority, (len(points), priority.shape[1]))
+
+
+def sweep_priority_counts(df, params, priority_counters, priority_thresholds, grid, selection=slice(None), rules=PRIORITY_RULES):
+    """Count rows per priority for every point of a one- or two-parameter grid.
+
+    grid maps each swept name to its list of values; a name is either a run
+    parameter (e.g. 'mv_urgency_days') or a threshold (e.g. 'Filipina Live-In').
+    The cached rule masks are broadcast against all grid values at once instead
+    of prioritizing the frame once per point. Returns a DataFrame with one row
+    per grid point and one column per priority number.
+    """
+    names = list(grid)
+    if not 1 <= len(names) <= 2:
+        raise ValueError("A sweep takes one or two parameters")
+    for name in names:
+        if name not in params and name not in priority_thresholds:
+            raise ValueError(f"Unknown sweep parameter: {name}")
+
+    compiled = compile_rules(rules)
+    static = _static_evaluation(df, compiled)
+    points = list(itertools.product(*(grid[name] for name in names)))
+    rows = len(static['uncapped_priority'][selection])
+    width = compiled['unmatched'] + 1
+    block_size = max(1, SWEEP_BLOCK_CELLS // max(rows, 1))
+
+    counts = []
+    for start in range(0, len(points), block_size):
+        block = points[start:start + block_size]
+        priority = _sweep_block(df, static, compiled, params, priority_counters, priority_thresholds, names, block, selection)
+        offsets = np.arange(len(block))[:, None] * width
+        block_counts = np.bincount((priority + offsets).ravel(), minlength=len(block) * width)
+        counts.append(block_counts.reshape(len(block), width))
+
+    index = pd.MultiIndex.from_tuples(points, names=names) if len(names) > 1 else pd.Index([point[0] for point in points], name=names[0])
+    counts = np.vstack(counts) if counts else np.zeros((0, width), dtype=int)
+    return pd.DataFrame(counts[:, compiled['priorities']], index=index, columns=compiled['priorities'])
+
+
+def assign_priority(row, priority_counters, priority_thresholds, mv_urgency_days, last_day_in_country):
+    """Assign priority to a single row (row-wise reference implementation)."""
+    priorities = []
+
+    if row['Housemaid Type'] == 'MV' and row['Client Note'] == 'SUPER_ANGRY_CLIENT':
+        priorities.append(1)
+
+    if row['Housemaid Type'] == 'MV' and row['Client Note'] == 'PRIORITIZE_VISA':
+        priorities.append(2)
+
+    if row['Housemaid Nationality'] == 'Filipina' and pd.notna(row['Flight in (days)']) and row['Flight in (days)'] < 4 and row['Flight in (days)'] > 2:
+        priorities.append(3)
+
+    if row['Housemaid Type'] == 'MV' and pd.notna(row['Been in the table for (in days)']) and row['Been in the table for (in days)'] > mv_urgency_days:
+        priorities.append(4)
+
+    if pd.notna(row['Last day to stay in country in']) and row['Last day to stay in country in'] < last_day_in_country:
+        priorities.append(5)
+
+    if row['Housemaid Nationality'] == 'Filipina' and row['Housemaid Status'] == 'LANDED_IN_DUBAI' and row['Live out'] == 'No':
+        if priority_counters[6] < priority_thresholds['Filipina Live-In']:
+            priorities.append(6)
+            priority_counters[6] += 1
+
+    if row['Housemaid Nationality'] in african_countries and row['Housemaid Status'] == 'LANDED_IN_DUBAI' and row['Live out'] == 'No':
+        if priority_counters[7] < priority_thresholds['African Live-In']:
+            priorities.append(7)
+            priority_counters[7] += 1
+
+    if row['Housemaid Nationality'] == 'Ethiopian' and row['Housemaid Status'] == 'LANDED_IN_DUBAI' and row['Live out'] == 'No':
+        if priority_counters[8] < priority_thresholds['Ethiopian Live-In']:
+            priorities.append(8)
+            priority_counters[8] += 1
+
+    if row['Housemaid Nationality'] == 'Ethiopian' and row['Stage in Freedom Operator Page'] == 'Pending COC' and pd.notna(row['Been in the table for (in days)']) and row['Been in the table for (in days)'] > 10 and row['Live out'] == 'No':
+        priorities.append(9)
+
+    if row['Housemaid Nationality'] == 'Filipina' and row['Housemaid Status'] == 'LANDED_IN_DUBAI' and row['Live out'] == 'Yes':
+        if priority_counters[10] < priority_thresholds['Filipina Live-Out']:
+            priorities.append(10)
+            priority_counters[10] += 1
+
+    if row['Housemaid Nationality'] in african_countries and row['Housemaid Status'] == 'LANDED_IN_DUBAI' and row['Live out'] == 'Yes':
+        if priority_counters[11] < priority_thresholds['African Live-Out']:
+            priorities.append(11)
+            priority_counters[11] += 1
+
+    if row['Housemaid Nationality'] == 'Filipina' and pd.notna(row['Flight in (days)']) and 4 <= row['Flight in (days)'] <= 7:
+        priorities.append(12)
+
+    if row['Housemaid Type'] == 'MV' and pd.notna(row['Been in the table for (in days)']) and row['Been in the table for (in days)'] <= mv_urgency_days:
+        priorities.append(13)
+
+    if row['Housemaid Status'] == 'LANDED_IN_DUBAI' and row['Live out'] == 'No':
+        priorities.append(14)
+
+    if row['Housemaid Status'] == 'LANDED_IN_DUBAI' and row['Live out'] == 'Yes':
+        priorities.append(15)
+
+    if row['Outcome'] == 'LAWP':
+        priorities.append(16)
+
+    if row['Housemaid Nationality'] == 'Filipina' and pd.notna(row['Flight in (days)']) and 7 < row['Flight in (days)'] <= 14:
+        priorities.append(17)
+
+    if row['Housemaid Nationality'] in african_countries and row['Attested GCC'] == 'Yes':
+        priorities.append(18)
+
+    if row['Housemaid Nationality'] == 'Ethiopian' and row['Stage in Freedom Operator Page'] == 'Pending Exit Permit':
+        priorities.append(19)
+
+    if row['Housemaid Nationality'] in african_countries and row['MFA'] == 'Yes':
+        priorities.append(20)
+
+    if row['Housemaid Nationality'] == 'Ethiopian' and row['Stage in Freedom Operator Page'] == 'Pending COC':
+        priorities.append(21)
+
+    if row['Housemaid Nationality'] in african_countries and row['GCC'] == 'Yes':
+        priorities.append(22)
+
+    priorities.append(23)
+
+    return min(priorities) if priorities else None
@@ -0,0 +1,188 @@
+"""Polars backend for the priority report pipeline.
+
+Each sheet of a report (typed load, docs status / payment / LAWP filter,
+rule evaluation, capped counts, priority names and sort) is one lazy Polars
+query; the three sheets and the African filter are collected together, so
+Polars optimises the whole pipeline and runs it on all cores. Sheets and
+statistics match the pandas path in priority_reports.
+"""
+import pandas as pd
+
+from priority_engine import (CATEGORICAL_COLUMNS, DAY_COLUMNS, PRIORITY_RULES, NUMERIC_OPERATORS, african_countries,
+                             approved_strings, compile_rules, rejected_strings, rule_bit)
+
+try:
+    import polars as pl
+except ImportError:  # optional dependency, only needed for engine='polars'
+    pl = None
+
+
+def require_polars():
+    if pl is None:
+        raise ImportError("The Polars engine needs the polars package: pip install polars")
+
+
+def condition_expr(column, op, value, params):
+    """Expression for one (column, operator, value) rule condition; null never satisfies it, like NaN in pandas."""
+    if isinstance(value, dict):
+        value = params[value['param']]
+    if op in NUMERIC_OPERATORS:
+        expr = NUMERIC_OPERATORS[op](pl.col(column).cast(pl.Float64, strict=False), float(value))
+    elif op == '==':
+        expr = pl.col(column) == value
+    elif op == '!=':
+        expr = pl.col(column) != value
+    elif op == 'in':
+        expr = pl.col(column).is_in(list(value))
+    else:
+        raise ValueError(f"Unsupported operator in priority rule: {op!r}")
+    return expr.fill_null(False)
+
+
+def rule_expr(rule, params):
+    if not rule['when']:
+        return pl.lit(True)
+    return pl.all_horizontal([condition_expr(column, op, value, params) for column, op, value in rule['when']])
+
+
+def typed_columns(columns):
+    """Expressions applying compact_export's cleaning: stripped text, mapped 'Docs status' and numeric day columns."""
+    docs_status = {status.strip(): 'Rejected' for status in rejected_strings}
+    docs_status.update({status.strip(): 'Approved' for status in approved_strings})
+    exprs = []
+    for column in columns:
+        if column == 'Docs status':
+            stripped = pl.col(column).cast(pl.String).fill_null('Rejected').str.strip_chars()
+            exprs.append(stripped.replace(docs_status).alias(column))
+        elif column in CATEGORICAL_COLUMNS:
+            exprs.append(pl.col(column).cast(pl.String).str.strip_chars())
+        elif column in DAY_COLUMNS:
+            exprs.append(pl.col(column).cast(pl.Float64, strict=False))
+        else:
+            exprs.append(pl.col(column))
+    return exprs
+
+
+def load_export(source, columns=None):
+    """Lazy typed frame over source with a row_no column in file order.
+
+    source is a DataFrame, a UTF-16 TSV (.csv/.tsv) path or a .parquet path (such
+    as a priority_duckdb.parquet_copy). Only columns are selected when given.
+    """
+    require_polars()
+    if isinstance(source, pd.DataFrame):
+        frame = pl.from_pandas(source.reset_index(drop=True)).lazy()
+    elif source.lower().endswith('.parquet'):
+        frame = pl.scan_parquet(source)
+    elif source.lower().endswith(('.csv', '.tsv')):
+        # Polars only scans UTF-8 text, so a UTF-16 export is decoded in memory first;
+        # text columns stay text instead of being inferred as numbers or dates
+        frame = pl.read_csv(source, separator='\t', encoding='utf-16',
+                            schema_overrides={column: pl.String for column in CATEGORICAL_COLUMNS}).lazy()
+    else:
+        raise ValueError(f"Unsupported file type for the Polars engine: {source}")
+
+    available = frame.collect_schema().names()
+    missing = [column for column in columns or [] if column not in available]
+    if missing:
+        raise KeyError(f"The following required columns are missing: {', '.join(missing)}")
+    if 'row_no' not in available:
+        frame = frame.with_row_index('row_no')
+    selected = [column for column in (columns or available) if column != 'row_no']
+    return frame.select(pl.col('row_no').cast(pl.Int64), *typed_columns(selected))
+
+
+def prioritize_frame(frame, params, priority_counters, priority_thresholds, rules=PRIORITY_RULES):
+    """Add 'Priority number' and 'Matched rules' to every row of frame.
+
+    Capped rules keep a match only while the running count of matches (in
+    file order, within frame) fits under the threshold minus the counter.
+    """
+    compiled = compile_rules(rules)
+    ordered = sorted(rules, key=lambda rule: rule['priority'])
+    matched = []
+    for rule in ordered:
+        priority = rule['priority']
+        flag = rule_expr(rule, params)
+        if priority in compiled['caps']:
+            remaining = priority_thresholds[compiled['caps'][priority]] - priority_counters[priority]
+            flag = flag & (flag.cast(pl.Int64).cum_sum() <= remaining)
+        matched.append((priority, flag))
+
+    priority_expr = pl.lit(compiled['unmatched'])
+    for priority, flag in reversed(matched):
+        priority_expr = pl.when(flag).then(pl.lit(priority)).otherwise(priority_expr)
+    bits = pl.sum_horizontal([pl.when(flag).then(pl.lit(rule_bit(priority), pl.Int64)).otherwise(0) for priority, flag in matched]
+                             or [pl.lit(0, pl.Int64)])
+    return frame.with_columns(priority_expr.cast(pl.Int64).alias('Priority number'), bits.cast(pl.UInt32).alias('Matched rules'))
+
+
+def slice_filter(report, payment_added, docs_status, lawp_filter=True):
+    """Filter of one sheet: its docs status(es), the payment toggle and (unless lawp_filter is False) the report's LAWP filter."""
+    condition = pl.col('Docs status').is_in(docs_status)
+    if payment_added in ["Yes", "No"]:
+        condition = condition & (pl.col('Payment added?') == payment_added).fill_null(False)
+    if report['lawp'] is not None and lawp_filter:
+        is_lawp = (pl.col('Outcome') == 'LAWP').fill_null(False)
+        condition = condition & (is_lawp if report['lawp'] else ~is_lawp)
+    return condition
+
+
+def sheet_query(export, where, output_columns, priority_counters, priority_thresholds, params, priority_names, rules=PRIORITY_RULES,
+                targets=None):
+    """Lazy query for one sheet of the report, still carrying row_no.
+
+    With targets and no capped rules, other priorities are dropped before the
+    sheet and statistics are built, as prioritize_report_rows does.
+    """
+    query = prioritize_frame(export.filter(where), params, priority_counters, priority_thresholds, rules)
+    if targets and not compile_rules(rules)['caps']:
+        query = query.filter(pl.col('Priority number').is_in(list(targets)))
+    query = query.with_columns(pl.col('Priority number').replace_strict(priority_names, default=None, return_dtype=pl.String)
+                               .alias('Priority Name'))
+    return (query.select('row_no', *output_columns)
+            .sort(['Priority number', 'Been in the table for (in days)'], descending=[False, True], nulls_last=True, maintain_order=True))
+
+
+def sheet_statistics(sheet, priority_names):
+    """calculate_statistics for a collected sheet."""
+    counts = sheet.group_by('Priority number').agg(
+        Males=(pl.col('Gender') == 'Male').sum(),
+        Females=(pl.col('Gender') == 'Female').sum(),
+        Total=pl.len(),
+    ).to_pandas().set_index('Priority number')
+    stats = counts.reindex(list(priority_names), fill_value=0).astype('int64')
+    stats.index = list(priority_names.values())
+    return stats
+
+
+def prioritize_report_rows_polars(source, report, payment_added, sheet_counters, priority_thresholds, params, priority_names,
+                                  export_columns, output_columns, rules=PRIORITY_RULES, targets=None):
+    """Polars counterpart of priority_reports.prioritize_report_rows for a whole export."""
+    export = load_export(source, export_columns)
+    wheres = [slice_filter(report, payment_added, ['Approved']),
+              slice_filter(report, payment_added, ['Rejected']),
+              # The Combined sheet always covers every row
+              slice_filter(report, payment_added, ['Approved', 'Rejected'], lawp_filter=False)]
+    queries = [sheet_query(export, where, output_columns, counters, priority_thresholds, params, priority_names, rules, targets)
+               for where, counters in zip(wheres, sheet_counters)]
+    nationality = pl.col('Housemaid Nationality')
+    non_african = export.select('row_no', (~nationality.is_in(african_countries).fill_null(False) | (nationality == 'Ethiopian').fill_null(False))
+                                .alias('non_african'))
+
+    # One collect for everything, so the shared load and filters run once and the sheets in parallel
+    *collected, non_african = pl.collect_all(queries + [non_african])
+
+    caps = compile_rules(rules)['caps']
+    sheets, stats = [], []
+    for sheet, counters in zip(collected, sheet_counters):
+        for priority in caps:
+            counters[priority] += int(((sheet['Matched rules'] & rule_bit(priority)) != 0).sum())
+        stats.append(sheet_statistics(sheet, priority_names))
+        sheet = sheet.to_pandas().set_index('row_no')
+        sheet.index.name = None
+        sheets.append(sheet)
+
+    non_african = non_african.to_pandas().set_index('row_no')['non_african']
+    non_african.index.name = None
+    return sheets, stats[:2], non_african
@@ -0,0 +1,137 @@
+"""Server-side paging, sorting and filtering of a prioritized report sheet for the page's preview table.
+
+The prioritized sheets of a report are kept per upload and settings, so
+moving between pages, sorting or filtering only slices a cached DataFrame and
+just the visible page of rows is sent to the browser.
+"""
+import json
+import re
+import threading
+import weakref
+from collections import OrderedDict
+
+import pandas as pd
+
+from priority_reports import REPORT_TYPES, prioritize_report, report_sheets
+
+# Reports kept for the preview table; each is the six sheets of one upload under one setting
+PREVIEW_CACHE_SIZE = 8
+
+PREVIEW_PAGE_SIZE = 50
+
+_preview_reports = OrderedDict()
+_preview_lock = threading.Lock()
+
+# One condition of a DataTable filter_query, e.g. {Housemaid Name} icontains "maria" or {Priority number} = 3
+FILTER_CONDITION = re.compile(r'\{(?P<column>[^}]+)\}\s+(?P<op>[is]?(?:contains|datestartswith|eq|ne|lt|le|gt|ge)|<=|>=|!=|=|<|>)\s+(?P<value>.+)')
+
+FILTER_OPERATORS = {
+    'eq': '=', 'ne': '!=', 'lt': '<', 'le': '<=', 'gt': '>', 'ge': '>=',
+}
+
+
+def preview_key(df, report_type, payment_added, priority_counters, priority_thresholds, params):
+    settings = json.dumps([report_type, payment_added, priority_counters, priority_thresholds, params], sort_keys=True)
+    return id(df), settings
+
+
+def preview_sheets(df, report_type, payment_added='No', priority_counters=None, priority_thresholds=None, params=None, engine='pandas'):
+    """The six sheets of a report by name, prioritized once per upload and settings.
+
+    Like the upload cache, the sheets are shared between callers and must be
+    treated as read-only.
+    """
+    key = preview_key(df, report_type, payment_added, priority_counters, priority_thresholds, params)
+    with _preview_lock:
+        cached = _preview_reports.get(key)
+        if cached is not None and cached[0]() is df:
+            _preview_reports.move_to_end(key)
+            return cached[1]
+
+    sheets, non_african, _ = prioritize_report(df, report_type, payment_added, priority_counters, priority_thresholds, params, engine)
+    named = report_sheets(REPORT_TYPES[report_type], sheets, non_african)
+
+    with _preview_lock:
+        _preview_reports[key] = (weakref.ref(df), named)
+        _preview_reports.move_to_end(key)
+        while len(_preview_reports) > PREVIEW_CACHE_SIZE:
+            _preview_reports.popitem(last=False)
+    return named
+
+
+def parse_filter_value(value):
+    """A filter_query operand as (text, number); number is None unless it is an unquoted number."""
+    value = value.strip()
+    if len(value) >= 2 and value[0] == value[-1] and value[0] in '"\'`':
+        return value[1:-1].replace('\\' + value[0], value[0]), None
+    try:
+        return value, float(value)
+    except ValueError:
+        return value, None
+
+
+def condition_mask(column, op, value):
+    """Boolean mask of one filter condition over a sheet column; value is a parse_filter_value pair."""
+    # An 'i' or 's' prefix is the case (in)sensitive form of the operator
+    case_insensitive = op[0] == 'i'
+    if op[0] in ('i', 's') and op[1:] in ('contains', 'datestartswith', *FILTER_OPERATORS):
+        op = op[1:]
+    op = FILTER_OPERATORS.get(op, op)
+
+    text, number = value
+    if op in ('contains', 'datestartswith'):
+        # Numbers are matched as they are displayed, so a Request ID can be searched for by its digits
+        values = column.astype('Int64').astype('string') if pd.api.types.is_integer_dtype(column) else column.astype('string')
+        if op == 'contains':
+            return values.str.contains(text, case=not case_insensitive, regex=False).fillna(False)
+        return values.str.startswith(text).fillna(False)
+
+    if number is not None:
+        values, value = pd.to_numeric(column, errors='coerce'), number
+    else:
+        value = text
+        values = column.astype('string')
+        if case_insensitive:
+            values, value = values.str.lower(), value.lower()
+    mask = {'=': values == value, '!=': values != value, '<': values < value,
+            '<=': values <= value, '>': values > value, '>=': values >= value}[op]
+    return mask.fillna(op == '!=').astype(bool)
+
+
+def filter_sheet(sheet, filter_query):
+    """Rows of sheet matching a DataTable filter_query; conditions are joined with &&."""
+    if not filter_query:
+        return sheet
+    mask = pd.Series(True, index=sheet.index)
+    for part in filter_query.split(' && '):
+        match = FILTER_CONDITION.fullmatch(part.strip())
+        if match is None:
+            raise ValueError(f"Unsupported filter: {part.strip()}")
+        column = match['column']
+        if column not in sheet.columns:
+            raise ValueError(f"Unknown column in filter: {column}")
+        mask &= condition_mask(sheet[column], match['op'], parse_filter_value(match['value'])).to_numpy()
+    return sheet[mask.to_numpy()]
+
+
+def sort_sheet(sheet, sort_by):
+    """sheet ordered by a DataTable sort_by list, keeping the report order among ties.
+
+    Text columns are sorted alphabetically, not in the order of their categories.
+    """
+    if not sort_by:
+        return sheet
+    return sheet.sort_values([entry['column_id'] for entry in sort_by],
+                             ascending=[entry['direction'] == 'asc' for entry in sort_by], kind='stable',
+                             key=lambda column: column.astype('string') if isinstance(column.dtype, pd.CategoricalDtype) else column)
+
+
+def sheet_page(sheet, page_current, page_size, sort_by=None, filter_query=None):
+    """One page of sheet after filtering and sorting: (records, page count, matching row count)."""
+    rows = sort_sheet(filter_sheet(sheet, filter_query), sort_by)
+    page_size = page_size or PREVIEW_PAGE_SIZE
+    page_count = max(1, -(-len(rows) // page_size))
+    start = min(page_current or 0, page_count - 1) * page_size
+    page = rows.iloc[start:start + page_size]
+    # Through JSON so numpy and pandas scalars (and missing values) are sent as plain JSON values
+    return json.loads(page.to_json(orient='records')), page_count, len(rows)
@@ -0,0 +1,470 @@
+import heapq
+import io
+import itertools
+import os
+import pickle
+import tempfile
+
+import numpy as np
+import pandas as pd
+import xlsxwriter
+
+from priority_engine import (PRIORITY_RULES, african_countries, compact_export, evaluate_rules, evaluation_from_bits, matched_rule_names,
+                             pushdown_rules, rule_columns, rule_statistics, slice_rule_matches, priority_names as get_priority_names)
+from upload_cache import read_export_chunks
+
+# Columns carried from the export into every report sheet
+REPORT_COLUMNS = ['Request ID', 'Housemaid Name', 'Housemaid Nationality', 'Housemaid Type', 'Gender', 'Been in the table for (in days)', 'Docs status']
+
+# Every export column build_report reads; uploads are loaded with just these
+EXPORT_COLUMNS = list(dict.fromkeys(REPORT_COLUMNS + rule_columns() + ['Outcome', 'Payment added?']))
+
+# 'Matched rules' is the bitmask of every rule a row matched (bit 0 is priority 1),
+# see priority_engine.slice_rule_matches
+OUTPUT_COLUMNS = ['Priority number', 'Request ID', 'Housemaid Name', 'Housemaid Nationality', 'Housemaid Type', 'Gender', 'Priority Name', 'Been in the table for (in days)', 'Docs status', 'Matched rules']
+
+# Columns of a report sheet: the engines' OUTPUT_COLUMNS plus the matched rules spelled
+# out by name, so a reader can see why each maid has her priority (see add_rule_names)
+SHEET_COLUMNS = OUTPUT_COLUMNS + ['Matched rule names']
+
+# Defaults used when an input is left empty on the page or omitted on the command line
+DEFAULT_COUNTERS = {6: 0, 7: 0, 8: 0, 10: 0, 11: 0}
+
+DEFAULT_THRESHOLDS = {
+    'Filipina Live-In': 80,
+    'African Live-In': 60,
+    'Ethiopian Live-In': 70,
+    'Filipina Live-Out': 60,
+    'African Live-Out': 40
+}
+
+DEFAULT_PARAMS = {'mv_urgency_days': 5, 'last_day_in_country': 5}
+
+# Command line flag / API parameter suffix for each capped priority's counter and threshold
+CAPPED_PRIORITIES = {
+    'filipina-live-in': (6, 'Filipina Live-In'),
+    'african-live-in': (7, 'African Live-In'),
+    'ethiopian-live-in': (8, 'Ethiopian Live-In'),
+    'filipina-live-out': (10, 'Filipina Live-Out'),
+    'african-live-out': (11, 'African Live-Out'),
+}
+
+
+def input_settings(counters, thresholds, mv_urgency_days=None, last_day_in_country=None):
+    """(priority_counters, priority_thresholds, params) from the page's inputs.
+
+    counters and thresholds are the input values in CAPPED_PRIORITIES order;
+    an empty input takes its default.
+    """
+    capped = list(CAPPED_PRIORITIES.values())
+    priority_counters = {priority: value or DEFAULT_COUNTERS[priority] for (priority, _), value in zip(capped, counters)}
+    priority_thresholds = {name: value or DEFAULT_THRESHOLDS[name] for (_, name), value in zip(capped, thresholds)}
+    params = {'mv_urgency_days': mv_urgency_days or DEFAULT_PARAMS['mv_urgency_days'],
+              'last_day_in_country': last_day_in_country or DEFAULT_PARAMS['last_day_in_country']}
+    return priority_counters, priority_thresholds, params
+
+
+TOP_PRIORITIES = [1, 2, 3, 4, 5]
+
+# Pre-filter of the local page that leaves out maids with an MB or a contract MB,
+# as column -> values kept (see prioritize_report_rows)
+NO_MB_PREFILTERS = {'MB?': ['No'], 'Has Contract MB?': ['No']}
+
+# Engine the Prioritization page and API prioritize with: 'pandas', 'polars' or 'duckdb' (see build_report);
+# the last two are installed with requirements-engines.txt
+REPORT_ENGINE = os.environ.get('REPORT_ENGINE', 'pandas')
+
+# Directory of the export snapshots the page diffs each upload against (see priority_delta); unset disables it
+SNAPSHOT_DIR = os.environ.get('PRIORITY_SNAPSHOT_DIR') or None
+
+# Rows typed and prioritized at a time by build_report_chunked
+EXPORT_CHUNK_ROWS = 100_000
+
+# Rows of a sheet converted to cell values at a time while a workbook is written
+WRITE_CHUNK_ROWS = 10_000
+
+# Rows per block of a run spilled to disk by build_report_chunked; the merge holds one block of each run
+SPILL_BLOCK_ROWS = 2_000
+
+# The header style DataFrame.to_excel gives a sheet
+HEADER_FORMAT = {'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'}
+
+# Sheet names, output file and row selections of each report. 'lawp' picks the
+# accepted/rejected sheets from LAWP rows only (True), non-LAWP rows only
+# (False) or all rows (None); the Combined sheet always covers every row.
+# 'targets' keeps only rows in those priorities, evaluating only the rules
+# that can produce them.
+REPORT_TYPES = {
+    'combined': {
+        'filename': "combined_maids_docs_report.xlsx",
+        'lawp': None,
+        'sheets': ['Accepted', 'Rejected', 'Combined',
+                   'Accepted No-Africans', 'Rejected No-Africans', 'Combined No-Africans'],
+    },
+    'lawp': {
+        'filename': "lawp_maids_docs_report.xlsx",
+        'lawp': True,
+        'sheets': ['Accepted LAWP', 'Rejected LAWP', 'Combined LAWP',
+                   'Accepted No-Africans LAWP', 'Rejected No-Africans LAWP', 'Combined No-Africans LAWP'],
+    },
+    'non_lawp': {
+        'filename': "non_lawp_maids_docs_report.xlsx",
+        'lawp': False,
+        'sheets': ['Accepted Non-LAWP', 'Rejected Non-LAWP', 'Combined Non-LAWP',
+                   'Accepted No-Africans Non-LAWP', 'Rejected No-Africans Non-LAWP', 'Combined No-Africans Non-LAWP'],
+    },
+    'top': {
+        'filename': "top_priorities_report.xlsx",
+        'lawp': False,
+        'targets': TOP_PRIORITIES,
+        'sheets': ['Accepted Non-LAWP-Top', 'Rejected Non-LAWP-Top', 'Combined Non-LAWP-Top',
+                   'Accepted No-Afr Non-LAWP-Top', 'Rejected No-Afr Non-LAWP-Top', 'Combined No-Afr Non-LAWP-Top'],
+    },
+}
+
+
+def prepare_report_frame(df):
+    """Split the rows into approved and rejected; 'Docs status' is already normalised at load time."""
+    is_approved = (df['Docs status'] == 'Approved').to_numpy(dtype=bool)
+    is_rejected = (df['Docs status'] == 'Rejected').to_numpy(dtype=bool)
+    return df[REPORT_COLUMNS], is_approved, is_rejected
+
+
+def calculate_statistics(df, priority_names):
+    """Calculate statistics for the prioritized DataFrame with a single grouped count per priority and gender."""
+    gender = np.select([df['Gender'] == 'Male', df['Gender'] == 'Female'], ['Male', 'Female'], 'Other')
+    counts = (df.groupby([df['Priority number'], gender]).size()
+              .unstack(fill_value=0)
+              .reindex(index=list(priority_names), columns=['Male', 'Female', 'Other'], fill_value=0))
+    stats = pd.DataFrame({'Males': counts['Male'], 'Females': counts['Female'], 'Total': counts.sum(axis=1)})
+    stats.index = list(priority_names.values())
+    return stats
+
+
+def process_dataframe(report_df, evaluation, selection, priority_counters, priority_thresholds, priority_names):
+    """Assign priorities to the selected rows and generate statistics, reusing rule masks evaluated once per report."""
+    df = report_df[selection].copy()
+    df['Priority number'], df['Matched rules'] = slice_rule_matches(evaluation, selection, priority_counters, priority_thresholds)
+    df['Priority Name'] = df['Priority number'].map(priority_names)
+
+    output_df = df.sort_values(by=['Priority number', 'Been in the table for (in days)'], ascending=[True, False])
+    output_df = output_df[OUTPUT_COLUMNS]
+
+    stats = calculate_statistics(df, priority_names)
+
+    return output_df, stats
+
+
+def add_rule_names(sheets, priority_names):
+    """The sheets with a 'Matched rule names' column decoding each row's 'Matched rules'."""
+    return [sheet.assign(**{'Matched rule names': matched_rule_names(sheet['Matched rules'], priority_names)}) for sheet in sheets]
+
+
+def resolve_settings(priority_counters, priority_thresholds, params):
+    """Fill in the defaults for any counter, threshold or parameter left out."""
+    return ({**DEFAULT_COUNTERS, **(priority_counters or {})},
+            {**DEFAULT_THRESHOLDS, **(priority_thresholds or {})},
+            {**DEFAULT_PARAMS, **(params or {})})
+
+
+def prioritize_report_rows(df, report, payment_added, sheet_counters, priority_thresholds, params, priority_names, rule_bits=None,
+                           prefilters=None):
+    """Prioritize the accepted, rejected and combined rows of df (a whole export or one chunk of it).
+
+    sheet_counters holds one counters dict per sheet; each is updated in place
+    so the next chunk continues the capped counts where this one stopped.
+    rule_bits, if given, are the rows' evaluation_rule_bits under params and
+    replace rule evaluation (see priority_delta). prefilters maps columns to
+    the values a row must have in them to be in any sheet, like payment_added.
+    Returns ([accepted_df, rejected_df, combined_df], [accepted_stats, rejected_stats, rule_stats], non_african);
+    rule_stats is rule_statistics over the combined sheet.
+    """
+    # Evaluate the rules, the docs status split and the African filter once per report;
+    # every sheet below is a cheap selection with its own capped-counter pass. Rules run
+    # over the whole export so their parameter-independent masks are reused across
+    # reports, and the payment filter is applied as part of each selection.
+    targets = report.get('targets')
+    rules = pushdown_rules(targets) if targets else PRIORITY_RULES
+    evaluation = evaluate_rules(df, params, rules) if rule_bits is None else evaluation_from_bits(rule_bits, rules)
+    report_df, is_approved, is_rejected = prepare_report_frame(df)
+    if payment_added in ["Yes", "No"]:
+        in_payment = (df['Payment added?'] == payment_added).to_numpy(dtype=bool)
+        is_approved = is_approved & in_payment
+        is_rejected = is_rejected & in_payment
+    for column, values in (prefilters or {}).items():
+        kept = df[column].isin(values).to_numpy(dtype=bool)
+        is_approved = is_approved & kept
+        is_rejected = is_rejected & kept
+    nationality = df['Housemaid Nationality']
+    non_african = ~nationality.isin(african_countries) | (nationality == 'Ethiopian')
+
+    accepted, rejected = is_approved, is_rejected
+    if report['lawp'] is not None:
+        is_lawp = (df['Outcome'] == 'LAWP').to_numpy(dtype=bool)
+        in_report = is_lawp if report['lawp'] else ~is_lawp
+        accepted, rejected = in_report & is_approved, in_report & is_rejected
+    combined = is_approved | is_rejected
+
+    if targets and not evaluation['caps']:
+        # Without capped rules a row's priority does not depend on the other rows
+        # in its slice, so non-target rows are dropped before any frame is built
+        in_targets = np.isin(evaluation['uncapped_priority'], targets)
+        accepted, rejected, combined = accepted & in_targets, rejected & in_targets, combined & in_targets
+
+    sheets, stats = [], []
+    for selection, counters in zip([accepted, rejected, combined], sheet_counters):
+        sheet, sheet_stats = process_dataframe(report_df, evaluation, selection, counters, priority_thresholds, priority_names)
+        sheets.append(sheet)
+        stats.append(sheet_stats)
+    combined_sheet = sheets[2]
+    rule_stats = rule_statistics(evaluation, combined, combined_sheet['Priority number'].to_numpy(),
+                                 combined_sheet['Matched rules'].to_numpy(), priority_names)
+    return add_rule_names(sheets, priority_names), stats[:2] + [rule_stats], non_african
+
+
+def report_sheets(report, sheets, non_african):
+    """The accepted, rejected and combined sheets of a report plus their No-Africans copies, by sheet name."""
+    targets = report.get('targets')
+    if targets:
+        sheets = [sheet[sheet['Priority number'].isin(targets)] for sheet in sheets]
+
+    # Exclude African maids, but keep Ethiopians
+    sheets = sheets + [sheet[non_african.loc[sheet.index].to_numpy(dtype=bool)] for sheet in sheets]
+    return dict(zip(report['sheets'], sheets))
+
+
+def sheet_row_blocks(sheet, block_rows=WRITE_CHUNK_ROWS):
+    """The rows of sheet in blocks, each a list of tuples of plain Python values with None for missing ones."""
+    for start in range(0, len(sheet), block_rows):
+        chunk = sheet.iloc[start:start + block_rows]
+        yield list(chunk.astype(object).where(chunk.notna(), None).itertuples(index=False, name=None))
+
+
+def write_rows(workbook, sheet_name, columns, rows, header_format):
+    """Add a sheet of columns to an xlsxwriter workbook, writing rows (value tuples) one at a time in order."""
+    worksheet = workbook.add_worksheet(sheet_name)
+    worksheet.write_row(0, 0, [str(column) for column in columns], header_format)
+    for row, values in enumerate(rows, start=1):
+        # None values are left as blank cells
+        worksheet.write_row(row, 0, values)
+
+
+def write_sheet(workbook, sheet_name, sheet, header_format):
+    """Add sheet to an xlsxwriter workbook row by row, laid out as DataFrame.to_excel does without the index."""
+    write_rows(workbook, sheet_name, sheet.columns, itertools.chain.from_iterable(sheet_row_blocks(sheet)), header_format)
+
+
+def write_report_file(report, sheets, non_african, output, extra_sheets=None):
+    """Write the workbook of write_report to output, a file path or binary file object.
+
+    The workbook is written in xlsxwriter's constant_memory mode, where each
+    row is flushed to disk as soon as the next one starts, so beyond the
+    sheets themselves memory use does not grow with the size of the report.
+    Returns output.
+    """
+    workbook = xlsxwriter.Workbook(output, {'constant_memory': True})
+    header_format = workbook.add_format(HEADER_FORMAT)
+    for sheet_name, sheet in {**report_sheets(report, sheets, non_african), **(extra_sheets or {})}.items():
+        write_sheet(workbook, sheet_name, sheet, header_format)
+    workbook.close()
+    return output
+
+
+def write_report(report, sheets, non_african, extra_sheets=None):
+    """Write the accepted, rejected and combined sheets of a report, plus their No-Africans copies.
+
+    extra_sheets maps further sheet names to DataFrames written after them.
+    Returns the workbook bytes; write_report_file writes it to a file instead.
+    """
+    return write_report_file(report, sheets, non_african, io.BytesIO(), extra_sheets).getvalue()
+
+
+def log_rule_statistics(report_type, stats):
+    """Print a report's per-rule hits and timings to the server log, when its engine recorded them."""
+    rules = stats.get('Rules')
+    if rules is not None:
+        print(f"Rule hits and timings for the {report_type} report:\n{rules.to_string()}")
+
+
+def prioritize_report(df, report_type, payment_added='No', priority_counters=None, priority_thresholds=None, params=None,
+                      engine='pandas', rule_bits=None, prefilters=None, log_rules=True):
+    """Prioritize a typed export for one report without writing it.
+
+    Returns ([accepted_df, rejected_df, combined_df], non_african,
+    {'Accepted': stats, 'Rejected': stats, 'Rules': rule_stats}). 'Rules',
+    from the pandas engine only, holds each rule's hits over the Combined sheet
+    and its evaluation time (see priority_engine.rule_statistics); it is
+    logged with log_rule_statistics unless log_rules is False. See
+    build_report for the arguments and prioritize_report_rows for rule_bits
+    and prefilters (pandas engine only).
+    """
+    if rule_bits is not None and engine != 'pandas':
+        raise ValueError("rule_bits are only supported by the pandas engine")
+    if prefilters and engine != 'pandas':
+        raise ValueError("prefilters are only supported by the pandas engine")
+    report = REPORT_TYPES[report_type]
+    priority_counters, priority_thresholds, params = resolve_settings(priority_counters, priority_thresholds, params)
+    priority_names = get_priority_names(params)
+
+    sheet_counters = [priority_counters.copy() for _ in range(3)]
+    if engine in ('duckdb', 'polars'):
+        if engine == 'duckdb':
+            from priority_duckdb import prioritize_report_rows_duckdb as prioritize_rows
+        else:
+            from priority_polars import prioritize_report_rows_polars as prioritize_rows
+        targets = report.get('targets')
+        sheets, stats, non_african = prioritize_rows(
+            df, report, payment_added, sheet_counters, priority_thresholds, params, priority_names,
+            EXPORT_COLUMNS, OUTPUT_COLUMNS, pushdown_rules(targets) if targets else PRIORITY_RULES, targets)
+        sheets = add_rule_names(sheets, priority_names)
+    elif engine == 'pandas':
+        sheets, stats, non_african = prioritize_report_rows(df, report, payment_added, sheet_counters, priority_thresholds, params, priority_names,
+                                                            rule_bits, prefilters)
+    else:
+        raise ValueError(f"Unknown engine: {engine}")
+    report_stats = {'Accepted': stats[0], 'Rejected': stats[1]}
+    if len(stats) > 2:
+        report_stats['Rules'] = stats[2]
+    if log_rules:
+        log_rule_statistics(report_type, report_stats)
+    return sheets, non_african, report_stats
+
+
+def build_report(df, report_type, payment_added='No', priority_counters=None, priority_thresholds=None, params=None, progress=None,
+                 engine='pandas', snapshot_dir=None, prefilters=None, output=None, snapshot_source=None):
+    """Prioritize a typed export and write one report workbook.
+
+    report_type is a key of REPORT_TYPES and payment_added is 'Yes', 'No' or
+    'Combined'. prefilters, such as NO_MB_PREFILTERS, restrict every sheet to
+    rows with the given column values. progress, if given, is called with a
+    short message before each stage. Returns (workbook bytes, file name, stats)
+    with stats as in prioritize_report; for reports with targets the
+    statistics cover the target rows only. Given output, a file path or binary
+    file object, the workbook is streamed there (see write_report_file) and
+    returned in place of the bytes.
+
+    engine='duckdb' runs the rules as SQL in an embedded DuckDB (see
+    priority_duckdb) and engine='polars' as lazy Polars queries (see
+    priority_polars); df may then also be the path of a UTF-16 TSV export or
+    of its Parquet copy.
+
+    With snapshot_dir, only rows that changed since the previous export of
+    snapshot_source (see priority_delta.export_source) are evaluated and a
+    Movers sheet is added; the movers are also returned as stats['Movers']
+    (None for the first export). This uses the pandas engine.
+    """
+    report = REPORT_TYPES[report_type]
+    progress = progress or (lambda message: None)
+
+    progress("Assigning priorities...")
+    extra_sheets = {}
+    if snapshot_dir:
+        from priority_delta import DEFAULT_SOURCE, prioritize_delta
+        sheets, non_african, stats, movers, _ = prioritize_delta(df, report_type, payment_added, priority_counters, priority_thresholds,
+                                                                 params, snapshot_dir, prefilters,
+                                                                 source=snapshot_source or DEFAULT_SOURCE)
+        stats['Movers'] = movers
+        if movers is not None:
+            extra_sheets['Movers'] = movers
+    else:
+        sheets, non_african, stats = prioritize_report(df, report_type, payment_added, priority_counters, priority_thresholds, params, engine,
+                                                       prefilters=prefilters)
+
+    progress("Writing the report workbook...")
+    if output is not None:
+        workbook = write_report_file(report, sheets, non_african, output, extra_sheets)
+    else:
+        workbook = write_report(report, sheets, non_african, extra_sheets)
+    return workbook, report['filename'], stats
+
+
+def spill_run(sheet, path):
+    """Write a sheet already in report order to path as pickled blocks of row tuples, for merge_sorted_runs."""
+    with open(path, 'wb') as f:
+        for rows in sheet_row_blocks(sheet, SPILL_BLOCK_ROWS):
+            pickle.dump(rows, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def read_run(path):
+    """The rows spilled to path by spill_run, reading one block at a time."""
+    with open(path, 'rb') as f:
+        while True:
+            try:
+                rows = pickle.load(f)
+            except EOFError:
+                return
+            yield from rows
+
+
+def report_order_key(columns):
+    """Sort key of a row tuple of columns in report order, as sorted by process_dataframe."""
+    priority_at, days_at = columns.index('Priority number'), columns.index('Been in the table for (in days)')
+
+    def key(row):
+        days = row[days_at]
+        # Ascending priority, then the most days first, with missing days last as sort_values puts them
+        return row[priority_at], days is None, -days if days is not None else 0
+    return key
+
+
+def merge_sorted_runs(paths, columns):
+    """Merge the rows of runs spilled to paths, each already in report order, into one stream in report order.
+
+    heapq.merge takes tied rows from earlier runs first and keeps each run's own
+    order, so rows that tie on priority and days keep their file order, exactly
+    as when the whole export is sorted at once. Only one block of each run is
+    held at a time.
+    """
+    return heapq.merge(*(read_run(path) for path in paths), key=report_order_key(columns))
+
+
+def write_merged_report(runs, columns, output):
+    """Write a workbook to output whose sheets are merged from spilled runs; runs maps sheet names to run paths."""
+    workbook = xlsxwriter.Workbook(output, {'constant_memory': True})
+    header_format = workbook.add_format(HEADER_FORMAT)
+    for sheet_name, paths in runs.items():
+        write_rows(workbook, sheet_name, columns, merge_sorted_runs(paths, columns), header_format)
+    workbook.close()
+    return output
+
+
+def build_report_chunked(source, report_type, payment_added='No', priority_counters=None, priority_thresholds=None, params=None,
+                         chunksize=EXPORT_CHUNK_ROWS, progress=None, output=None):
+    """build_report for a UTF-16 TSV export read from a binary file object chunk by chunk.
+
+    Only one chunk of the export is held (and typed) at a time. The capped
+    counters carry over from chunk to chunk, and each chunk's sorted sheets
+    are spilled to temporary files that are merged straight into the
+    workbook at the end, so memory use does not grow with the export and the
+    workbook matches build_report on the whole export. output is as for
+    build_report.
+    """
+    report = REPORT_TYPES[report_type]
+    priority_counters, priority_thresholds, params = resolve_settings(priority_counters, priority_thresholds, params)
+    priority_names = get_priority_names(params)
+    progress = progress or (lambda message: None)
+
+    sheet_counters = [priority_counters.copy() for _ in range(3)]
+    runs = {sheet_name: [] for sheet_name in report['sheets']}
+    stats = None
+    with tempfile.TemporaryDirectory() as spill_dir:
+        for number, chunk in enumerate(read_export_chunks(source, EXPORT_COLUMNS, chunksize), start=1):
+            progress(f"Assigning priorities (chunk {number})...")
+            sheets, chunk_stats, chunk_non_african = prioritize_report_rows(
+                compact_export(chunk), report, payment_added, sheet_counters, priority_thresholds, params, priority_names)
+            for index, (sheet_name, sheet) in enumerate(report_sheets(report, sheets, chunk_non_african).items()):
+                path = os.path.join(spill_dir, f"{number}-{index}.pkl")
+                spill_run(sheet, path)
+                runs[sheet_name].append(path)
+            stats = chunk_stats if stats is None else [total.add(part) for total, part in zip(stats, chunk_stats)]
+
+        if stats is None:
+            raise ValueError("The export has no rows.")
+
+        progress("Writing the report workbook...")
+        workbook = write_merged_report(runs, SHEET_COLUMNS, output if output is not None else io.BytesIO())
+    if output is None:
+        workbook = workbook.getvalue()
+    report_stats = {'Accepted': stats[0], 'Rejected': stats[1], 'Rules': stats[2]}
+    log_rule_statistics(report_type, report_stats)
+    return workbook, report['filename'], report_stats
@@ -13,6 +13,7 @@ from googleapiclient.discovery import build
 import re
 from googleapiclient.discovery import build
 from googleapiclient.http import HttpRequest
+from upload_cache import MissingColumnsError, check_columns, select_columns
 # Initialize the Dash app with a modern theme
 app = dash.Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP, dbc.icons.FONT_AWESOME])
 
@@ -141,6 +142,81 @@ app.layout = dbc.Container([
 ], fluid=True, className="px-4 py-5 bg-light")
 layout = app.layout
 
+# Columns the distribution reads from an upload; the rest of a wide export is never parsed
+REQUIRED_COLUMNS = ['Priority number', 'Request ID', 'Housemaid Name', 'Housemaid Nationality']
+
+
+# Helper function to extract Google Sheet ID from either URL or direct ID
+def extract_sheet_id(link):
+    if re.match(r'^[a-zA-Z0-9-_]+$', link):  # Direct Sheet ID format
+        return link
+    match = re.search(r"/d/([a-zA-Z0-9-_]+)", link)
+    return match.group(1) if match else None
+
+
+# Filter out blank entries
+def filter_blank_entries(df):
+    missing_columns = [col for col in ['Request ID', 'Housemaid Name'] if col not in df.columns]
+    if missing_columns:
+        raise KeyError(f"The following required columns are missing: {', '.join(missing_columns)}")
+    return df.dropna(subset=['Request ID', 'Housemaid Name'])
+
+
+# Distribute maids to PCs
+def distribute_maids(df, num_pcs):
+    df_sorted = df  # Keep the original order from the uploaded Excel
+    distribution = {f"PC_{i+1}": [] for i in range(num_pcs)}
+    priorities = df_sorted['Priority number'].unique()
+    pc_index = 0
+    for priority in priorities:
+        priority_maids = df_sorted[df_sorted['Priority number'] == priority]
+        for _, maid in priority_maids.iterrows():
+            maid_info = {
+                'Priority number': maid['Priority number'],  # Add Priority Number
+                'id': maid['Request ID'],
+                'name': maid['Housemaid Name'],
+                'Nationality': maid['Housemaid Nationality']  # Add Nationality
+            }
+            distribution[f"PC_{pc_index + 1}"].append(maid_info)
+            pc_index = (pc_index + 1) % num_pcs
+    return distribution
+
+
+def create_output_file(distribution, distribution_type):
+    output = io.BytesIO()
+    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
+        for pc, maids in distribution.items():
+            pc_df = pd.DataFrame(maids)
+            if distribution_type == 'replacement':
+                columns = ['Request ID', 'Housemaid Name', 'Cancel ID', 'Type', 'Gender', 'Priority Name']
+            else:
+                # columns = ['Request ID', 'Housemaid Name', 'Type', 'Gender', 'Priority Name']
+                columns = ['Priority number', 'id', 'name', 'Nationality']
+            pc_df = pc_df[columns]
+            pc_df.to_excel(writer, sheet_name=pc, index=False)
+    return output
+
+
+HttpRequest.DEFAULT_HTTP_TIMEOUT = 300  # Set to 300 seconds (5 minutes)
+
+# Write data to Google Sheet
+def write_to_google_sheet(sheet_id, data):
+    try:
+        # creds = service_account.Credentials.from_service_account_file(
+        #     SERVICE_ACCOUNT_FILE, scopes=['https://www.googleapis.com/auth/spreadsheets']
+        # )
+        creds = service_account.Credentials.from_service_account_info(SERVICE_ACCOUNT_INFO)
+        service = build('sheets', 'v4', credentials=creds)
+        service.spreadsheets().values().clear(spreadsheetId=sheet_id, range='A1:Z').execute()
+        body = {'values': [data.columns.tolist()] + data.values.tolist()}
+        result = service.spreadsheets().values().update(spreadsheetId=sheet_id, range='A1', valueInputOption='USER_ENTERED', body=body).execute()
+        print(f"{result.get('updatedCells')} cells updated.")
+        return True
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        return False
+
+
 def register_callbacks(app):
 
     def create_pc_row(name, link, index):
@@ -152,28 +228,23 @@ def register_callbacks(app):
         ], className="mb-2")
 
 
-    # Helper function to extract Google Sheet ID from either URL or direct ID
-    def extract_sheet_id(link):
-        if re.match(r'^[a-zA-Z0-9-_]+$', link):  # Direct Sheet ID format
-            return link
-        match = re.search(r"/d/([a-zA-Z0-9-_]+)", link)
-        return match.group(1) if match else None
-
     # Parse uploaded file
     def parse_contents(contents, filename):
         content_type, content_string = contents.split(',')
         decoded = base64.b64decode(content_string)
         try:
             if 'xlsx' in filename:
-                df = pd.read_excel(io.BytesIO(decoded))
+                df = pd.read_excel(io.BytesIO(decoded), usecols=select_columns(REQUIRED_COLUMNS))
             elif 'csv' in filename:
-                df = pd.read_csv(io.StringIO(decoded.decode('utf-8')))
+                df = pd.read_csv(io.StringIO(decoded.decode('utf-8')), usecols=select_columns(REQUIRED_COLUMNS))
             else:
-                return html.Div(['Please upload an Excel or CSV file.'])
-            return df
+                return html.Div("Please upload an Excel or CSV file.", className="alert alert-warning")
+            return check_columns(df, REQUIRED_COLUMNS)
+        except MissingColumnsError as e:
+            return html.Div(str(e), className="alert alert-danger")
         except Exception as e:
             print(e)
-            return html.Div(['There was an error processing this file.'])
+            return html.Div("Error processing the file.", className="alert alert-danger")
 
     # Sort maids based on priority
     def prioritize_maids(df):
@@ -181,66 +252,6 @@ def register_callbacks(app):
             raise KeyError("The column 'Priority number' is missing from the file.")
         return df.sort_values('Priority number')
 
-    # Filter out blank entries
-    def filter_blank_entries(df):
-        missing_columns = [col for col in ['Request ID', 'Housemaid Name'] if col not in df.columns]
-        if missing_columns:
-            raise KeyError(f"The following required columns are missing: {', '.join(missing_columns)}")
-        return df.dropna(subset=['Request ID', 'Housemaid Name'])
-
-    # Distribute maids to PCs
-    def distribute_maids(df, num_pcs):
-        df_sorted = df  # Keep the original order from the uploaded Excel
-        distribution = {f"PC_{i+1}": [] for i in range(num_pcs)}
-        priorities = df_sorted['Priority number'].unique()
-        pc_index = 0
-        for priority in priorities:
-            priority_maids = df_sorted[df_sorted['Priority number'] == priority]
-            for _, maid in priority_maids.iterrows():
-                maid_info = {
-                    'Priority number': maid['Priority number'],  # Add Priority Number
-                    'id': maid['Request ID'],
-                    'name': maid['Housemaid Name'],
-                    'Nationality': maid['Housemaid Nationality']  # Add Nationality
-                }
-                distribution[f"PC_{pc_index + 1}"].append(maid_info)
-                pc_index = (pc_index + 1) % num_pcs
-        return distribution
-
-    def create_output_file(distribution, distribution_type):
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-            for pc, maids in distribution.items():
-                pc_df = pd.DataFrame(maids)
-                if distribution_type == 'replacement':
-                    columns = ['Request ID', 'Housemaid Name', 'Cancel ID', 'Type', 'Gender', 'Priority Name']
-                else:
-                    # columns = ['Request ID', 'Housemaid Name', 'Type', 'Gender', 'Priority Name']
-                    columns = ['Priority number', 'id', 'name', 'Nationality']
-                pc_df = pc_df[columns]
-                pc_df.to_excel(writer, sheet_name=pc, index=False)
-        return output
-
-
-    HttpRequest.DEFAULT_HTTP_TIMEOUT = 300  # Set to 300 seconds (5 minutes)
-
-    # Write data to Google Sheet
-    def write_to_google_sheet(sheet_id, data):
-        try:
-            # creds = service_account.Credentials.from_service_account_file(
-            #     SERVICE_ACCOUNT_FILE, scopes=['https://www.googleapis.com/auth/spreadsheets']
-            # )
-            creds = service_account.Credentials.from_service_account_info(SERVICE_ACCOUNT_INFO)
-            service = build('sheets', 'v4', credentials=creds)
-            service.spreadsheets().values().clear(spreadsheetId=sheet_id, range='A1:Z').execute()
-            body = {'values': [data.columns.tolist()] + data.values.tolist()}
-            result = service.spreadsheets().values().update(spreadsheetId=sheet_id, range='A1', valueInputOption='USER_ENTERED', body=body).execute()
-            print(f"{result.get('updatedCells')} cells updated.")
-            return True
-        except Exception as e:
-            print(f"An error occurred: {e}")
-            return False
-
     # Create a distribution chart
     def create_distribution_chart(distribution):
         pc_names = list(distribution.keys())
@@ -364,7 +375,8 @@ def register_callbacks(app):
 
         df = parse_contents(contents, filename)
         if not isinstance(df, pd.DataFrame):
-            return html.Div("Error processing the file.", className="alert alert-danger")
+            # parse_contents returns the message to show (e.g. the missing columns)
+            return df
 
         selected_pcs = [{"name": name, "link": extract_sheet_id(link)} for name, link, checked in zip(pc_names, pc_links, pc_checks) if checked and link.strip()]
         if not selected_pcs:
@@ -429,7 +441,8 @@ def register_callbacks(app):
 
             df = parse_contents(contents, filename)
             if not isinstance(df, pd.DataFrame):
-                return html.Div("Error processing the file.", className="alert alert-danger")
+                # parse_contents returns the message to show (e.g. the missing columns)
+                return df
 
             try:
                 df_filtered = filter_blank_entries(df)
@@ -0,0 +1,126 @@
+"""Finished report workbooks, kept on disk and streamed to the browser from there.
+
+Artifacts are keyed by the upload's content hash, the report, the payment
+toggle, every counter, threshold and parameter, the engine and the rule spec,
+so a repeated request is served without prioritizing again. The store lives in
+a private (0700) diskcache directory under the app's data dir, shared by the
+server and its background report jobs. It is trimmed to
+REPORT_ARTIFACTS_MAX_BYTES (oldest stored first), and an artifact expires
+REPORT_ARTIFACTS_MAX_AGE seconds after it was written.
+
+Workbooks are written to a file and copied into the store in blocks, and the
+download route sends them from the store the same way, so a large report is
+never held in memory whole.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import uuid
+
+import diskcache
+from flask import abort, send_file
+
+from priority_engine import PRIORITY_RULES, compile_rules
+from priority_reports import resolve_settings
+from upload_cache import APP_DATA_DIR, private_dir
+
+REPORT_ARTIFACTS_DIR = os.environ.get('REPORT_ARTIFACTS_DIR', os.path.join(APP_DATA_DIR, 'report-artifacts'))
+REPORT_ARTIFACTS_MAX_BYTES = int(os.environ.get('REPORT_ARTIFACTS_MAX_BYTES', 1024 * 1024 * 1024))
+REPORT_ARTIFACTS_MAX_AGE = int(os.environ.get('REPORT_ARTIFACTS_MAX_AGE', 24 * 60 * 60))
+
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+_store = None
+_store_pid = None
+
+
+def artifact_store():
+    """The process's handle on the artifact directory, opened on first use.
+
+    A forked background job opens its own handle instead of reusing the SQLite
+    connection it inherited from the server worker.
+    """
+    global _store, _store_pid
+    if _store is None or _store_pid != os.getpid():
+        _store_pid = os.getpid()
+        _store = diskcache.Cache(private_dir(REPORT_ARTIFACTS_DIR), size_limit=REPORT_ARTIFACTS_MAX_BYTES, eviction_policy='least-recently-stored')
+    return _store
+
+
+def artifact_key(upload_key, report_type, payment_added='No', priority_counters=None, priority_thresholds=None, params=None,
+                 engine='pandas', rules=PRIORITY_RULES):
+    """Store key of one report: upload_key is upload_cache.upload_key of the export it was built from.
+
+    Left-out settings are filled in with their defaults first, so a report
+    asked for with and without the default values shares one artifact.
+    """
+    priority_counters, priority_thresholds, params = resolve_settings(priority_counters, priority_thresholds, params)
+    return json.dumps([list(upload_key), report_type, payment_added, {str(p): c for p, c in priority_counters.items()},
+                       priority_thresholds, params, engine, compile_rules(rules)['hash']], sort_keys=True)
+
+
+def artifact_token(key):
+    """The name an artifact is stored and downloaded under; key is an artifact_key."""
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def load_artifact(token):
+    """The (file name, stats) of the workbook stored as token, or None."""
+    store = artifact_store()
+    # The workbook is stored before its details, so it is also evicted first
+    details = store.get((token, 'details'))
+    if details is None or token not in store:
+        return None
+    return details
+
+
+def open_artifact(token):
+    """The workbook stored as token as (open binary file, file name), or None."""
+    store = artifact_store()
+    details = store.get((token, 'details'))
+    workbook = store.get(token, read=True)
+    if details is None or workbook is None:
+        return None
+    return workbook, details[0]
+
+
+def store_artifact(token, path, filename, stats):
+    """Copy the workbook at path into the store as token, for REPORT_ARTIFACTS_MAX_AGE seconds."""
+    store = artifact_store()
+    with open(path, 'rb') as workbook:
+        store.set(token, workbook, read=True, expire=REPORT_ARTIFACTS_MAX_AGE)
+    store.set((token, 'details'), (filename, stats), expire=REPORT_ARTIFACTS_MAX_AGE)
+
+
+def stored_report(key, build):
+    """(token, file name, stats) of the report stored under key, built first if it is not there.
+
+    build(path) writes the workbook to path and returns (file name, stats).
+    With key None the report is always built, under a token of its own.
+    """
+    if key is None:
+        token = uuid.uuid4().hex
+    else:
+        token = artifact_token(key)
+        details = load_artifact(token)
+        if details is not None:
+            return (token, *details)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'report.xlsx')
+        filename, stats = build(path)
+        store_artifact(token, path, filename, stats)
+    return token, filename, stats
+
+
+def register_routes(server):
+    """Add the download route for stored report workbooks to the Flask server behind the Dash app."""
+
+    @server.route('/reports/<token>')
+    def download_report(token):
+        artifact = open_artifact(token)
+        if artifact is None:
+            abort(404)
+        workbook, filename = artifact
+        return send_file(workbook, mimetype=XLSX_MIMETYPE, as_attachment=True, download_name=filename)
@@ -0,0 +1,70 @@
+"""Synthetic maid exports shaped like the real prioritization upload, for benchmarks and parity checks."""
+import io
+
+import numpy as np
+import pandas as pd
+
+from priority_engine import african_countries, approved_strings, rejected_strings
+
+# Demonyms only ("Kenyan", not "Kenya" or "Kenyans"), the way nationalities appear in the export
+AFRICAN_NATIONALITIES = sorted(set(african_countries[1::4]) - {'Ethiopian'})
+
+# Share of each nationality group in a typical export
+NATIONALITY_MIX = {'Filipina': 0.35, 'Ethiopian': 0.2, 'African': 0.3, 'Other': 0.15}
+OTHER_NATIONALITIES = ['Indian', 'Sri Lankan', 'Indonesian', 'Nepalese', 'Bangladeshi']
+
+# Docs status as typed by hand: padded variants, blanks, missing values and statuses that are neither
+DOCS_STATUSES = approved_strings + rejected_strings + [None, 'Pending', 'Under Review']
+
+
+def _with_missing(rng, values, share):
+    values = values.astype(float)
+    values[rng.random(len(values)) < share] = np.nan
+    return values
+
+
+def generate_export(rows, seed=0):
+    """Generate an export DataFrame with the real column set and a realistic value mix."""
+    rng = np.random.default_rng(seed)
+    choice = lambda values, p=None: rng.choice(values, rows, p=p)
+
+    group = choice(list(NATIONALITY_MIX), p=list(NATIONALITY_MIX.values()))
+    nationality = np.where(group == 'Filipina', 'Filipina',
+                  np.where(group == 'Ethiopian', 'Ethiopian',
+                  np.where(group == 'African', choice(AFRICAN_NATIONALITIES), choice(OTHER_NATIONALITIES))))
+    today = pd.Timestamp.today().normalize()
+
+    return pd.DataFrame({
+        'Request ID': np.arange(rows) + 100000,
+        'Housemaid Name': [f"Maid {i}" for i in range(rows)],
+        'Housemaid Nationality': nationality,
+        'Housemaid Type': choice(['MV', 'CC'], p=[0.4, 0.6]),
+        'Housemaid Status': choice(['LANDED_IN_DUBAI', 'IN_EXIT', 'WITH_CLIENT', 'NOT_LANDED'], p=[0.35, 0.15, 0.2, 0.3]),
+        'Live out': choice(['No', 'Yes'], p=[0.7, 0.3]),
+        'Gender': choice(['Female', 'Male'], p=[0.9, 0.1]),
+        'Client Note': choice(['SUPER_ANGRY_CLIENT', 'PRIORITIZE_VISA', 'Call before visit', None], p=[0.02, 0.03, 0.15, 0.8]),
+        'Flight in (days)': _with_missing(rng, rng.integers(0, 30, rows), 0.6),
+        'Been in the table for (in days)': _with_missing(rng, rng.integers(0, 60, rows), 0.1),
+        'Last day to stay in country in': _with_missing(rng, rng.integers(-5, 60, rows), 0.7),
+        'Stage in Freedom Operator Page': choice(['Pending COC', 'Pending Exit Permit', 'Pending Medical', None], p=[0.1, 0.1, 0.2, 0.6]),
+        'Outcome': choice(['LAWP', 'Approved', None], p=[0.2, 0.3, 0.5]),
+        'Attested GCC': choice(['Yes', 'No'], p=[0.2, 0.8]),
+        'MFA': choice(['Yes', 'No'], p=[0.2, 0.8]),
+        'GCC': choice(['Yes', 'No'], p=[0.3, 0.7]),
+        'Docs status': choice(DOCS_STATUSES),
+        'Payment added?': choice(['Yes', 'No'], p=[0.3, 0.7]),
+        'MB?': choice(['Yes', 'No'], p=[0.2, 0.8]),
+        'Has Contract MB?': choice(['Yes', 'No'], p=[0.2, 0.8]),
+        'Offer Letter date': today - pd.to_timedelta(rng.integers(0, 30, rows), unit='D'),
+    })
+
+
+def export_bytes(df, file_format='csv'):
+    """Serialise an export the way users upload it: an Excel workbook or a UTF-16 tab-separated CSV."""
+    if file_format == 'xlsx':
+        output = io.BytesIO()
+        df.to_excel(output, index=False)
+        return output.getvalue()
+    if file_format == 'csv':
+        return df.to_csv(sep='\t', index=False).encode('utf-16')
+    raise ValueError(f"Unsupported file format: {file_format}")
@@ -0,0 +1,95 @@
+"""POST /api/prioritize answers bad exports and settings with 4xx and only server faults with 500."""
+import gzip
+
+import pytest
+from flask import Flask
+
+import priority_api
+import upload_cache
+from priority_reports import SHEET_COLUMNS
+from synthetic_export import export_bytes, generate_export
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(upload_cache, 'UPLOAD_STORE_DIR', str(tmp_path / 'uploads'))
+    monkeypatch.setattr(upload_cache, '_store', None)
+    upload_cache.clear_upload_cache()
+    server = Flask(__name__)
+    priority_api.register_routes(server)
+    return server.test_client()
+
+
+@pytest.fixture(scope='module')
+def export():
+    return export_bytes(generate_export(300, seed=3))
+
+
+def prioritize(client, data, query='', **headers):
+    return client.post(f'/api/prioritize{query}', data=data, headers={'Content-Type': 'text/csv', **headers})
+
+
+def test_json_rows_of_the_sheet(client, export):
+    response = prioritize(client, export, '?report=lawp&sheet=Accepted LAWP')
+    assert response.status_code == 200
+    body = response.get_json()
+    assert (body['report'], body['sheet']) == ('lawp', 'Accepted LAWP')
+    assert body['row_count'] == len(body['rows']) > 0
+    assert list(body['rows'][0]) == SHEET_COLUMNS
+    assert set(body['stats']) >= {'Accepted', 'Rejected'}
+
+
+def test_gzipped_export(client, export):
+    plain = prioritize(client, export).get_json()
+    assert prioritize(client, gzip.compress(export), **{'Content-Encoding': 'gzip'}).get_json()['rows'] == plain['rows']
+
+
+def test_arrow_output_matches_json(client, export):
+    pa = pytest.importorskip('pyarrow')
+    response = prioritize(client, export, '?format=arrow')
+    assert response.status_code == 200
+    assert response.mimetype == priority_api.ARROW_MIMETYPE
+    table = pa.ipc.open_stream(response.data).read_all()
+    rows = prioritize(client, export).get_json()['rows']
+    assert table.column_names == list(rows[0])
+    assert table.column('Request ID').to_pylist() == [row['Request ID'] for row in rows]
+
+
+@pytest.mark.parametrize('data, query, headers', [
+    (b'\x00\x01 not an export', '', {}),
+    (b'not gzip', '', {'Content-Encoding': 'gzip'}),
+    (b'', '', {}),
+    (None, '?report=weekly', {}),
+    (None, '?report=top&sheet=Accepted', {}),
+    (None, '?counter-filipina-live-in=many', {}),
+    (None, '?mv_urgency_days=1.5', {}),
+    (None, '?payment_added=Maybe', {}),
+])
+def test_bad_requests_are_400(client, export, data, query, headers):
+    response = prioritize(client, export if data is None else data, query, **headers)
+    assert response.status_code == 400
+    assert response.get_json()['error']
+
+
+def test_missing_columns_are_400(client):
+    data = export_bytes(generate_export(50).drop(columns=['Housemaid Status', 'Live out']))
+    response = prioritize(client, data)
+    assert response.status_code == 400
+    assert 'Housemaid Status' in response.get_json()['error']
+
+
+def test_oversized_exports_are_413(client, export, monkeypatch):
+    monkeypatch.setattr(priority_api, 'API_MAX_EXPORT_BYTES', len(export) - 1)
+    assert prioritize(client, export).status_code == 413
+    # Also once un-gzipped
+    assert prioritize(client, gzip.compress(export), **{'Content-Encoding': 'gzip'}).status_code == 413
+
+
+def test_server_errors_are_500(client, export, monkeypatch):
+    def fail(*args, **kwargs):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(priority_api, 'prioritize_report', fail)
+    response = prioritize(client, export)
+    assert response.status_code == 500
+    assert 'disk full' not in response.get_json()['error']
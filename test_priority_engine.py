@@ -0,0 +1,248 @@
+"""assign_priorities must give every row the priority the row-wise assign_priority gives it, and every report path the pandas report."""
+import datetime
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import priority_engine
+import upload_cache
+from priority_engine import (DAY_COLUMNS, PRIORITY_RULES, assign_priorities, assign_priority, compact_export, compile_rules, evaluate_rules,
+                             pushdown_rules, read_typed_export)
+from priority_reports import (CAPPED_PRIORITIES, REPORT_TYPES, build_report, build_report_chunked, prioritize_report,
+                              report_sheets)
+from synthetic_export import export_bytes, generate_export
+
+
+def random_frame(seed, rows=1500):
+    """Random rows over the values the rules look at, with missing and boundary day counts."""
+    rng = np.random.default_rng(seed)
+
+    def days(low, high):
+        values = rng.integers(low, high, rows).astype(float)
+        values[rng.random(rows) < 0.1] += 0.5
+        values[rng.random(rows) < 0.15] = np.nan
+        return values
+
+    return pd.DataFrame({
+        'Housemaid Type': rng.choice(['MV', 'CC', None], rows),
+        'Client Note': rng.choice(['SUPER_ANGRY_CLIENT', 'PRIORITIZE_VISA', '', None], rows),
+        'Housemaid Nationality': rng.choice(['Filipina', 'Ethiopian', 'Kenyan', 'Ugandan', 'Indian', None], rows),
+        'Housemaid Status': rng.choice(['LANDED_IN_DUBAI', 'PENDING', None], rows),
+        'Live out': rng.choice(['Yes', 'No', None], rows),
+        'Stage in Freedom Operator Page': rng.choice(['Pending COC', 'Pending Exit Permit', '', None], rows),
+        'Outcome': rng.choice(['LAWP', 'OTHER', None], rows),
+        'Attested GCC': rng.choice(['Yes', 'No'], rows),
+        'MFA': rng.choice(['Yes', 'No'], rows),
+        'GCC': rng.choice(['Yes', 'No'], rows),
+        'Flight in (days)': days(0, 16),
+        'Been in the table for (in days)': days(0, 20),
+        'Last day to stay in country in': days(-5, 15),
+    })
+
+
+def random_export(seed, rows=2000):
+    """A synthetic export with extra missing values, fractional days and days on the rule boundaries."""
+    rng = np.random.default_rng(seed)
+    df = generate_export(rows, seed)
+    for column in DAY_COLUMNS:
+        values = df[column].to_numpy(dtype=float)
+        values = np.where(rng.random(rows) < 0.2, rng.choice([2, 3, 4, 5, 7, 10, 11, 14], rows), values)
+        values = np.where(rng.random(rows) < 0.1, values + 0.5, values)
+        values[rng.random(rows) < rng.random()] = np.nan
+        df[column] = values
+    return df
+
+
+def random_settings(seed):
+    """Non-zero counters, low thresholds and random day parameters."""
+    rng = np.random.default_rng(seed + 1000)
+    priority_counters = {priority: int(rng.integers(0, 5)) for priority, _ in CAPPED_PRIORITIES.values()}
+    priority_thresholds = {name: int(rng.integers(0, 15)) for _, name in CAPPED_PRIORITIES.values()}
+    params = {'mv_urgency_days': int(rng.integers(0, 15)), 'last_day_in_country': int(rng.integers(-3, 10))}
+    return priority_counters, priority_thresholds, params
+
+
+def report_workbook(build, *args, **kwargs):
+    """Every sheet of the workbook build (build_report or build_report_chunked) writes, by sheet name."""
+    output = io.BytesIO()
+    build(*args, output=output, **kwargs)
+    return pd.read_excel(output, sheet_name=None)
+
+
+def assert_same_report(report_type, expected, actual):
+    """Two prioritize_report results give the same sheets, No-Africans copies included, and the same statistics.
+
+    Engines may type columns differently (e.g. categorical against string), so values are compared.
+    """
+    expected_sheets = report_sheets(REPORT_TYPES[report_type], *expected[:2])
+    sheets = report_sheets(REPORT_TYPES[report_type], *actual[:2])
+    assert list(sheets) == list(expected_sheets)
+    for sheet_name, sheet in expected_sheets.items():
+        pd.testing.assert_frame_equal(sheets[sheet_name].reset_index(drop=True), sheet.reset_index(drop=True),
+                                      check_dtype=False, check_categorical=False)
+    for name in ['Accepted', 'Rejected']:
+        pd.testing.assert_frame_equal(actual[2][name], expected[2][name], check_dtype=False)
+
+
+def row_wise_priorities(df, priority_counters, priority_thresholds, params):
+    """assign_priority applied row by row; priority_counters is updated in place, as it is by assign_priorities."""
+    return df.apply(lambda row: assign_priority(row, priority_counters, priority_thresholds, params['mv_urgency_days'],
+                                                params['last_day_in_country']), axis=1)
+
+
+@pytest.mark.parametrize('seed', range(6))
+def test_assign_priorities_matches_row_wise_on_random_frames(seed):
+    df = random_frame(seed)
+    priority_counters, priority_thresholds, params = random_settings(seed)
+    expected_counters = dict(priority_counters)
+    expected = row_wise_priorities(df, expected_counters, priority_thresholds, params)
+
+    counters = dict(priority_counters)
+    assert assign_priorities(df, counters, priority_thresholds, params).tolist() == expected.tolist()
+    assert counters == expected_counters
+
+
+@pytest.mark.parametrize('seed', range(8))
+def test_assign_priorities_matches_row_wise(seed):
+    df = random_export(seed)
+    priority_counters, priority_thresholds, params = random_settings(seed)
+    expected_counters = dict(priority_counters)
+    expected = row_wise_priorities(df, expected_counters, priority_thresholds, params)
+
+    counters = dict(priority_counters)
+    assert assign_priorities(df, counters, priority_thresholds, params).tolist() == expected.tolist()
+    assert counters == expected_counters
+
+    # The typed frame the reports prioritize gives the same priorities
+    counters = dict(priority_counters)
+    assert assign_priorities(compact_export(df), counters, priority_thresholds, params).tolist() == expected.tolist()
+    assert counters == expected_counters
+
+
+def test_assign_priorities_all_days_missing():
+    df = random_export(1, rows=300)
+    df[DAY_COLUMNS] = np.nan
+    priority_counters, priority_thresholds, params = random_settings(1)
+    expected = row_wise_priorities(df, dict(priority_counters), priority_thresholds, params)
+    assert assign_priorities(df, dict(priority_counters), priority_thresholds, params).tolist() == expected.tolist()
+
+
+def test_matched_rule_names_start_with_the_priority():
+    df = compact_export(random_export(2, rows=500))
+    priority_counters, priority_thresholds, params = random_settings(2)
+    sheets, _, _ = prioritize_report(df, 'combined', 'Combined', priority_counters, priority_thresholds, params)
+    for sheet in sheets:
+        first_rules = sheet['Matched rule names'].str.split('.', n=1).str[0].astype(int)
+        assert first_rules.tolist() == sheet['Priority number'].tolist()
+
+
+def test_compile_rules_hashes_a_spec_once(monkeypatch):
+    compiled = compile_rules(PRIORITY_RULES)
+    pushdown = compile_rules(pushdown_rules([6]))
+    monkeypatch.setattr(priority_engine, 'rules_hash', lambda rules: pytest.fail("spec hashed again"))
+    assert compile_rules(PRIORITY_RULES) is compiled
+    assert compile_rules(pushdown_rules([3, 6])) is pushdown
+
+
+def test_static_masks_are_shared_through_the_upload_store(tmp_path, monkeypatch):
+    monkeypatch.setattr(upload_cache, 'UPLOAD_STORE_DIR', str(tmp_path / 'uploads'))
+    monkeypatch.setattr(upload_cache, '_store', None)
+    decoded = export_bytes(random_export(3, rows=400))
+    params = {'mv_urgency_days': 5, 'last_day_in_country': 3}
+    evaluate_rules(upload_cache.parse_upload_bytes(decoded, 'export.csv', read_typed_export), params)
+
+    # Another process loads the upload from the store as a new DataFrame
+    upload_cache.clear_upload_cache()
+    df = upload_cache.parse_upload_bytes(decoded, 'export.csv', read_typed_export)
+    params['mv_urgency_days'] = 9
+    expected = evaluate_rules(df.copy(), params)
+    compiled = compile_rules()
+    evaluated = set()
+
+    def counted(index, condition):
+        def count(*args):
+            evaluated.add(index)
+            return condition(*args)
+        return count
+
+    monkeypatch.setitem(compiled, 'conditions', [counted(index, condition) for index, condition in enumerate(compiled['conditions'])])
+    evaluation = evaluate_rules(df, params)
+    assert evaluated == compiled['dynamic_conditions']
+    assert evaluation['uncapped_priority'].tolist() == expected['uncapped_priority'].tolist()
+    assert all(evaluation['masks'][priority].tolist() == mask.tolist() for priority, mask in expected['masks'].items())
+
+
+@pytest.mark.parametrize('payment_added', ['Yes', 'No', 'Combined'])
+@pytest.mark.parametrize('report_type', list(REPORT_TYPES))
+def test_chunked_report_matches_whole_report(report_type, payment_added):
+    decoded = export_bytes(random_export(4, rows=500))
+    priority_counters, priority_thresholds, params = random_settings(4)
+    expected = report_workbook(build_report, read_typed_export(decoded, 'export.csv'), report_type, payment_added,
+                               priority_counters, priority_thresholds, params)
+    chunked = report_workbook(build_report_chunked, io.BytesIO(decoded), report_type, payment_added,
+                              priority_counters, priority_thresholds, params, chunksize=97)
+    assert list(chunked) == list(expected)
+    for sheet_name, sheet in expected.items():
+        pd.testing.assert_frame_equal(chunked[sheet_name], sheet)
+
+
+@pytest.mark.parametrize('payment_added', ['Yes', 'No', 'Combined'])
+@pytest.mark.parametrize('report_type', list(REPORT_TYPES))
+def test_duckdb_engine_matches_pandas(report_type, payment_added):
+    pytest.importorskip('duckdb')
+    df = compact_export(random_export(5))
+    priority_counters, priority_thresholds, params = random_settings(5)
+    expected = prioritize_report(df, report_type, payment_added, priority_counters, priority_thresholds, params)
+    assert_same_report(report_type, expected, prioritize_report(df, report_type, payment_added, priority_counters, priority_thresholds,
+                                                                params, engine='duckdb'))
+
+
+@pytest.mark.parametrize('payment_added', ['Yes', 'No', 'Combined'])
+@pytest.mark.parametrize('report_type', list(REPORT_TYPES))
+def test_polars_engine_matches_pandas(report_type, payment_added):
+    pytest.importorskip('polars')
+    df = compact_export(random_export(6))
+    priority_counters, priority_thresholds, params = random_settings(6)
+    expected = prioritize_report(df, report_type, payment_added, priority_counters, priority_thresholds, params)
+    assert_same_report(report_type, expected, prioritize_report(df, report_type, payment_added, priority_counters, priority_thresholds,
+                                                                params, engine='polars'))
+
+
+def next_export(df, seed):
+    """df a day later: some rows changed, some gone and some new."""
+    rng = np.random.default_rng(seed)
+    df = df.copy()
+    changed = rng.random(len(df)) < 0.1
+    df.loc[changed, 'Housemaid Status'] = rng.choice(['LANDED_IN_DUBAI', 'WITH_CLIENT'], changed.sum())
+    df.loc[rng.random(len(df)) < 0.1, 'Been in the table for (in days)'] += 1
+    new = generate_export(200, seed).assign(**{'Request ID': lambda frame: frame['Request ID'] + len(df)})
+    return pd.concat([df[rng.random(len(df)) >= 0.05], new], ignore_index=True)
+
+
+@pytest.mark.parametrize('payment_added', ['Yes', 'No', 'Combined'])
+@pytest.mark.parametrize('report_type', list(REPORT_TYPES))
+def test_delta_report_matches_full_report(report_type, payment_added, tmp_path):
+    pytest.importorskip('pyarrow')
+    from priority_delta import prioritize_delta
+
+    previous = random_export(7)
+    df = compact_export(next_export(previous, 7))
+    priority_counters, priority_thresholds, params = random_settings(7)
+    prioritize_delta(compact_export(previous), report_type, payment_added, priority_counters, priority_thresholds, params,
+                     tmp_path, export_date=datetime.date(2024, 5, 1))
+    *delta, movers, reused = prioritize_delta(df, report_type, payment_added, priority_counters, priority_thresholds, params,
+                                              tmp_path, export_date=datetime.date(2024, 5, 2))
+    assert reused > 0 and movers is not None
+    assert_same_report(report_type, prioritize_report(df, report_type, payment_added, priority_counters, priority_thresholds, params),
+                       delta)
+
+
+def test_rule_statistics_are_logged_once_per_report(capsys):
+    decoded = export_bytes(random_export(8, rows=300))
+    prioritize_report(read_typed_export(decoded, 'export.csv'), 'lawp')
+    build_report_chunked(io.BytesIO(decoded), 'lawp', chunksize=97)
+    logged = capsys.readouterr().out
+    assert logged.count("Rule hits and timings for the lawp report:") == 2
+    assert "MV with Super Angry Client" in logged
@@ -0,0 +1,37 @@
+"""A report asked for again with equivalent settings is served from the artifact store without being built."""
+import pytest
+
+import report_artifacts
+from priority_reports import DEFAULT_COUNTERS, DEFAULT_PARAMS, DEFAULT_THRESHOLDS
+from report_artifacts import artifact_key, stored_report
+
+UPLOAD_KEY = ('0' * 64, 'csv', 'priority_engine.read_typed_export', None)
+
+
+@pytest.fixture(autouse=True)
+def artifact_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(report_artifacts, 'REPORT_ARTIFACTS_DIR', str(tmp_path / 'artifacts'))
+    monkeypatch.setattr(report_artifacts, '_store', None)
+
+
+def build(path):
+    with open(path, 'wb') as workbook:
+        workbook.write(b'workbook')
+    return 'combined_maids_docs_report.xlsx', {'Accepted': 1}
+
+
+def test_repeat_request_reuses_the_stored_report():
+    token, filename, stats = stored_report(artifact_key(UPLOAD_KEY, 'combined'), build)
+
+    # Defaults spelled out, and the upload key in the JSON list form the page's Store holds
+    key = artifact_key(list(UPLOAD_KEY), 'combined', 'No', dict(DEFAULT_COUNTERS), dict(DEFAULT_THRESHOLDS), dict(DEFAULT_PARAMS))
+    assert stored_report(key, lambda path: pytest.fail("report built again")) == (token, filename, stats)
+    workbook, _ = report_artifacts.open_artifact(token)
+    with workbook:
+        assert workbook.read() == b'workbook'
+
+
+def test_other_settings_build_another_report():
+    token = stored_report(artifact_key(UPLOAD_KEY, 'combined'), build)[0]
+    assert stored_report(artifact_key(UPLOAD_KEY, 'combined', params={'mv_urgency_days': 9}), build)[0] != token
+    assert stored_report(None, build)[0] != stored_report(None, build)[0]
@@ -0,0 +1,223 @@
+import base64
+import hashlib
+import io
+import os
+import threading
+import weakref
+from collections import OrderedDict
+
+import pandas as pd
+
+# Parsed uploads are kept per process and evicted least-recently-used once
+# their combined in-memory size goes over this budget.
+UPLOAD_CACHE_MAX_BYTES = int(os.environ.get('UPLOAD_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+
+# They are also pickled to a diskcache directory shared by every server worker and
+# background job, so an upload parsed by one is loaded by the others instead of being
+# parsed again. The store is trimmed to UPLOAD_STORE_MAX_BYTES (oldest stored first)
+# and an upload expires UPLOAD_STORE_MAX_AGE seconds after it was parsed. Loading a
+# pickle runs code, so the directory must be private to the app's user (see private_dir).
+# priority_engine keeps each upload's parameter-independent rule masks there as well.
+APP_DATA_DIR = os.environ.get('CHEKRI_DATA_DIR', os.path.join(os.path.expanduser('~'), '.chekri'))
+UPLOAD_STORE_DIR = os.environ.get('UPLOAD_STORE_DIR', os.path.join(APP_DATA_DIR, 'uploads'))
+UPLOAD_STORE_MAX_BYTES = int(os.environ.get('UPLOAD_STORE_MAX_BYTES', 2 * 1024 * 1024 * 1024))
+UPLOAD_STORE_MAX_AGE = int(os.environ.get('UPLOAD_STORE_MAX_AGE', 24 * 60 * 60))
+
+_parsed_uploads = OrderedDict()
+_cache_lock = threading.Lock()
+_cache_bytes = 0
+# upload_key of every DataFrame this process parsed or loaded: {id(df): (weakref to df, key)}
+_upload_keys = {}
+_store = None
+_store_pid = None
+
+
+def decode_contents(contents):
+    """Decode a dcc.Upload data URL into the raw file bytes."""
+    content_type, content_string = contents.split(',')
+    return base64.b64decode(content_string)
+
+
+class MissingColumnsError(KeyError):
+    """An upload lacks columns the page requires."""
+
+    def __init__(self, columns):
+        super().__init__(columns)
+        self.columns = columns
+
+    def __str__(self):
+        return f"The following required columns are missing: {', '.join(self.columns)}"
+
+
+def select_columns(columns):
+    """usecols for pd.read_excel/read_csv that loads only the given columns (all of them for None).
+
+    Unlike a list, a callable does not make pandas fail on absent columns, so
+    check_columns can report every missing one at once.
+    """
+    if columns is None:
+        return None
+    wanted = set(columns)
+    return lambda column: column in wanted
+
+
+def check_columns(df, columns):
+    """Raise MissingColumnsError if any of columns is not in df."""
+    missing = [column for column in columns or [] if column not in df.columns]
+    if missing:
+        raise MissingColumnsError(missing)
+    return df
+
+
+def read_export(decoded, filename, columns=None):
+    """Read a maid export: an Excel workbook, a UTF-16 tab-separated CSV/TSV or JSON records.
+
+    With columns, only those columns are parsed and a missing one raises
+    MissingColumnsError.
+    """
+    if 'xlsx' in filename:
+        df = pd.read_excel(io.BytesIO(decoded), usecols=select_columns(columns))
+    elif 'csv' in filename or 'tsv' in filename:
+        # Read as TSV using '\t' as the delimiter
+        df = pd.read_csv(io.StringIO(decoded.decode('utf-16')), delimiter='\t', skip_blank_lines=True, usecols=select_columns(columns))
+    elif 'json' in filename:
+        # A list of row objects keyed by column name, as sent to the prioritization API
+        df = pd.read_json(io.BytesIO(decoded), orient='records', convert_dates=False)
+        if columns is not None:
+            df = df[[column for column in df.columns if column in set(columns)]]
+    else:
+        raise ValueError(f"Unsupported file type: {filename}")
+    return check_columns(df, columns)
+
+
+def read_export_chunks(source, columns=None, chunksize=100_000):
+    """Read a UTF-16 tab-separated export from a binary file object in DataFrames of chunksize rows.
+
+    The file is decoded as it is read instead of into one string up front.
+    Chunk indexes continue from one chunk to the next, like one read_export.
+    """
+    text = io.TextIOWrapper(source, encoding='utf-16')
+    reader = pd.read_csv(text, delimiter='\t', skip_blank_lines=True, usecols=select_columns(columns), chunksize=chunksize)
+    with reader:
+        for chunk in reader:
+            yield check_columns(chunk, columns)
+
+
+def upload_key(decoded, filename, read=read_export, columns=None):
+    """Cache key for an upload: a hash of its bytes plus the file kind, the reader used and the columns read."""
+    digest = hashlib.sha256(decoded).hexdigest()
+    kind = ('xlsx' if 'xlsx' in filename else 'csv' if 'csv' in filename or 'tsv' in filename
+            else 'json' if 'json' in filename else os.path.splitext(filename)[1])
+    return digest, kind, f"{read.__module__}.{read.__qualname__}", None if columns is None else tuple(sorted(columns))
+
+
+def _evict(max_bytes):
+    global _cache_bytes
+    while _parsed_uploads and _cache_bytes > max_bytes:
+        _, (_, size) = _parsed_uploads.popitem(last=False)
+        _cache_bytes -= size
+
+
+def private_dir(path):
+    """Create path readable and writable only by this user (0700) and return it.
+
+    An existing directory owned by someone else is refused rather than trusted,
+    and one that others can get into is closed off.
+    """
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    status = os.stat(path)
+    if status.st_uid != os.getuid():
+        raise PermissionError(f"{path} is owned by another user")
+    if status.st_mode & 0o077:
+        os.chmod(path, 0o700)
+    return path
+
+
+def upload_store():
+    """The process's handle on the shared store of parsed uploads, opened on first use.
+
+    A forked background job opens its own handle instead of reusing the SQLite
+    connection it inherited from the server worker.
+    """
+    global _store, _store_pid
+    if _store is None or _store_pid != os.getpid():
+        import diskcache  # only needed once an upload is parsed
+
+        _store = diskcache.Cache(private_dir(UPLOAD_STORE_DIR), size_limit=UPLOAD_STORE_MAX_BYTES,
+                                 eviction_policy='least-recently-stored')
+        _store_pid = os.getpid()
+    return _store
+
+
+def _remember(key, df):
+    """Keep df in this process's cache under key; returns df."""
+    global _cache_bytes
+    if upload_key_of(df) is None:
+        _upload_keys[id(df)] = (weakref.ref(df), key)
+        weakref.finalize(df, _upload_keys.pop, id(df), None)
+    size = int(df.memory_usage(deep=True).sum())
+    with _cache_lock:
+        if key not in _parsed_uploads and size <= UPLOAD_CACHE_MAX_BYTES:
+            _parsed_uploads[key] = (df, size)
+            _cache_bytes += size
+            _evict(UPLOAD_CACHE_MAX_BYTES)
+    return df
+
+
+def _cached(key):
+    """The DataFrame for key from this process's cache or else the shared store, or None."""
+    with _cache_lock:
+        if key in _parsed_uploads:
+            _parsed_uploads.move_to_end(key)
+            return _parsed_uploads[key][0]
+    df = upload_store().get(key)
+    return None if df is None else _remember(key, df)
+
+
+def upload_key_of(df):
+    """The upload_key df was parsed or loaded under in this process, or None for any other DataFrame.
+
+    Slices and copies of an upload are other DataFrames and have no key.
+    """
+    entry = _upload_keys.get(id(df))
+    return entry[1] if entry is not None and entry[0]() is df else None
+
+
+def parse_upload_bytes(decoded, filename, read=read_export, columns=None):
+    """Return the DataFrame for an upload, parsing it only the first time its bytes are seen.
+
+    columns, if given, is passed on to read so only those columns are loaded.
+    The cached DataFrame is shared between callers and must be treated as
+    read-only; filter or copy it before changing columns. Uploads parsed by
+    another process are loaded from the shared store.
+    """
+    key = upload_key(decoded, filename, read, columns)
+    df = _cached(key)
+    if df is not None:
+        return df
+
+    df = read(decoded, filename) if columns is None else read(decoded, filename, columns)
+    upload_store().set(key, df, expire=UPLOAD_STORE_MAX_AGE)
+    return _remember(key, df)
+
+
+def cached_upload(key):
+    """The parsed DataFrame for an upload_key (as a tuple or its JSON list form), or None once evicted.
+
+    The upload may have been parsed by any process sharing the upload store.
+    """
+    digest, kind, reader, columns = key
+    return _cached((digest, kind, reader, None if columns is None else tuple(columns)))
+
+
+def parse_upload(contents, filename, read=read_export, columns=None):
+    """parse_upload_bytes for a dcc.Upload data URL."""
+    return parse_upload_bytes(decode_contents(contents), filename, read, columns)
+
+
+def clear_upload_cache():
+    """Empty this process's cache; the shared store is left as it is."""
+    global _cache_bytes
+    with _cache_lock:
+        _parsed_uploads.clear()
+        _cache_bytes = 0
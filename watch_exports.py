@@ -0,0 +1,210 @@
+"""Watched-folder pipeline: prioritize and distribute every export dropped into a directory.
+
+    python watch_exports.py drop/ --output-dir out/ --pc "PC 1=<sheet id or URL>" --pc "PC 9=<sheet id>"
+
+Each new .xlsx/.csv/.tsv/.json export in the drop directory goes through the
+Prioritization page's engine and then the Quota Distribution page's
+round-robin split. The report workbook is written to the output directory,
+and each PC's share goes to its Google Sheet. With --offline (or no --pc), and
+for any Sheet that fails, the shares go to a local distribution workbook
+instead; --offline still splits between the --pc PCs. Stage timings and the outcome of every file are appended to
+pipeline_log.jsonl in the output directory, and the export is moved to
+processed/ or failed/ so it is picked up only once. With --snapshot-dir each
+export is diffed against the previous day's export of the same source, named
+by its file name without the date stamp (see priority_delta), and the report
+gets a Movers sheet.
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import time
+from datetime import datetime
+
+import pandas as pd
+
+from prioritize_cli import EXPORT_EXTENSIONS, add_settings_arguments, settings_from_args
+from priority_engine import read_typed_export
+from priority_delta import export_source, prioritize_delta
+from priority_reports import EXPORT_COLUMNS, REPORT_ENGINE, REPORT_TYPES, SNAPSHOT_DIR, prioritize_report, report_sheets, write_report_file
+from quota_distribution_remote import create_output_file, distribute_maids, extract_sheet_id, filter_blank_entries, write_to_google_sheet
+
+PIPELINE_LOG = 'pipeline_log.jsonl'
+
+
+class StageTimer:
+    """Record the wall time of each named stage of one file's run."""
+
+    def __init__(self):
+        self.timings = {}
+
+    def __call__(self, stage, func, *args):
+        start = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            self.timings[stage] = round(time.perf_counter() - start, 3)
+
+
+def parse_pc(value):
+    """'PC name=sheet id or URL' as given to --pc."""
+    name, sep, link = value.partition('=')
+    sheet_id = extract_sheet_id(link.strip()) if sep else None
+    if not sheet_id:
+        raise argparse.ArgumentTypeError(f"Expected 'PC name=Google Sheet URL or ID', got {value!r}")
+    return {'name': name.strip(), 'link': sheet_id}
+
+
+def ready_exports(drop_dir, seen):
+    """Exports in drop_dir whose size and modification time have not changed since the last poll.
+
+    seen maps path -> (size, mtime) from the previous poll and is updated in
+    place, so a file that is still being copied in waits for the next poll.
+    """
+    ready = []
+    current = {}
+    for entry in os.scandir(drop_dir):
+        if not entry.is_file() or not entry.name.lower().endswith(EXPORT_EXTENSIONS) or entry.name.startswith('~$'):
+            continue
+        stat = entry.stat()
+        current[entry.path] = (stat.st_size, stat.st_mtime)
+        if seen.get(entry.path) == current[entry.path]:
+            ready.append(entry.path)
+    seen.clear()
+    seen.update(current)
+    return sorted(ready)
+
+
+def write_distribution(distribution, pcs, output_path, offline=False):
+    """Write each PC's share to its Google Sheet, or all shares to a local workbook.
+
+    Returns {PC name: {'maids': count, 'written': 'sheet' or 'local'}}. Shares
+    whose Sheet could not be written are saved in the local workbook instead,
+    so nothing is lost when offline. With offline, no Sheet is written and
+    every PC's share goes to the local workbook.
+    """
+    outcomes = {}
+    local = {}
+    if pcs:
+        for (pc_key, maids), pc in zip(distribution.items(), pcs):
+            success = False
+            if not offline:
+                data = pd.DataFrame(maids, columns=['Priority number', 'id', 'name', 'Nationality'])
+                success = write_to_google_sheet(pc['link'], data)
+            outcomes[pc['name']] = {'maids': len(maids), 'written': 'sheet' if success else 'local'}
+            if not success:
+                local[pc_key] = maids
+    else:
+        local = distribution
+        outcomes = {pc_key: {'maids': len(maids), 'written': 'local'} for pc_key, maids in distribution.items()}
+
+    if local:
+        with open(output_path, 'wb') as f:
+            f.write(create_output_file(local, 'quota').getvalue())
+    return outcomes
+
+
+def process_export(path, args, pcs):
+    """Run one export through parse, prioritize, report, distribute and write; return its log record."""
+    timer = StageTimer()
+    record = {'file': os.path.basename(path), 'started': datetime.now().isoformat(timespec='seconds'), 'stages': timer.timings}
+    stem = os.path.splitext(os.path.basename(path))[0]
+    report = REPORT_TYPES[args.report]
+    priority_counters, priority_thresholds, params = settings_from_args(args)
+    try:
+        with open(path, 'rb') as f:
+            decoded = f.read()
+        df = timer('parse', read_typed_export, decoded, os.path.basename(path), EXPORT_COLUMNS)
+        extra_sheets = {}
+        if args.snapshot_dir:
+            sheets, non_african, _, movers, record['reused'] = timer('prioritize', prioritize_delta, df, args.report, args.payment_added,
+                                                                     priority_counters, priority_thresholds, params, args.snapshot_dir,
+                                                                     source=export_source(path))
+            if movers is not None:
+                extra_sheets['Movers'] = movers
+                record['movers'] = {change: int(count) for change, count in movers['Change'].value_counts().items()}
+        else:
+            sheets, non_african, _ = timer('prioritize', prioritize_report, df, args.report, args.payment_added,
+                                           priority_counters, priority_thresholds, params, REPORT_ENGINE)
+
+        timer('report', write_report_file, report, sheets, non_african, os.path.join(args.output_dir, f"{stem}_{report['filename']}"),
+              extra_sheets)
+
+        sheet = report_sheets(report, sheets, non_african)[report['sheets'][args.sheet]]
+        maids = filter_blank_entries(sheet)
+        distribution = timer('distribute', distribute_maids, maids, len(pcs) or args.num_pcs)
+        distribution_path = os.path.join(args.output_dir, f"{stem}_quota_distribution.xlsx")
+        record['pcs'] = timer('write', write_distribution, distribution, pcs, distribution_path, args.offline)
+
+        record['rows'] = len(df)
+        record['distributed'] = len(maids)
+        # Partial when some Google Sheet writes fell back to the local workbook
+        record['outcome'] = ('partial' if pcs and not args.offline and any(pc['written'] == 'local' for pc in record['pcs'].values())
+                             else 'ok')
+    except Exception as e:
+        record['outcome'] = 'failed'
+        record['error'] = str(e)
+    return record
+
+
+def handle_export(path, args, pcs):
+    record = process_export(path, args, pcs)
+    with open(os.path.join(args.output_dir, PIPELINE_LOG), 'a') as f:
+        f.write(json.dumps(record) + '\n')
+
+    target_dir = os.path.join(args.drop_dir, 'failed' if record['outcome'] == 'failed' else 'processed')
+    os.makedirs(target_dir, exist_ok=True)
+    shutil.move(path, os.path.join(target_dir, os.path.basename(path)))
+
+    timings = ', '.join(f"{stage} {seconds:.2f}s" for stage, seconds in record['stages'].items())
+    print(f"{record['file']}: {record['outcome']} ({timings}){' - ' + record['error'] if 'error' in record else ''}")
+    return record
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Prioritize and distribute every maid export dropped into a directory.")
+    parser.add_argument('drop_dir', help="Directory new exports (.xlsx, UTF-16 .csv/.tsv or .json) are dropped into")
+    parser.add_argument('--output-dir', default='.', help="Directory for report workbooks, offline distributions and the pipeline log")
+    parser.add_argument('--report', choices=list(REPORT_TYPES), default='combined', help="Report to prioritize each export with")
+    parser.add_argument('--sheet', type=int, default=2, choices=range(6),
+                        help="Index of the report sheet to distribute, as in REPORT_TYPES (default: 2, the Combined sheet)")
+    add_settings_arguments(parser)
+    parser.add_argument('--pc', dest='pcs', action='append', type=parse_pc, default=[],
+                        help="'PC name=Google Sheet URL or ID' to distribute to, may be repeated")
+    parser.add_argument('--num-pcs', type=int, default=2, help="PCs to split into when no --pc is given")
+    parser.add_argument('--offline', action='store_true',
+                        help="Write local distribution workbooks instead of Google Sheets, still split between the --pc PCs")
+    parser.add_argument('--snapshot-dir', default=SNAPSHOT_DIR,
+                        help="Keep a daily snapshot of each export source here, diff each export against its source's "
+                             "snapshot from an earlier day and add a Movers sheet (default: $PRIORITY_SNAPSHOT_DIR)")
+    parser.add_argument('--interval', type=float, default=10, help="Seconds between polls of the drop directory")
+    parser.add_argument('--once', action='store_true', help="Process the exports already in the drop directory, then exit")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    os.makedirs(args.drop_dir, exist_ok=True)
+    os.makedirs(args.output_dir, exist_ok=True)
+    pcs = args.pcs
+
+    seen = {}
+    if args.once:
+        # Every file is taken as complete; there is no later poll to wait for
+        ready_exports(args.drop_dir, seen)
+        records = [handle_export(path, args, pcs) for path in ready_exports(args.drop_dir, seen)]
+        return 1 if any(record['outcome'] == 'failed' for record in records) else 0
+
+    print(f"Watching {args.drop_dir} every {args.interval:g}s")
+    try:
+        while True:
+            for path in ready_exports(args.drop_dir, seen):
+                handle_export(path, args, pcs)
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())